@@ -31,10 +31,25 @@ import tarfile
 import tempfile
 import atexit
 import shutil
+import heapq
+import traceback
+import multiprocessing
 try:
 	from StringIO import StringIO
 except ImportError:
 	from io import StringIO
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
+
+# Use the libyaml based loader when available, it's an order of magnitude
+# faster than the pure Python one.  Metadata files are plain YAML so a
+# safe loader is sufficient.
+try:
+	from yaml import CSafeLoader as YamlLoader
+except ImportError:
+	from yaml import SafeLoader as YamlLoader
 
 #
 #  Globals holding scanned metadata, helper snippets, etc
@@ -110,6 +125,13 @@ header_tag_order = doc_tag_order
 # Helper headers snippets.
 helper_snippets = None
 
+# Parsed YAML metadata files, see load_metadata_snapshot().  Maps a path
+# relative to the metadata directory to a [ mtime, size, doc ] triple.
+# Bump the version when the snapshot format changes.
+metadata_snapshot_version = 1
+metadata_snapshot = {}
+metadata_snapshot_dirty = False
+
 # Assume these provides come from outside.
 assumed_provides = {
 	'DUK_SINGLE_FILE': True,         # compiling Duktape from a single source file (duktape.c) version
@@ -155,6 +177,53 @@ def get_auto_delete_tempdir():
 	atexit.register(_f, tmpdir)
 	return tmpdir
 
+# Load a previously saved metadata snapshot.  A missing or unreadable
+# snapshot is not an error, the YAML files are then just parsed normally.
+def load_metadata_snapshot(filename):
+	global metadata_snapshot
+
+	metadata_snapshot = {}
+	if not os.path.isfile(filename):
+		return
+	try:
+		with open(filename, 'rb') as f:
+			doc = pickle.load(f)
+		if doc.get('version') == metadata_snapshot_version:
+			metadata_snapshot = doc['files']
+	except:
+		print('WARNING: failed to load metadata snapshot %s, ignoring' % filename)
+
+# Write the metadata snapshot if any entries were added or updated.
+# Entries for files which no longer exist are dropped.
+def save_metadata_snapshot(filename, meta_dir):
+	if not metadata_snapshot_dirty:
+		return
+	files = {}
+	for k in metadata_snapshot.keys():
+		if os.path.isfile(os.path.join(meta_dir, k)):
+			files[k] = metadata_snapshot[k]
+	tmpfn = filename + '.tmp%d' % os.getpid()
+	with open(tmpfn, 'wb') as f:
+		pickle.dump({ 'version': metadata_snapshot_version, 'files': files }, f, pickle.HIGHEST_PROTOCOL)
+	os.rename(tmpfn, filename)  # atomic on POSIX, parallel runs are OK
+
+# Load a YAML metadata file, using the snapshot if the file's mtime and
+# size are unchanged.
+def load_metadata_yaml(meta_dir, relpath):
+	global metadata_snapshot_dirty
+
+	filename = os.path.join(meta_dir, relpath)
+	st = os.stat(filename)
+	ent = metadata_snapshot.get(relpath)
+	if ent is not None and ent[0] == st.st_mtime and ent[1] == st.st_size:
+		return ent[2]
+
+	with open(filename, 'rb') as f:
+		doc = yaml.load(f, Loader=YamlLoader)
+	metadata_snapshot[relpath] = [ st.st_mtime, st.st_size, doc ]
+	metadata_snapshot_dirty = True
+	return doc
+
 def strip_comments_from_lines(lines):
 	# Not exact but close enough.  Doesn't handle string literals etc,
 	# but these are not a concrete issue for scanning preprocessor
@@ -358,24 +427,40 @@ class FileBuilder:
 	def fill_dependencies_for_snippets(self, idx_deps):
 		fill_dependencies_for_snippets(self.vals, idx_deps)
 
-# Insert missing define dependencies into index 'idx_deps' repeatedly
-# until no unsatisfied dependencies exist.  This is used to pull in
-# the required DUK_F_xxx helper defines without pulling them all in.
-# The resolution mechanism also ensures dependencies are pulled in the
-# correct order, i.e. DUK_F_xxx helpers may depend on each other (as
-# long as there are no circular dependencies).
+# Insert missing define dependencies into index 'idx_deps'.  This is used
+# to pull in the required DUK_F_xxx helper defines without pulling them all
+# in.  The resolution mechanism also ensures dependencies are pulled in the
+# correct order, i.e. DUK_F_xxx helpers may depend on each other (as long
+# as there are no circular dependencies).
 #
-# XXX: this can be simplified a lot
+# The dependency graph is built using define-to-snippet indexes and then
+# serialized with a topological sort.  When multiple snippets are ready,
+# the one added to the graph first is emitted first so that the output
+# order is stable.
 def fill_dependencies_for_snippets(snippets, idx_deps):
 	# graph[A] = [ B, ... ] <-> B, ... provide something A requires.
 	graph = {}
 	snlist = []
+	snindex = {}    # snippet -> index in snlist
+	provided = {}   # define -> [ snippets in snlist providing define ]
 	resolved = []   # for printing only
 
+	# First helper snippet providing each define.  Some DUK_F_xxx files
+	# provide multiple defines, so we don't necessarily know the snippet
+	# filename here.
+	helper_provides = {}
+	for sn2 in helper_snippets:
+		for k in sn2.provides.keys():
+			if not helper_provides.has_key(k):
+				helper_provides[k] = sn2
+
 	def add(sn):
-		if sn in snlist:
+		if snindex.has_key(sn):
 			return  # already present
+		snindex[sn] = len(snlist)
 		snlist.append(sn)
+		for k in sn.provides.keys():
+			provided.setdefault(k, []).append(sn)
 
 		to_add = []
 
@@ -383,37 +468,23 @@ def fill_dependencies_for_snippets(snippets, idx_deps):
 			if assumed_provides.has_key(k):
 				continue
 
-			found = False
-			for sn2 in snlist:
-				if sn2.provides.has_key(k):
-					if not graph.has_key(sn):
-						graph[sn] = []
-					graph[sn].append(sn2)
-					found = True  # at least one other node provides 'k'
-
-			if not found:
-				#print('Resolving %r' % k)
-				resolved.append(k)
-
-				# Find a header snippet which provides the missing define.
-				# Some DUK_F_xxx files provide multiple defines, so we don't
-				# necessarily know the snippet filename here.
-
-				sn_req = None
-				for sn2 in helper_snippets:
-					if sn2.provides.has_key(k):
-						sn_req = sn2
-						break
-				if sn_req is None:
-					print(repr(sn.lines))
-					raise Exception('cannot resolve missing require: %r' % k)
-
-				# Snippet may have further unresolved provides; add recursively
-				to_add.append(sn_req)
-
-				if not graph.has_key(sn):
-					graph[sn] = []
-				graph[sn].append(sn_req)
+			providers = provided.get(k)
+			if providers:
+				# At least one snippet already in the graph provides 'k'.
+				graph.setdefault(sn, []).extend(providers)
+				continue
+
+			#print('Resolving %r' % k)
+			resolved.append(k)
+
+			sn_req = helper_provides.get(k)
+			if sn_req is None:
+				print(repr(sn.lines))
+				raise Exception('cannot resolve missing require: %r' % k)
+
+			# Snippet may have further unresolved provides; add recursively
+			to_add.append(sn_req)
+			graph.setdefault(sn, []).append(sn_req)
 
 		for sn in to_add:
 			add(sn)
@@ -423,39 +494,48 @@ def fill_dependencies_for_snippets(snippets, idx_deps):
 	for sn in snippets:
 		add(sn)
 
-	# Figure out fill-ins by looking for snippets not in original
-	# list and without any unserialized dependent nodes.
+	# Topological sort of fill-ins (snippets not in original list).
+	# Original snippets count as already handled.
 	handled = {}
 	for sn in snippets:
 		handled[sn] = True
-	keepgoing = True
-	while keepgoing:
-		keepgoing = False
-		for sn in snlist:
-			if handled.has_key(sn):
-				continue
-
-			success = True
-			for dep in graph.get(sn, []):
-				if not handled.has_key(dep):
-					success = False
-			if success:
-				snippets.insert(idx_deps, sn)
-				idx_deps += 1
-				snippets.insert(idx_deps, Snippet([ '' ]))
-				idx_deps += 1
-				handled[sn] = True
-				keepgoing = True
-				break
-
-	# XXX: detect and handle loops cleanly
+	pending_count = {}  # snippet -> number of unhandled dependencies
+	dependents = {}     # snippet -> [ snippets depending on it ]
+	ready = []          # heap of snlist indices
 	for sn in snlist:
 		if handled.has_key(sn):
 			continue
-		print('UNHANDLED KEY')
-		print('PROVIDES: %r' % sn.provides)
-		print('REQUIRES: %r' % sn.requires)
-		print('\n'.join(sn.lines))
+		deps = {}
+		for dep in graph.get(sn, []):
+			if not handled.has_key(dep):
+				deps[dep] = True
+		pending_count[sn] = len(deps)
+		for dep in deps.keys():
+			dependents.setdefault(dep, []).append(sn)
+		if len(deps) == 0:
+			heapq.heappush(ready, snindex[sn])
+
+	while len(ready) > 0:
+		sn = snlist[heapq.heappop(ready)]
+		snippets.insert(idx_deps, sn)
+		idx_deps += 1
+		snippets.insert(idx_deps, Snippet([ '' ]))
+		idx_deps += 1
+		handled[sn] = True
+		for sn2 in dependents.get(sn, []):
+			pending_count[sn2] -= 1
+			if pending_count[sn2] == 0:
+				heapq.heappush(ready, snindex[sn2])
+
+	# Anything left is part of (or depends on) a dependency cycle.
+	unhandled = [ sn for sn in snlist if not handled.has_key(sn) ]
+	if len(unhandled) > 0:
+		for sn in unhandled:
+			print('UNHANDLED SNIPPET')
+			print('PROVIDES: %r' % sn.provides)
+			print('REQUIRES: %r' % sn.requires)
+			print('\n'.join(sn.lines))
+		raise Exception('circular dependency in helper snippets, %d snippets cannot be ordered' % len(unhandled))
 
 #	print(repr(graph))
 #	print(repr(snlist))
@@ -496,62 +576,60 @@ def remove_duplicate_newlines(x):
 			ret.append(line)
 	return '\n'.join(ret)
 
-def scan_use_defs(dirname):
+def scan_use_defs(meta_dir, subdir):
 	global use_defs, use_defs_list
 	use_defs = {}
 	use_defs_list = []
 
-	for fn in os.listdir(dirname):
+	for fn in os.listdir(os.path.join(meta_dir, subdir)):
 		root, ext = os.path.splitext(fn)
 		if not root.startswith('DUK_USE_') or ext != '.yaml':
 			continue
-		with open(os.path.join(dirname, fn), 'rb') as f:
-			doc = yaml.load(f)
-			if doc.get('example', False):
-				continue
-			if doc.get('unimplemented', False):
-				print('WARNING: unimplemented: %s' % fn)
-				continue
-			dockeys = doc.keys()
-			for k in dockeys:
-				if not k in allowed_use_meta_keys:
-					print('WARNING: unknown key %s in metadata file %s' % (k, fn))
-			for k in required_use_meta_keys:
-				if not k in dockeys:
-					print('WARNING: missing key %s in metadata file %s' % (k, fn))
+		doc = load_metadata_yaml(meta_dir, os.path.join(subdir, fn))
+		if doc.get('example', False):
+			continue
+		if doc.get('unimplemented', False):
+			print('WARNING: unimplemented: %s' % fn)
+			continue
+		dockeys = doc.keys()
+		for k in dockeys:
+			if not k in allowed_use_meta_keys:
+				print('WARNING: unknown key %s in metadata file %s' % (k, fn))
+		for k in required_use_meta_keys:
+			if not k in dockeys:
+				print('WARNING: missing key %s in metadata file %s' % (k, fn))
 
-			use_defs[doc['define']] = doc
+		use_defs[doc['define']] = doc
 
 	keys = use_defs.keys()
 	keys.sort()
 	for k in keys:
 		use_defs_list.append(use_defs[k])
 
-def scan_opt_defs(dirname):
+def scan_opt_defs(meta_dir, subdir):
 	global opt_defs, opt_defs_list
 	opt_defs = {}
 	opt_defs_list = []
 
-	for fn in os.listdir(dirname):
+	for fn in os.listdir(os.path.join(meta_dir, subdir)):
 		root, ext = os.path.splitext(fn)
 		if not root.startswith('DUK_OPT_') or ext != '.yaml':
 			continue
-		with open(os.path.join(dirname, fn), 'rb') as f:
-			doc = yaml.load(f)
-			if doc.get('example', False):
-				continue
-			if doc.get('unimplemented', False):
-				print('WARNING: unimplemented: %s' % fn)
-				continue
-			dockeys = doc.keys()
-			for k in dockeys:
-				if not k in allowed_opt_meta_keys:
-					print('WARNING: unknown key %s in metadata file %s' % (k, fn))
-			for k in required_opt_meta_keys:
-				if not k in dockeys:
-					print('WARNING: missing key %s in metadata file %s' % (k, fn))
+		doc = load_metadata_yaml(meta_dir, os.path.join(subdir, fn))
+		if doc.get('example', False):
+			continue
+		if doc.get('unimplemented', False):
+			print('WARNING: unimplemented: %s' % fn)
+			continue
+		dockeys = doc.keys()
+		for k in dockeys:
+			if not k in allowed_opt_meta_keys:
+				print('WARNING: unknown key %s in metadata file %s' % (k, fn))
+		for k in required_opt_meta_keys:
+			if not k in dockeys:
+				print('WARNING: missing key %s in metadata file %s' % (k, fn))
 
-			opt_defs[doc['define']] = doc
+		opt_defs[doc['define']] = doc
 
 	keys = opt_defs.keys()
 	keys.sort()
@@ -569,11 +647,10 @@ def scan_use_tags():
 	use_tags_list = use_tags.keys()
 	use_tags_list.sort()
 
-def scan_tags_meta(filename):
+def scan_tags_meta(meta_dir, relpath):
 	global tags_meta
 
-	with open(filename, 'rb') as f:
-		tags_meta = yaml.load(f)
+	tags_meta = load_metadata_yaml(meta_dir, relpath)
 
 def scan_helper_snippets(dirname):  # DUK_F_xxx snippets
 	global helper_snippets
@@ -798,7 +875,7 @@ def get_forced_options(opts):
 	# overridden by a more specific one).
 	forced_opts = {}
 	for val in opts.force_options_yaml:
-		doc = yaml.load(StringIO(val))
+		doc = yaml.load(StringIO(val), Loader=YamlLoader)
 		for k in doc.keys():
 			if use_defs.has_key(k):
 				pass  # key is known
@@ -1037,14 +1114,11 @@ def generate_duk_config_header(opts, meta_dir):
 	forced_opts = get_forced_options(opts)
 
 	platforms = None
-	with open(os.path.join(meta_dir, 'platforms.yaml'), 'rb') as f:
-		platforms = yaml.load(f)
+	platforms = load_metadata_yaml(meta_dir, 'platforms.yaml')
 	architectures = None
-	with open(os.path.join(meta_dir, 'architectures.yaml'), 'rb') as f:
-		architectures = yaml.load(f)
+	architectures = load_metadata_yaml(meta_dir, 'architectures.yaml')
 	compilers = None
-	with open(os.path.join(meta_dir, 'compilers.yaml'), 'rb') as f:
-		compilers = yaml.load(f)
+	compilers = load_metadata_yaml(meta_dir, 'compilers.yaml')
 
 	# XXX: indicate feature option support, sanity checks enabled, etc
 	# in general summary of options, perhaps genconfig command line?
@@ -1398,7 +1472,9 @@ def generate_duk_config_header(opts, meta_dir):
 #  Main
 #
 
-def main():
+# Parse genconfig command line arguments.  Also used for parsing batch
+# items, so must not have side effects other than reading option files.
+def parse_options(argv):
 	# Forced options from multiple sources are gathered into a shared list
 	# so that the override order remains the same as on the command line.
 	force_options_yaml = []
@@ -1438,6 +1514,7 @@ def main():
 
 	commands = [
 		'duk-config-header',
+		'duk-config-header-batch',
 		'feature-documentation',
 		'config-documentation'
 	]
@@ -1448,6 +1525,7 @@ def main():
 	)
 
 	parser.add_option('--metadata', dest='metadata', default=None, help='metadata directory or metadata tar.gz file')
+	parser.add_option('--metadata-snapshot', dest='metadata_snapshot', default=None, help='file for caching parsed YAML metadata between runs, entries are invalidated based on file mtime and size (optional)')
 	parser.add_option('--output', dest='output', default=None, help='output filename for C header or RST documentation file')
 	parser.add_option('--platform', dest='platform', default=None, help='platform (for "barebones-header" command)')
 	parser.add_option('--compiler', dest='compiler', default=None, help='compiler (for "barebones-header" command)')
@@ -1474,7 +1552,85 @@ def main():
 	parser.add_option('--git-commit', dest='git_commit', default=None, help='git commit hash to be included in header comments')
 	parser.add_option('--git-describe', dest='git_describe', default=None, help='git describe string to be included in header comments')
 	parser.add_option('--git-branch', dest='git_branch', default=None, help='git branch string to be included in header comments')
-	(opts, args) = parser.parse_args()
+	parser.add_option('--batch', dest='batch', default=None, help='JSON lines file (or "-" for stdin) for "duk-config-header-batch" command, each line is a list of genconfig arguments for one header, e.g. ["--output", "duk_config.h", "-DDUK_USE_FASTINT"]')
+	parser.add_option('--jobs', dest='jobs', type='int', default=multiprocessing.cpu_count(), help='number of parallel processes for "duk-config-header-batch" command (default: number of CPUs)')
+	return parser.parse_args(argv)
+
+#
+#  Batch mode
+#
+#  Generates multiple duk_config.h headers while metadata is scanned only
+#  once.  Worker processes are forked after metadata has been loaded so
+#  they inherit it.
+#
+
+batch_commands = [ 'duk-config-header', 'autodetect-header', 'barebones-header' ]
+
+def read_batch_items(filename):
+	if filename == '-':
+		lines = sys.stdin.readlines()
+	else:
+		with open(filename, 'rb') as f:
+			lines = f.readlines()
+
+	items = []
+	for line in lines:
+		line = line.strip()
+		if line == '' or line[0] == '#':
+			continue
+		argv = json.loads(line)
+		if not isinstance(argv, list):
+			raise Exception('batch item must be a list of arguments: %r' % line)
+		items.append([ unicode_to_str(x) for x in argv ])
+	return items
+
+def unicode_to_str(x):
+	if isinstance(x, unicode):
+		return x.encode('utf-8')
+	return x
+
+# Generate one batch header, returns None on success or an error string.
+def generate_batch_item(arg):
+	meta_dir, argv = arg
+	try:
+		(opts, args) = parse_options(argv)
+		if len(args) > 0 and args[0] not in batch_commands:
+			raise Exception('unsupported command in batch item: %r' % args[0])
+		if opts.output is None:
+			raise Exception('missing --output in batch item')
+		result = generate_duk_config_header(opts, meta_dir)
+		with open(opts.output, 'wb') as f:
+			f.write(result)
+		return None
+	except:
+		return 'batch item %r failed:\n%s' % (argv, traceback.format_exc())
+
+def generate_duk_config_header_batch(opts, meta_dir):
+	if opts.batch is None:
+		raise Exception('missing --batch')
+	items = read_batch_items(opts.batch)
+	work = [ (meta_dir, argv) for argv in items ]
+
+	jobs = max(1, min(opts.jobs, len(work)))
+	if jobs == 1:
+		errors = map(generate_batch_item, work)
+	else:
+		pool = multiprocessing.Pool(jobs)
+		try:
+			errors = pool.map(generate_batch_item, work, chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+
+	errors = [ e for e in errors if e is not None ]
+	for e in errors:
+		print(e)
+	if len(errors) > 0:
+		raise Exception('%d/%d batch items failed' % (len(errors), len(items)))
+	print('Generated %d headers (%d jobs)' % (len(items), jobs))
+
+def main():
+	(opts, args) = parse_options(sys.argv[1:])
 
 	meta_dir = opts.metadata
 	if opts.metadata is None:
@@ -1494,11 +1650,14 @@ def main():
 	else:
 		raise Exception('metadata source must be a directory or a tar.gz file')
 
+	if opts.metadata_snapshot is not None:
+		load_metadata_snapshot(opts.metadata_snapshot)
+
 	scan_helper_snippets(os.path.join(meta_dir, 'helper-snippets'))
-	scan_use_defs(os.path.join(meta_dir, 'config-options'))
-	scan_opt_defs(os.path.join(meta_dir, 'feature-options'))
+	scan_use_defs(meta_dir, 'config-options')
+	scan_opt_defs(meta_dir, 'feature-options')
 	scan_use_tags()
-	scan_tags_meta(os.path.join(meta_dir, 'tags.yaml'))
+	scan_tags_meta(meta_dir, 'tags.yaml')
 	print('%s, scanned %d DUK_OPT_xxx, %d DUK_USE_XXX, %d helper snippets' % \
 		(metadata_src_text, len(opt_defs.keys()), len(use_defs.keys()), len(helper_snippets)))
 	#print('Tags: %r' % use_tags_list)
@@ -1521,6 +1680,10 @@ def main():
 		result = generate_duk_config_header(opts, meta_dir)
 		with open(opts.output, 'wb') as f:
 			f.write(result)
+	elif cmd == 'duk-config-header-batch':
+		# Generate multiple duk_config.h headers, options for each
+		# header are given in a separate batch file.
+		generate_duk_config_header_batch(opts, meta_dir)
 	elif cmd == 'feature-documentation':
 		result = generate_feature_option_documentation(opts)
 		with open(opts.output, 'wb') as f:
@@ -1532,5 +1695,8 @@ def main():
 	else:
 		raise Exception('invalid command: %r' % cmd)
 
+	if opts.metadata_snapshot is not None:
+		save_metadata_snapshot(opts.metadata_snapshot, meta_dir)
+
 if __name__ == '__main__':
 	main()
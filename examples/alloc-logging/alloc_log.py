@@ -0,0 +1,179 @@
+#!/usr/bin/env python2
+#
+#  Reader for allocation logs written by duk_alloc_logging.c (or in a
+#  matching format), shared by the analysis tools.  Both the text format
+#  and the binary format (DUK_ALLOC_LOGGING_BINARY) are supported, the
+#  format is detected automatically.
+#
+#  Records are returned as tuples:
+#
+#    ('A', ptr, size)
+#    ('F', ptr, size)
+#    ('R', ptr, oldsize, newptr, newsize)
+#
+#  where a pointer is None for NULL, FAIL for a failed allocation, and
+#  otherwise an opaque value (a string for text logs, an integer for binary
+#  logs) which is only useful for matching pointers with each other.
+#
+#  Binary logs are memory mapped and decoded in bulk so that very large
+#  logs can be processed without a parsing bottleneck.
+#
+
+import sys
+import mmap
+import struct
+
+FAIL = 'FAIL'
+
+BINARY_MAGIC = 'DUKALOGB'
+BINARY_HEADER_SIZE = 16
+BINARY_RECORD_SIZE = 16
+BINARY_FLAG_NULL = 0x01
+BINARY_FLAG_FAIL = 0x02
+
+# Records decoded per struct.unpack_from() call.
+BINARY_CHUNK_RECORDS = 4096
+
+def parseTextPointer(x):
+	if x == 'NULL':
+		return None
+	if x == 'FAIL':
+		return FAIL
+	return x
+
+# Parse text log lines into records.  Lines which are not recognized are
+# ignored.
+def readTextRecords(lines):
+	for line in lines:
+		parts = line.strip().split(' ')
+
+		# A ptr/NULL/FAIL size
+		# F ptr/NULL size
+		# R ptr/NULL oldsize ptr/NULL/FAIL newsize
+
+		# Note: ajduk doesn't log oldsize (uses -1 instead)
+
+		if parts[0] == 'A':
+			yield ('A', parseTextPointer(parts[1]), long(parts[2]))
+		elif parts[0] == 'F':
+			yield ('F', parseTextPointer(parts[1]), long(parts[2]))
+		elif parts[0] == 'R':
+			yield ('R', parseTextPointer(parts[1]), long(parts[2]),
+			       parseTextPointer(parts[3]), long(parts[4]))
+
+def decodeBinaryPointer(ptr, flags):
+	if flags & BINARY_FLAG_FAIL:
+		return FAIL
+	if flags & BINARY_FLAG_NULL:
+		return None
+	return ptr
+
+# Decode binary log records from a buffer (string or mmap) which starts
+# with the binary log header.
+def readBinaryRecords(buf):
+	if len(buf) < BINARY_HEADER_SIZE or buf[0:8] != BINARY_MAGIC:
+		raise Exception('invalid binary alloc log header')
+	if struct.unpack_from('<L', buf, 8)[0] == 0x01020304:
+		endian = '<'
+	elif struct.unpack_from('>L', buf, 8)[0] == 0x01020304:
+		endian = '>'
+	else:
+		raise Exception('invalid binary alloc log byte order marker')
+	if struct.unpack_from(endian + 'L', buf, 12)[0] != BINARY_RECORD_SIZE:
+		raise Exception('unsupported binary alloc log record size')
+
+	num_records = (len(buf) - BINARY_HEADER_SIZE) / BINARY_RECORD_SIZE
+	chunk_struct = struct.Struct(endian + 'QLBBH' * BINARY_CHUNK_RECORDS)
+	pending = None  # 'R' record waiting for its 'r' record
+
+	for first in xrange(0, num_records, BINARY_CHUNK_RECORDS):
+		count = min(BINARY_CHUNK_RECORDS, num_records - first)
+		offset = BINARY_HEADER_SIZE + first * BINARY_RECORD_SIZE
+		if count == BINARY_CHUNK_RECORDS:
+			values = chunk_struct.unpack_from(buf, offset)
+		else:
+			values = struct.unpack_from(endian + 'QLBBH' * count, buf, offset)
+
+		for i in xrange(0, count * 5, 5):
+			ptr = values[i]
+			size = values[i + 1]
+			rectype = values[i + 2]
+			flags = values[i + 3]
+
+			if rectype == 0x41:  # 'A'
+				yield ('A', decodeBinaryPointer(ptr, flags), size)
+			elif rectype == 0x46:  # 'F'
+				yield ('F', decodeBinaryPointer(ptr, flags), size)
+			elif rectype == 0x52:  # 'R'
+				pending = (decodeBinaryPointer(ptr, flags), size)
+			elif rectype == 0x72:  # 'r'
+				if pending is None:
+					raise Exception('invalid binary alloc log, realloc record without old pointer')
+				yield ('R', pending[0], pending[1], decodeBinaryPointer(ptr, flags), size)
+				pending = None
+			else:
+				raise Exception('invalid binary alloc log record type %d' % rectype)
+
+# Read records from an open file, e.g. sys.stdin.
+def readAllocLogFile(f):
+	try:
+		f.seek(0)
+		seekable = True
+	except (AttributeError, EnvironmentError):
+		seekable = False  # e.g. a pipe
+
+	if seekable:
+		is_binary = (f.read(len(BINARY_MAGIC)) == BINARY_MAGIC)
+		f.seek(0)
+		if not is_binary:
+			for rec in readTextRecords(f):
+				yield rec
+			return
+		buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			for rec in readBinaryRecords(buf):
+				yield rec
+		finally:
+			buf.close()
+		return
+
+	# Not seekable: detect the format from the first line or header.
+	first = f.readline()
+	if first.startswith(BINARY_MAGIC):
+		for rec in readBinaryRecords(first + f.read()):
+			yield rec
+	else:
+		for rec in readTextRecords([ first ]):
+			yield rec
+		for rec in readTextRecords(f):
+			yield rec
+
+# Read records from a log file.
+def readAllocLog(fn):
+	f = open(fn, 'rb')
+	try:
+		for rec in readAllocLogFile(f):
+			yield rec
+	finally:
+		f.close()
+
+if __name__ == '__main__':
+	# Dump a log (either format) in the text format.
+	def fmt(ptr):
+		if ptr is None:
+			return 'NULL'
+		if ptr is FAIL:
+			return 'FAIL'
+		if isinstance(ptr, str):
+			return ptr
+		return '0x%x' % ptr
+
+	if len(sys.argv) > 1:
+		records = readAllocLog(sys.argv[1])
+	else:
+		records = readAllocLogFile(sys.stdin)
+	for rec in records:
+		if rec[0] == 'R':
+			print('R %s %d %s %d' % (fmt(rec[1]), rec[2], fmt(rec[3]), rec[4]))
+		else:
+			print('%s %s %d' % (rec[0], fmt(rec[1]), rec[2]))
@@ -0,0 +1,414 @@
+#!/usr/bin/env python2
+#
+#  Allocation profile analyzer for allocation logs written by
+#  duk_alloc_logging.c (text or binary, see alloc_log.py).
+#
+#  Computes, in a single streaming pass:
+#
+#    - Allocation size histogram over size classes
+#    - Allocation lifetime distribution (in log operations) for each
+#      size class
+#    - Peak concurrent live bytes and allocation counts, overall and for
+#      each size class
+#    - Optionally, fragmentation for an extras/alloc-pool configuration:
+#      the pool allocator behavior (duk_alloc_pool.c) is modelled using
+#      per-pool free entry counts, and internal waste, free bytes and
+#      allocation failures are tracked over time
+#
+#  Memory use is bounded by the number of concurrently live allocations;
+#  all other state is fixed size.
+#
+#  Size classes are the pool block sizes when a pool configuration is
+#  given, otherwise powers of two.
+#
+#  Pool configuration is JSON, either with explicit counts (same format as
+#  for pool_simulator.py):
+#
+#    { "pools": [ { "size": 16, "count": 200 }, ... ] }
+#
+#  or in duk_pool_config format, in which case --pool-memory gives the pool
+#  region size and counts are computed like duk_alloc_pool_init() does:
+#
+#    { "pools": [ { "size": 16, "a": 20, "b": 200 }, ... ] }
+#
+#  Example:
+#
+#  $ python alloc_profile.py --alloc-log /tmp/duk-alloc-log.txt \
+#        --pool-config pools.json --pool-memory 200000 \
+#        --output-series /tmp/fragmentation.txt
+#
+
+import sys
+import json
+import optparse
+
+import alloc_log
+
+# Lifetime histogram bucket 'k' contains lifetimes in [2^(k-1), 2^k - 1]
+# log operations, bucket 0 contains zero lifetimes.
+NUM_LIFETIME_BUCKETS = 48
+
+def readJson(fn):
+	f = open(fn, 'rb')
+	d = f.read()
+	f.close()
+	return json.loads(d)
+
+def lifetimeBucket(x):
+	return min(x.bit_length(), NUM_LIFETIME_BUCKETS - 1)
+
+# Compute pool counts for a duk_pool_config style configuration and a pool
+# region size, matching duk_alloc_pool_init().
+def computePoolCounts(configs, size):
+	t_min = 0.0
+	t_max = 1e6
+	step = 0
+	while True:
+		if step >= 100:
+			t_curr = t_min
+		else:
+			t_curr = (t_min + t_max) / 2.0
+
+		counts = []
+		total = 0
+		good = True
+		for cfg in configs:
+			x = (float(cfg['a']) * t_curr + float(cfg['b'])) / float(cfg['size'])
+			counts.append(int(x))
+			total += cfg['size'] * counts[-1]
+			if total > size:
+				good = False
+				break
+
+		if good:
+			if step >= 100:
+				break
+			t_min = t_curr
+		else:
+			if step >= 1000:
+				raise Exception('cannot fit pool configuration into %d bytes' % size)
+			t_max = t_curr
+		step += 1
+
+	# Sprinkle leftovers to pools in descending order.
+	for i in xrange(len(configs) - 1, -1, -1):
+		while size - total >= configs[i]['size']:
+			counts[i] += 1
+			total += configs[i]['size']
+
+	return counts
+
+class SizeClass:
+	def __init__(self, size):
+		self.size = size             # upper bound for class, None if unbounded
+		self.allocs = 0
+		self.alloc_bytes = 0
+		self.frees = 0
+		self.live_count = 0
+		self.live_bytes = 0
+		self.peak_live_count = 0
+		self.peak_live_bytes = 0
+		self.lifetime_sum = 0
+		self.lifetimes = [ 0 ] * NUM_LIFETIME_BUCKETS
+
+# Model of the duk_alloc_pool.c allocator.  Pool entries within a pool are
+# interchangeable, so only free entry counts are tracked.
+class PoolModel:
+	def __init__(self, sizes, counts):
+		self.sizes = sizes
+		self.counts = counts
+		self.free = list(counts)
+		self.used_bytes = 0       # block bytes in use
+		self.request_bytes = 0    # requested bytes in use
+		self.failures = 0
+		self.first_failure = None
+
+	def allocFrom(self, first, size):
+		for i in xrange(first, len(self.sizes)):
+			if size <= self.sizes[i] and self.free[i] > 0:
+				self.free[i] -= 1
+				self.used_bytes += self.sizes[i]
+				return i
+		return None
+
+	def release(self, i):
+		self.free[i] += 1
+		self.used_bytes -= self.sizes[i]
+
+	# Returns pool index or None if the allocation fails.
+	def alloc(self, size):
+		return self.allocFrom(0, size)
+
+	# Returns new pool index or None if the reallocation fails (in which
+	# case the old allocation remains).
+	def realloc(self, i, size):
+		if size <= self.sizes[i]:
+			# Shrink to smallest possible block size if there's a
+			# free entry, otherwise keep the existing entry.
+			for j in xrange(i):
+				if size <= self.sizes[j] and self.free[j] > 0:
+					self.free[j] -= 1
+					self.used_bytes += self.sizes[j]
+					self.release(i)
+					return j
+			return i
+
+		j = self.allocFrom(i + 1, size)
+		if j is not None:
+			self.release(i)
+		return j
+
+	def fail(self, index):
+		self.failures += 1
+		if self.first_failure is None:
+			self.first_failure = index
+
+	def freeBytes(self):
+		res = 0
+		for i in xrange(len(self.sizes)):
+			res += self.free[i] * self.sizes[i]
+		return res
+
+	def totalBytes(self):
+		res = 0
+		for i in xrange(len(self.sizes)):
+			res += self.counts[i] * self.sizes[i]
+		return res
+
+class AllocProfile:
+	def __init__(self, class_sizes, pool_model=None, f_series=None, sample_interval=1000):
+		self.class_sizes = class_sizes
+		self.classes = [ SizeClass(sz) for sz in class_sizes ] + [ SizeClass(None) ]
+		self.class_cache = {}
+		self.pool_model = pool_model
+		self.f_series = f_series
+		self.sample_interval = sample_interval
+
+		self.live = {}  # ptr -> (class index, size, birth index, pool index)
+		self.index = 0
+		self.live_count = 0
+		self.live_bytes = 0
+		self.peak_live_count = 0
+		self.peak_live_bytes = 0
+		self.peak_live_bytes_index = 0
+		self.peak_waste_bytes = 0
+		self.peak_used_bytes = 0
+
+		if f_series is not None:
+			cols = [ 'index', 'live_bytes', 'live_count' ]
+			if pool_model is not None:
+				cols += [ 'pool_used_bytes', 'pool_waste_bytes', 'pool_free_bytes', 'pool_failures' ]
+			f_series.write('# ' + ' '.join(cols) + '\n')
+
+	def getClass(self, size):
+		res = self.class_cache.get(size)
+		if res is None:
+			res = len(self.class_sizes)
+			for i, sz in enumerate(self.class_sizes):
+				if size <= sz:
+					res = i
+					break
+			self.class_cache[size] = res
+		return res
+
+	def begin(self, ptr, size, pool_idx):
+		ci = self.getClass(size)
+		c = self.classes[ci]
+		c.allocs += 1
+		c.alloc_bytes += size
+		c.live_count += 1
+		c.live_bytes += size
+		c.peak_live_count = max(c.peak_live_count, c.live_count)
+		c.peak_live_bytes = max(c.peak_live_bytes, c.live_bytes)
+
+		self.live_count += 1
+		self.live_bytes += size
+		self.peak_live_count = max(self.peak_live_count, self.live_count)
+		if self.live_bytes > self.peak_live_bytes:
+			self.peak_live_bytes = self.live_bytes
+			self.peak_live_bytes_index = self.index
+
+		if ptr is not None:
+			self.live[ptr] = (ci, size, self.index, pool_idx)
+		if pool_idx is not None:
+			self.pool_model.request_bytes += size
+
+	# Returns the pool index of the ended allocation, None if unknown or
+	# not placed in a pool.
+	def end(self, ptr):
+		ent = self.live.pop(ptr, None)
+		if ent is None:
+			return None
+		ci, size, birth, pool_idx = ent
+		c = self.classes[ci]
+		c.frees += 1
+		c.live_count -= 1
+		c.live_bytes -= size
+		lifetime = self.index - birth
+		c.lifetime_sum += lifetime
+		c.lifetimes[lifetimeBucket(lifetime)] += 1
+
+		self.live_count -= 1
+		self.live_bytes -= size
+
+		if pool_idx is not None:
+			self.pool_model.request_bytes -= size
+		return pool_idx
+
+	def process(self, rec):
+		pm = self.pool_model
+
+		if rec[0] == 'A':
+			if rec[1] is not None and rec[1] is not alloc_log.FAIL:
+				pool_idx = None
+				if pm is not None:
+					pool_idx = pm.alloc(rec[2])
+					if pool_idx is None:
+						pm.fail(self.index)
+				self.begin(rec[1], rec[2], pool_idx)
+		elif rec[0] == 'F':
+			if rec[1] is not None:
+				pool_idx = self.end(rec[1])
+				if pool_idx is not None:
+					pm.release(pool_idx)
+		elif rec[0] == 'R':
+			if rec[3] is not alloc_log.FAIL:
+				# A successful realloc ends the old allocation and
+				# begins a new one (possibly at the same pointer).
+				old_pool_idx = None
+				if rec[1] is not None:
+					old_pool_idx = self.end(rec[1])
+				if rec[3] is not None and rec[4] > 0:
+					pool_idx = None
+					if pm is not None:
+						if old_pool_idx is not None:
+							pool_idx = pm.realloc(old_pool_idx, rec[4])
+							if pool_idx is None:
+								pm.fail(self.index)
+								pm.release(old_pool_idx)
+						else:
+							pool_idx = pm.alloc(rec[4])
+							if pool_idx is None:
+								pm.fail(self.index)
+					self.begin(rec[3], rec[4], pool_idx)
+				elif old_pool_idx is not None:
+					pm.release(old_pool_idx)
+
+		if pm is not None:
+			waste = pm.used_bytes - pm.request_bytes
+			self.peak_waste_bytes = max(self.peak_waste_bytes, waste)
+			self.peak_used_bytes = max(self.peak_used_bytes, pm.used_bytes)
+
+		if self.f_series is not None and (self.index % self.sample_interval) == 0:
+			self.writeSample()
+		self.index += 1
+
+	def writeSample(self):
+		row = [ self.index, self.live_bytes, self.live_count ]
+		pm = self.pool_model
+		if pm is not None:
+			row += [ pm.used_bytes, pm.used_bytes - pm.request_bytes, pm.freeBytes(), pm.failures ]
+		self.f_series.write(' '.join([ '%d' % x for x in row ]) + '\n')
+
+	def finish(self):
+		if self.f_series is not None:
+			self.writeSample()
+
+def lifetimePercentile(c, pct):
+	count = sum(c.lifetimes)
+	if count == 0:
+		return None
+	limit = count * pct / 100.0
+	acc = 0
+	for k, n in enumerate(c.lifetimes):
+		acc += n
+		if acc >= limit:
+			return (1 << k) - 1  # upper bound of bucket
+	return None
+
+def printReport(prof):
+	print('Log operations: %d' % prof.index)
+	print('Peak live bytes: %d (at operation %d)' % (prof.peak_live_bytes, prof.peak_live_bytes_index))
+	print('Peak live allocations: %d' % prof.peak_live_count)
+	print('Live at end: %d allocations, %d bytes' % (prof.live_count, prof.live_bytes))
+	print('')
+
+	print('Size class histogram and lifetimes (lifetimes in log operations):')
+	print('%10s %10s %12s %10s %12s %10s %10s %10s %10s' % \
+	      ('class', 'allocs', 'bytes', 'peaklive', 'peakbytes', 'livenow', 'lt_mean', 'lt_p50<=', 'lt_p90<='))
+	for c in prof.classes:
+		if c.allocs == 0:
+			continue
+		if c.size is None:
+			name = '>%d' % prof.class_sizes[-1] if len(prof.class_sizes) > 0 else 'all'
+		else:
+			name = '<=%d' % c.size
+		lt_mean = '-'
+		if c.frees > 0:
+			lt_mean = '%.1f' % (float(c.lifetime_sum) / c.frees)
+		p50 = lifetimePercentile(c, 50)
+		p90 = lifetimePercentile(c, 90)
+		print('%10s %10d %12d %10d %12d %10d %10s %10s %10s' % \
+		      (name, c.allocs, c.alloc_bytes, c.peak_live_count, c.peak_live_bytes, c.live_count,
+		       lt_mean, '-' if p50 is None else '%d' % p50, '-' if p90 is None else '%d' % p90))
+
+	pm = prof.pool_model
+	if pm is None:
+		return
+
+	print('')
+	print('Pool configuration: %d bytes total' % pm.totalBytes())
+	print('%10s %10s %12s %10s' % ('block', 'count', 'bytes', 'peaklive'))
+	for i in xrange(len(pm.sizes)):
+		print('%10d %10d %12d %10d' % (pm.sizes[i], pm.counts[i], pm.sizes[i] * pm.counts[i], prof.classes[i].peak_live_count))
+	print('Peak pool bytes in use: %d' % prof.peak_used_bytes)
+	print('Peak internal waste (block size minus requested size): %d bytes' % prof.peak_waste_bytes)
+	if pm.failures > 0:
+		print('Allocation failures: %d (first at operation %d)' % (pm.failures, pm.first_failure))
+	else:
+		print('Allocation failures: none')
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option('--alloc-log', dest='alloc_log', default=None, help='Allocation log (text or binary), default is stdin')
+	parser.add_option('--pool-config', dest='pool_config', default=None, help='Pool configuration (JSON) for fragmentation estimation')
+	parser.add_option('--pool-memory', dest='pool_memory', type='int', default=None, help='Pool region size in bytes for a duk_pool_config style configuration')
+	parser.add_option('--output-series', dest='output_series', default=None, help='Write sampled live bytes and pool statistics into a columnar text file')
+	parser.add_option('--sample-interval', dest='sample_interval', type='int', default=1000, help='Log operations between samples in --output-series')
+	(opts, args) = parser.parse_args()
+
+	pool_model = None
+	if opts.pool_config is not None:
+		configs = readJson(opts.pool_config)['pools']
+		sizes = [ cfg['size'] for cfg in configs ]
+		if all([ cfg.has_key('count') for cfg in configs ]):
+			counts = [ cfg['count'] for cfg in configs ]
+		else:
+			if opts.pool_memory is None:
+				raise Exception('--pool-memory needed for a pool configuration without counts')
+			counts = computePoolCounts(configs, opts.pool_memory)
+		pool_model = PoolModel(sizes, counts)
+		class_sizes = sizes
+	else:
+		class_sizes = [ 1 << i for i in xrange(32) ]
+
+	f_series = None
+	if opts.output_series is not None:
+		f_series = open(opts.output_series, 'wb', 1024 * 1024)
+
+	prof = AllocProfile(class_sizes, pool_model, f_series, opts.sample_interval)
+	if opts.alloc_log is not None:
+		records = alloc_log.readAllocLog(opts.alloc_log)
+	else:
+		records = alloc_log.readAllocLogFile(sys.stdin)
+	for rec in records:
+		prof.process(rec)
+	prof.finish()
+
+	if f_series is not None:
+		f_series.close()
+
+	printReport(prof)
+
+if __name__ == '__main__':
+	main()
@@ -12,6 +12,20 @@
  *     ^           ^
  *     |           `--- pointer returned to Duktape
  *     `--- underlying malloc ptr
+ *
+ *  By default the log is written as text lines:
+ *
+ *    A ptr/NULL/FAIL size
+ *    F ptr/NULL size
+ *    R ptr/NULL oldsize ptr/NULL/FAIL newsize
+ *
+ *  If DUK_ALLOC_LOGGING_BINARY is defined, a more compact binary log is
+ *  written instead: a 16-byte header (magic "DUKALOGB", uint32 byte order
+ *  marker 0x01020304, uint32 record size) followed by fixed size records
+ *  (alloc_log_record) in native byte order.  A realloc is logged as an 'R'
+ *  record for the old pointer followed by an 'r' record for the new one.
+ *  Sizes which don't fit into 32 bits are logged as 0xffffffff.  Use
+ *  alloc_log.py to read either format.
  */
 
 #include "duktape.h"
@@ -20,7 +34,11 @@
 #include <string.h>
 #include <stdint.h>
 
+#if defined(DUK_ALLOC_LOGGING_BINARY)
+#define  ALLOC_LOG_FILE  "/tmp/duk-alloc-log.bin"
+#else
 #define  ALLOC_LOG_FILE  "/tmp/duk-alloc-log.txt"
+#endif
 
 typedef struct {
 	/* The double value in the union is there to ensure alignment is
@@ -33,21 +51,73 @@ typedef struct {
 	} u;
 } alloc_hdr;
 
-static FILE *log_file = NULL;
+#if defined(DUK_ALLOC_LOGGING_BINARY)
+#define  ALLOC_LOG_FLAG_NULL  0x01
+#define  ALLOC_LOG_FLAG_FAIL  0x02
+
+typedef struct {
+	uint64_t ptr;
+	uint32_t size;
+	uint8_t type;      /* 'A', 'F', 'R', 'r' */
+	uint8_t flags;     /* ALLOC_LOG_FLAG_xxx */
+	uint16_t reserved;
+} alloc_log_record;  /* 16 bytes, no padding */
+#endif
 
-static void write_log(const char *fmt, ...) {
-	va_list ap;
+static FILE *log_file = NULL;
 
+static int open_log(void) {
+	if (log_file) {
+		return 1;
+	}
+	log_file = fopen(ALLOC_LOG_FILE, "wb");
 	if (!log_file) {
-		log_file = fopen(ALLOC_LOG_FILE, "wb");
-		if (!log_file) {
-			return;
-		}
+		return 0;
+	}
+#if defined(DUK_ALLOC_LOGGING_BINARY)
+	{
+		uint32_t hdr[2];
+		hdr[0] = 0x01020304UL;
+		hdr[1] = (uint32_t) sizeof(alloc_log_record);
+		fwrite("DUKALOGB", 8, 1, log_file);
+		fwrite((void *) hdr, sizeof(hdr), 1, log_file);
+	}
+#endif
+	return 1;
+}
+
+/* Write a log item.  Type is 'A', 'F', 'R' (realloc, old pointer and size)
+ * or 'r' (realloc, new pointer and size; always follows an 'R' item).
+ * A NULL 'ptr' is logged as NULL, or as FAIL if 'fail' is set.
+ */
+static void write_log(char type, void *ptr, int fail, size_t size) {
+	if (!open_log()) {
+		return;
 	}
 
-	va_start(ap, fmt);
-	vfprintf(log_file, fmt, ap);
-	va_end(ap);
+#if defined(DUK_ALLOC_LOGGING_BINARY)
+	{
+		alloc_log_record rec;
+		rec.ptr = (uint64_t) (uintptr_t) ptr;
+		rec.size = (size > (size_t) 0xffffffffUL ? (uint32_t) 0xffffffffUL : (uint32_t) size);
+		rec.type = (uint8_t) type;
+		rec.flags = (uint8_t) (fail ? ALLOC_LOG_FLAG_FAIL : (ptr ? 0 : ALLOC_LOG_FLAG_NULL));
+		rec.reserved = 0;
+		fwrite((void *) &rec, sizeof(rec), 1, log_file);
+	}
+#else
+	if (type != 'r') {
+		fprintf(log_file, "%c ", type);
+	}
+	if (fail) {
+		fprintf(log_file, "FAIL");
+	} else if (ptr) {
+		fprintf(log_file, "%p", ptr);
+	} else {
+		fprintf(log_file, "NULL");
+	}
+	fprintf(log_file, (type == 'R' ? " %ld " : " %ld\n"), (long) size);
+#endif
 }
 
 void *duk_alloc_logging(void *udata, duk_size_t size) {
@@ -57,18 +127,18 @@ void *duk_alloc_logging(void *udata, duk_size_t size) {
 	(void) udata;  /* Suppress warning. */
 
 	if (size == 0) {
-		write_log("A NULL %ld\n", (long) size);
+		write_log('A', NULL, 0, size);
 		return NULL;
 	}
 
 	hdr = (alloc_hdr *) malloc(size + sizeof(alloc_hdr));
 	if (!hdr) {
-		write_log("A FAIL %ld\n", (long) size);
+		write_log('A', NULL, 1, size);
 		return NULL;
 	}
 	hdr->u.sz = size;
 	ret = (void *) (hdr + 1);
-	write_log("A %p %ld\n", ret, (long) size);
+	write_log('A', ret, 0, size);
 	return ret;
 }
 
@@ -90,34 +160,40 @@ void *duk_realloc_logging(void *udata, void *ptr, duk_size_t size) {
 		old_size = hdr->u.sz;
 
 		if (size == 0) {
-			write_log("R %p %ld NULL 0\n", ptr, (long) old_size);
+			write_log('R', ptr, 0, old_size);
+			write_log('r', NULL, 0, 0);
 			free((void *) hdr);
 			return NULL;
 		} else {
 			t = realloc((void *) hdr, size + sizeof(alloc_hdr));
 			if (!t) {
-				write_log("R %p %ld FAIL %ld\n", ptr, (long) old_size, (long) size);
+				write_log('R', ptr, 0, old_size);
+				write_log('r', NULL, 1, size);
 				return NULL;
 			}
 			hdr = (alloc_hdr *) t;
 			hdr->u.sz = size;
 			ret = (void *) (hdr + 1);
-			write_log("R %p %ld %p %ld\n", ptr, (long) old_size, ret, (long) size);
+			write_log('R', ptr, 0, old_size);
+			write_log('r', ret, 0, size);
 			return ret;
 		}
 	} else {
 		if (size == 0) {
-			write_log("R NULL 0 NULL 0\n");
+			write_log('R', NULL, 0, 0);
+			write_log('r', NULL, 0, 0);
 			return NULL;
 		} else {
 			hdr = (alloc_hdr *) malloc(size + sizeof(alloc_hdr));
 			if (!hdr) {
-				write_log("R NULL 0 FAIL %ld\n", (long) size);
+				write_log('R', NULL, 0, 0);
+				write_log('r', NULL, 1, size);
 				return NULL;
 			}
 			hdr->u.sz = size;
 			ret = (void *) (hdr + 1);
-			write_log("R NULL 0 %p %ld\n", ret, (long) size);
+			write_log('R', NULL, 0, 0);
+			write_log('r', ret, 0, size);
 			return ret;
 		}
 	}
@@ -129,10 +205,10 @@ void duk_free_logging(void *udata, void *ptr) {
 	(void) udata;  /* Suppress warning. */
 
 	if (!ptr) {
-		write_log("F NULL 0\n");
+		write_log('F', NULL, 0, 0);
 		return;
 	}
 	hdr = (alloc_hdr *) (void *) ((unsigned char *) ptr - sizeof(alloc_hdr));
-	write_log("F %p %ld\n", ptr, (long) hdr->u.sz);
+	write_log('F', ptr, 0, hdr->u.sz);
 	free((void *) hdr);
 }
@@ -1,9 +1,12 @@
 #!/usr/bin/env python2
 #
 #  Analyze allocator logs and write total-bytes-in-use after every
-#  operation to stdout.  The output can be gnuplotted as:
+#  operation to stdout.  The log can be in text or binary format (see
+#  alloc_log.py) and is read from stdin or from a file given as an
+#  argument.  The output can be gnuplotted as:
 #
 #  $ python log2gnuplot.py </tmp/duk-alloc-log.txt >/tmp/output.txt
+#  $ python log2gnuplot.py /tmp/duk-alloc-log.bin >/tmp/output.txt
 #  $ gnuplot
 #  > plot "output.txt" with lines
 #
@@ -11,31 +14,40 @@
 import os
 import sys
 
+import alloc_log
+
 def main():
 	allocated = 0
 
-	for line in sys.stdin:
-		line = line.strip()
-		parts = line.split(' ')
+	if len(sys.argv) > 1:
+		records = alloc_log.readAllocLog(sys.argv[1])
+	else:
+		records = alloc_log.readAllocLogFile(sys.stdin)
 
+	out = []
+	for rec in records:
 		# A ptr/NULL/FAIL size
 		# F ptr/NULL size
 		# R ptr/NULL oldsize ptr/NULL/FAIL newsize
 
 		# Note: ajduk doesn't log oldsize (uses -1 instead)
 
-		if parts[0] == 'A':
-			if parts[1] != 'NULL' and parts[1] != 'FAIL':
-				allocated += long(parts[2])
-		elif parts[0] == 'F':
-			allocated -= long(parts[2])
-		elif parts[0] == 'R':
-			allocated -= long(parts[2])
-			if parts[3] != 'NULL' and parts[3] != 'FAIL':
-				allocated += long(parts[4])
-		print(allocated)
-
-	print(allocated)
+		if rec[0] == 'A':
+			if rec[1] is not None and rec[1] is not alloc_log.FAIL:
+				allocated += rec[2]
+		elif rec[0] == 'F':
+			allocated -= rec[2]
+		elif rec[0] == 'R':
+			allocated -= rec[2]
+			if rec[3] is not None and rec[3] is not alloc_log.FAIL:
+				allocated += rec[4]
+		out.append('%d' % allocated)
+		if len(out) >= 10000:
+			sys.stdout.write('\n'.join(out) + '\n')
+			out = []
+
+	out.append('%d' % allocated)
+	sys.stdout.write('\n'.join(out) + '\n')
 
 if __name__ == '__main__':
 	main()
@@ -1,9 +1,9 @@
 #!/usr/bin/env python2
 #
 #  Simulate pool allocator behavior against a memory allocation log written
-#  by duk_alloc_logging.c or in matching format.  Provide commands to provide
-#  statistics and graphs, and to optimize pool counts for single or multiple
-#  application profiles.
+#  by duk_alloc_logging.c or in matching format (text or binary, see
+#  alloc_log.py).  Provide commands to provide statistics and graphs, and
+#  to optimize pool counts for single or multiple application profiles.
 #
 #  The pool allocator simulator incorporates quite basic pool features
 #  including "borrowing" from larger pool sizes.  The behavior matches
@@ -23,7 +23,13 @@ import os
 import sys
 import math
 import json
+import copy
+import heapq
+import array
 import optparse
+import multiprocessing
+
+import alloc_log
 
 #---------------------------------------------------------------------------
 #
@@ -84,6 +90,88 @@ HUGE = 0x100000000  # used for min()
 class AllocFailedException(Exception):
 	pass
 
+# Runtime entries of a single pool, stored in parallel arrays indexed by
+# slot number.  Free slots are kept in a heap so that the lowest free slot
+# is always used first, like when scanning the entries in order.
+class PoolEntries:
+	__slots__ = [ 'entry_size', 'base_count', 'pointers', 'alloc_sizes',
+	              'borrowed', 'free_slots', 'alloc_bytes' ]
+
+	def __init__(self, entry_size, base_count):
+		self.entry_size = entry_size
+		self.base_count = base_count  # slots beyond this are 'extended'
+		self.pointers = array.array('l')
+		self.alloc_sizes = array.array('l')  # -1 if free
+		self.borrowed = bytearray()
+		self.free_slots = []
+		self.alloc_bytes = 0  # sum of alloc_sizes of used slots
+
+	def add(self, ptr):
+		slot = len(self.pointers)
+		self.pointers.append(ptr)
+		self.alloc_sizes.append(-1)
+		self.borrowed.append(0)
+		heapq.heappush(self.free_slots, slot)
+		return slot
+
+	def count(self):
+		return len(self.pointers)
+
+	def usedCount(self):
+		return len(self.pointers) - len(self.free_slots)
+
+	def alloc(self, slot, size, borrowed):
+		self.alloc_sizes[slot] = size
+		self.borrowed[slot] = 1 if borrowed else 0
+		self.alloc_bytes += size
+
+	def free(self, slot):
+		self.alloc_bytes -= self.alloc_sizes[slot]
+		self.alloc_sizes[slot] = -1
+		self.borrowed[slot] = 0
+		heapq.heappush(self.free_slots, slot)
+
+	def clone(self):
+		res = PoolEntries(self.entry_size, self.base_count)
+		res.pointers = self.pointers[:]
+		res.alloc_sizes = self.alloc_sizes[:]
+		res.borrowed = self.borrowed[:]
+		res.free_slots = self.free_slots[:]
+		res.alloc_bytes = self.alloc_bytes
+		return res
+
+	# Drop slots from 'count' onwards, all of which must be free.
+	def truncate(self, count):
+		for i in xrange(count, len(self.pointers)):
+			if self.alloc_sizes[i] >= 0:
+				raise Exception('cannot truncate pool, slot %d in use' % i)
+		del self.pointers[count:]
+		del self.alloc_sizes[count:]
+		del self.borrowed[count:]
+		self.free_slots = [ i for i in self.free_slots if i < count ]
+		heapq.heapify(self.free_slots)
+		self.base_count = min(self.base_count, count)
+
+	# Entries in the original JSON compatible form (see getStateJson()).
+	def toJson(self):
+		res = []
+		for i in xrange(len(self.pointers)):
+			alloc_size = self.alloc_sizes[i]
+			if alloc_size < 0:
+				alloc_size = None
+			if i < self.base_count:
+				ent = { 'alloc_size': alloc_size,
+				        'entry_size': self.entry_size,
+				        'borrowed': self.borrowed[i] != 0 }
+			else:
+				ent = { 'alloc_size': alloc_size,
+				        'entry_size': self.entry_size,
+				        'borrowed': self.borrowed[i] != 0,
+				        'extended': True }
+			ent['pointer'] = self.pointers[i]
+			res.append(ent)
+		return res
+
 class PoolSimulator:
 	state = None
 	config = None
@@ -98,23 +186,52 @@ class PoolSimulator:
 		self.auto_extend = extend
 		self.state = { 'pools': [] }
 		self.config = json.loads(json.dumps(config))  # verify and clone
+		self.entries = []  # PoolEntries for each pool in self.state['pools']
+		self.ptrmap = {}   # pointer -> (pool index, slot)
 
-		for cfg in config['pools']:
+		for idx, cfg in enumerate(config['pools']):
 			st = json.loads(json.dumps(cfg))
-			st['entries'] = []
+			st['entries'] = None   # see getStateJson()
 			st['ajs_use'] = 0      # entries in use
 			st['ajs_hwm'] = 0      # max entries in use
 			#st['ajs_min'] = None  # min alloc size
 			#st['ajs_max'] = None  # max alloc size
 			st['heap_index'] = st.get('heap_index', 0)  # ajs specific
+			pe = PoolEntries(st['size'], cfg['count'])
 			for i in xrange(cfg['count']):
-				ent = { 'alloc_size': None,
-				        'entry_size': st['size'],
-				        'borrowed': False }  # free
-				ent['pointer'] = nextPtr
+				self.ptrmap[nextPtr] = (idx, pe.add(nextPtr))
 				nextPtr += 1
-				st['entries'].append(ent)
 			self.state['pools'].append(st)
+			self.entries.append(pe)
+
+	# Clone the simulator, e.g. for checkpointing a replay.
+	def clone(self):
+		res = copy.copy(self)  # shares config
+		res.state = { 'pools': [ dict(p) for p in self.state['pools'] ] }
+		res.entries = [ pe.clone() for pe in self.entries ]
+		res.ptrmap = dict(self.ptrmap)
+		return res
+
+	# Reduce the entry count of a pool in place.  Only entries which are
+	# currently free can be dropped.
+	def truncatePool(self, idx, count):
+		pe = self.entries[idx]
+		dropped = pe.pointers[count:]
+		pe.truncate(count)
+		for ptr in dropped:
+			del self.ptrmap[ptr]
+		self.state['pools'][idx]['count'] = count
+
+	# Current state as JSON, including all pool entries.
+	def getStateJson(self):
+		pools = self.state['pools']
+		for idx, p in enumerate(pools):
+			p['entries'] = self.entries[idx].toJson()
+		try:
+			return json.dumps(self.state)
+		finally:
+			for p in pools:
+				p['entries'] = None
 
 	def alloc(self, size):
 		global nextPtr
@@ -126,37 +243,30 @@ class PoolSimulator:
 
 		borrowed = False
 
-		def alloc_match(e):
-			e['alloc_size'] = size
-			e['borrowed'] = borrowed
-			p['ajs_use'] += 1
-			p['ajs_hwm'] = max(p['ajs_use'], p['ajs_hwm'])
-			p['ajs_min'] = min(p.get('ajs_min', HUGE), size)
-			p['ajs_max'] = max(p.get('ajs_max', 0), size)
-			return e['pointer']
-
-		for p in self.state['pools']:
+		for idx, p in enumerate(self.state['pools']):
 			if p['size'] < size:
 				continue
-			for e in p['entries']:
-				if e['alloc_size'] is not None:
-					continue
-				return alloc_match(e)
-
-			# Auto extend for measuring pool hwm without borrowing
-			if self.auto_extend:
-				ent = { 'alloc_size': None,
-				        'entry_size': p['size'],
-				        'borrowed': False,
-				        'extended': True }
-				ent['pointer'] = nextPtr
+			pe = self.entries[idx]
+			if len(pe.free_slots) > 0:
+				slot = heapq.heappop(pe.free_slots)
+			elif self.auto_extend:
+				# Auto extend for measuring pool hwm without borrowing
+				slot = pe.add(nextPtr)
+				heapq.heappop(pe.free_slots)  # == slot, no other free slots
+				self.ptrmap[nextPtr] = (idx, slot)
 				nextPtr += 1
-				p['entries'].append(ent)
-				return alloc_match(ent)
+			else:
+				if not self.allow_borrow or not p['borrow']:
+					raise AllocFailedException('alloc failure for size %d: pool full, no borrow' % size)
+				borrowed = True
+				continue
 
-			if not self.allow_borrow or not p['borrow']:
-				raise AllocFailedException('alloc failure for size %d: pool full, no borrow' % size)
-			borrowed = True
+			pe.alloc(slot, size, borrowed)
+			p['ajs_use'] += 1
+			p['ajs_hwm'] = max(p['ajs_use'], p['ajs_hwm'])
+			p['ajs_min'] = min(p.get('ajs_min', HUGE), size)
+			p['ajs_max'] = max(p.get('ajs_max', 0), size)
+			return pe.pointers[slot]
 
 		raise AllocFailedException('alloc failure for size %d: went through all pools, no space' % size)
 
@@ -172,38 +282,35 @@ class PoolSimulator:
 
 		# ptr != NULL and size != 0 here
 
-		for idx in xrange(len(self.state['pools'])):
-			p = self.state['pools'][idx]
-			prev_p = None
-			if idx >= 0:
-				prev_p = self.state['pools'][idx - 1]
+		loc = self.ptrmap.get(ptr)
+		if loc is None:
+			raise AllocFailedException('free failure for pointer %d: cannot find pointer' % ptr)
+		idx, slot = loc
+		p = self.state['pools'][idx]
+		prev_p = self.state['pools'][idx - 1]  # for idx 0, this is the last pool (matches earlier behavior)
 
-			for e in p['entries']:
-				if e['pointer'] == ptr:
-					if e['alloc_size'] is None:
-						raise AllocFailedException('realloc failure for pointer %d: entry not allocated (double free)' % ptr)
+		if self.entries[idx].alloc_sizes[slot] < 0:
+			raise AllocFailedException('realloc failure for pointer %d: entry not allocated (double free)' % ptr)
 
-					fits_current = (size <= p['size'])
-					fits_previous = (prev_p is not None and size <= prev_p['size'])
+		fits_current = (size <= p['size'])
+		fits_previous = (prev_p is not None and size <= prev_p['size'])
 
-					if fits_current and not fits_previous:
-						# New alloc size fits current pool and won't fit into
-						# previous pool (so it could be shrunk).
+		if fits_current and not fits_previous:
+			# New alloc size fits current pool and won't fit into
+			# previous pool (so it could be shrunk).
 
-						p['ajs_max'] = max(p.get('ajs_max', 0), size)
-						return ptr
-
-					# Reallocate entry (smaller or larger).
-					# Note: when shrinking, ajs_heap.c doesn't make sure
-					# there's actually a free entry in the smaller pool.
-					# This affects only some corner cases, but match
-					# that behavior here.
+			p['ajs_max'] = max(p.get('ajs_max', 0), size)
+			return ptr
 
-					newPtr = self.alloc(size)
-					self.free(ptr)
-					return newPtr
+		# Reallocate entry (smaller or larger).
+		# Note: when shrinking, ajs_heap.c doesn't make sure
+		# there's actually a free entry in the smaller pool.
+		# This affects only some corner cases, but match
+		# that behavior here.
 
-		raise AllocFailedException('free failure for pointer %d: cannot find pointer' % ptr)
+		newPtr = self.alloc(size)
+		self.free(ptr)
+		return newPtr
 
 	def free(self, ptr):
 		#print('free %d' % ptr)
@@ -211,17 +318,15 @@ class PoolSimulator:
 		if ptr == nullPtr:
 			return
 
-		for p in self.state['pools']:
-			for e in p['entries']:
-				if e['pointer'] == ptr:
-					if e['alloc_size'] is None:
-						raise AllocFailedException('free failure for pointer %d: entry not allocated (double free)' % ptr)
-					e['alloc_size'] = None
-					e['borrowed'] = False
-					p['ajs_use'] -= 1
-					return
-
-		raise AllocFailedException('free failure for pointer %d: cannot find pointer' % ptr)
+		loc = self.ptrmap.get(ptr)
+		if loc is None:
+			raise AllocFailedException('free failure for pointer %d: cannot find pointer' % ptr)
+		idx, slot = loc
+		pe = self.entries[idx]
+		if pe.alloc_sizes[slot] < 0:
+			raise AllocFailedException('free failure for pointer %d: entry not allocated (double free)' % ptr)
+		pe.free(slot)
+		self.state['pools'][idx]['ajs_use'] -= 1
 
 	# Get a list of pool byte sizes.
 	def getSizes(self):
@@ -242,17 +347,11 @@ class PoolSimulator:
 
 		by_pool = []
 
-		for p in self.state['pools']:
-			alloc_bytes_pool = 0
-			waste_bytes_pool = 0
-			free_bytes_pool = 0
-
-			for e in p['entries']:
-				if e['alloc_size'] is None:
-					free_bytes_pool += e['entry_size']
-				else:
-					alloc_bytes_pool += e['alloc_size']
-					waste_bytes_pool += e['entry_size'] - e['alloc_size']
+		for idx, p in enumerate(self.state['pools']):
+			pe = self.entries[idx]
+			alloc_bytes_pool = pe.alloc_bytes
+			waste_bytes_pool = pe.usedCount() * pe.entry_size - pe.alloc_bytes
+			free_bytes_pool = len(pe.free_slots) * pe.entry_size
 
 			ajs_use_count_pool = p['ajs_use']
 			ajs_hwm_count_pool = p['ajs_hwm']
@@ -316,14 +415,36 @@ class PoolSimulator:
 
 xIndex = 0
 
-def processAllocLog(ps, f_log, out_dir, throw_on_oom=True, emit_files=True):
+# Stats columns, written into 'stats.txt' (one row per log line) and
+# 'bypool_<N>.txt' (one row per pool for each snapshot).
+statsColumnsAll = [ 'alloc_bytes', 'waste_bytes', 'free_bytes',
+                    'ajs_hwm_bytes', 'ajs_use_bytes', 'ajs_waste_bytes' ]
+statsColumnsPool = [ 'alloc', 'waste', 'free',
+                     'ajs_use_count', 'ajs_hwm_count', 'ajs_min_bytes', 'ajs_max_bytes',
+                     'ajs_hwm_bytes', 'ajs_use_bytes', 'ajs_waste_bytes' ]
+
+# Column names of 'stats.txt', column 1 is the log line index.  The names
+# match the per-statistic files written by earlier versions.
+def getStatsColumns(sizes):
+	res = [ 'index' ]
+	for k in statsColumnsAll:
+		res.append('%s_all' % k)
+	for sz in sizes:
+		for k in statsColumnsPool:
+			if k in [ 'alloc', 'waste', 'free' ]:
+				res.append('%s_bytes_%d' % (k, sz))
+			else:
+				res.append('%s_%d' % (k, sz))
+	return res
+
+def processAllocLog(ps, records, out_dir, throw_on_oom=True, emit_files=True):
 	# map native pointer to current simulator pointer
 	ptrmap = {}
 
-	def writeFile(fn, line):
-		f = open(fn, 'ab')
-		f.write(line + '\n')
-		f.close()
+	f_stats = None
+	if emit_files:
+		f_stats = open(os.path.join(out_dir, 'stats.txt'), 'wb', 1024 * 1024)
+		f_stats.write('# ' + ' '.join(getStatsColumns(ps.getSizes())) + '\n')
 
 	def emitStats():
 		global xIndex
@@ -332,24 +453,13 @@ def processAllocLog(ps, f_log, out_dir, throw_on_oom=True, emit_files=True):
 			return
 
 		stats = ps.stats()
-		writeFile(os.path.join(out_dir, 'alloc_bytes_all.txt'), '%d %d' % (xIndex, stats['alloc_bytes']))
-		writeFile(os.path.join(out_dir, 'waste_bytes_all.txt'), '%d %d' % (xIndex, stats['waste_bytes']))
-		writeFile(os.path.join(out_dir, 'free_bytes_all.txt'), '%d %d' % (xIndex, stats['free_bytes']))
-		writeFile(os.path.join(out_dir, 'ajs_hwm_bytes_all.txt'), '%d %d' % (xIndex, stats['ajs_hwm_bytes']))
-		writeFile(os.path.join(out_dir, 'ajs_use_bytes_all.txt'), '%d %d' % (xIndex, stats['ajs_use_bytes']))
-		writeFile(os.path.join(out_dir, 'ajs_waste_bytes_all.txt'), '%d %d' % (xIndex, stats['ajs_waste_bytes']))
-
+		row = [ xIndex ]
+		for k in statsColumnsAll:
+			row.append(stats[k])
 		for p in stats['byPool']:
-			writeFile(os.path.join(out_dir, 'alloc_bytes_%d.txt' % p['size']), '%d %d' % (xIndex, p['alloc']))
-			writeFile(os.path.join(out_dir, 'waste_bytes_%d.txt' % p['size']), '%d %d' % (xIndex, p['waste']))
-			writeFile(os.path.join(out_dir, 'free_bytes_%d.txt' % p['size']), '%d %d' % (xIndex, p['free']))
-			writeFile(os.path.join(out_dir, 'ajs_use_count_%d.txt' % p['size']), '%d %d' % (xIndex, p['ajs_use_count']))
-			writeFile(os.path.join(out_dir, 'ajs_hwm_count_%d.txt' % p['size']), '%d %d' % (xIndex, p['ajs_hwm_count']))
-			writeFile(os.path.join(out_dir, 'ajs_min_bytes_%d.txt' % p['size']), '%d %d' % (xIndex, p['ajs_min_bytes']))
-			writeFile(os.path.join(out_dir, 'ajs_max_bytes_%d.txt' % p['size']), '%d %d' % (xIndex, p['ajs_max_bytes']))
-			writeFile(os.path.join(out_dir, 'ajs_hwm_bytes_%d.txt' % p['size']), '%d %d' % (xIndex, p['ajs_hwm_bytes']))
-			writeFile(os.path.join(out_dir, 'ajs_use_bytes_%d.txt' % p['size']), '%d %d' % (xIndex, p['ajs_use_bytes']))
-			writeFile(os.path.join(out_dir, 'ajs_waste_bytes_%d.txt' % p['size']), '%d %d' % (xIndex, p['ajs_waste_bytes']))
+			for k in statsColumnsPool:
+				row.append(p[k])
+		f_stats.write(' '.join([ '%d' % x for x in row ]) + '\n')
 		xIndex += 1
 
 	def emitSnapshot(count):
@@ -357,22 +467,19 @@ def processAllocLog(ps, f_log, out_dir, throw_on_oom=True, emit_files=True):
 			return
 
 		f = open(os.path.join(out_dir, 'state_%d.json' % count), 'wb')
-		f.write(json.dumps(ps.state, indent=4))
+		f.write(ps.getStateJson())
 		f.close()
 
 		stats = ps.stats()
+		res = [ '# log2size size ' + ' '.join(statsColumnsPool) ]
 		for p in stats['byPool']:
-			logsize = math.log(p['size'], 2)
-			writeFile(os.path.join(out_dir, 'alloc_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['alloc'], p['size']))
-			writeFile(os.path.join(out_dir, 'waste_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['waste'], p['size']))
-			writeFile(os.path.join(out_dir, 'free_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['free'], p['size']))
-			writeFile(os.path.join(out_dir, 'ajs_use_count_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['ajs_use_count'], p['size']))
-			writeFile(os.path.join(out_dir, 'ajs_hwm_count_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['ajs_hwm_count'], p['size']))
-			writeFile(os.path.join(out_dir, 'ajs_min_bytes_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['ajs_min_bytes'], p['size']))
-			writeFile(os.path.join(out_dir, 'ajs_max_bytes_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['ajs_max_bytes'], p['size']))
-			writeFile(os.path.join(out_dir, 'ajs_hwm_bytes_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['ajs_hwm_bytes'], p['size']))
-			writeFile(os.path.join(out_dir, 'ajs_use_bytes_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['ajs_use_bytes'], p['size']))
-			writeFile(os.path.join(out_dir, 'ajs_waste_bytes_bypool_%d.txt' % count), '%f %d   # size=%d' % (logsize, p['ajs_waste_bytes'], p['size']))
+			row = [ '%f %d' % (math.log(p['size'], 2), p['size']) ]
+			for k in statsColumnsPool:
+				row.append('%d' % p[k])
+			res.append(' '.join(row))
+		f = open(os.path.join(out_dir, 'bypool_%d.txt' % count), 'wb')
+		f.write('\n'.join(res) + '\n')
+		f.close()
 
 	sys.stdout.write('Simulating...')
 	sys.stdout.flush()
@@ -381,7 +488,7 @@ def processAllocLog(ps, f_log, out_dir, throw_on_oom=True, emit_files=True):
 
 	try:
 		count = 0
-		for line in f_log:
+		for rec in records:
 			count += 1
 			if (count % 1000) == 0:
 				sys.stdout.write('.')
@@ -390,53 +497,44 @@ def processAllocLog(ps, f_log, out_dir, throw_on_oom=True, emit_files=True):
 
 			emitStats()
 
-			line = line.strip()
-			parts = line.split(' ')
-
-			# A ptr/NULL/FAIL size
-			# F ptr/NULL size
-			# R ptr/NULL oldsize ptr/NULL/FAIL newsize
+			# See alloc_log.py for record format.
 
-			if len(parts) < 1:
-				pass  # ignore
-			elif parts[0] == 'A':
-				if parts[1] == 'FAIL':
+			if rec[0] == 'A':
+				if rec[1] is alloc_log.FAIL:
 					pass
-				elif parts[1] == 'NULL':
+				elif rec[1] is None:
 					ps.alloc(nullPtr)
 				else:
-					ptrmap[parts[1]] = ps.alloc(long(parts[2]))
-			elif parts[0] == 'F':
-				if parts[1] == 'NULL':
+					ptrmap[rec[1]] = ps.alloc(rec[2])
+			elif rec[0] == 'F':
+				if rec[1] is None:
 					ps.free(nullPtr)
 				else:
-					ptr = ptrmap[parts[1]]
+					ptr = ptrmap[rec[1]]
 					ps.free(ptr)
-					del ptrmap[parts[1]]
-			elif parts[0] == 'R':
+					del ptrmap[rec[1]]
+			elif rec[0] == 'R':
 				# oldsize is not needed; don't use because e.g. ajduk
 				# log stats don't provide it
 
-				if parts[1] == 'NULL':
+				if rec[1] is None:
 					oldptr = nullPtr
 				else:
-					oldptr = ptrmap[parts[1]]
+					oldptr = ptrmap[rec[1]]
 
-				if parts[3] == 'FAIL':
+				if rec[3] is alloc_log.FAIL:
 					pass
 				else:
-					newsize = long(parts[4])
+					newsize = rec[4]
 					newptr = ps.realloc(oldptr, newsize)
 					if newptr == nullPtr and newsize > 0:
 						# Failed/freed, don't update pointers
 						pass
 					else:
-						if parts[1] != 'NULL' and ptrmap.has_key(parts[1]):
-							del ptrmap[parts[1]]
-						if parts[3] != 'NULL':
-							ptrmap[parts[3]] = newptr
-			else:
-				pass  # ignore
+						if rec[1] is not None and ptrmap.has_key(rec[1]):
+							del ptrmap[rec[1]]
+						if rec[3] is not None:
+							ptrmap[rec[3]] = newptr
 
 		sys.stdout.write(' done\n')
 		sys.stdout.flush()
@@ -450,85 +548,397 @@ def processAllocLog(ps, f_log, out_dir, throw_on_oom=True, emit_files=True):
 	emitSnapshot(count)
 	emitStats()
 
+	if f_stats is not None:
+		f_stats.close()
+
 	return success
 
+#---------------------------------------------------------------------------
+#
+#  Checkpointed replay for pool count optimization
+#
+#  Replaying a simulation with one pool count reduced behaves exactly like
+#  the replay with the original count until that pool would need an entry
+#  beyond the reduced count, i.e. until the pool's entry use first exceeds
+#  the reduced count.  A reference replay records state checkpoints and the
+#  peak use of each pool between checkpoints so that a candidate count can
+#  be evaluated by resuming from the checkpoint before that point.  When the
+#  resumed replay is back in sync with the reference at a later checkpoint
+#  (e.g. borrowed entries have been freed), it skips ahead again.
+#
+
+# Parse an allocation log into a list of operations so that it can be
+# replayed quickly and from an arbitrary position:
+#
+#   ('A', ptr/None, size)
+#   ('F', ptr)
+#   ('R', ptr/None, newptr/None, newsize)
+#
+# Operations which don't affect the simulation are dropped.
+def readAllocOps(fn):
+	ops = []
+
+	# Same handling as in processAllocLog().
+	for rec in alloc_log.readAllocLog(fn):
+		if rec[0] == 'A':
+			if rec[1] is None:
+				ops.append(('A', None, nullPtr))
+			elif rec[1] is not alloc_log.FAIL:
+				ops.append(('A', rec[1], rec[2]))
+		elif rec[0] == 'F':
+			if rec[1] is not None:
+				ops.append(('F', rec[1]))
+		elif rec[0] == 'R':
+			if rec[3] is not alloc_log.FAIL:
+				ops.append(('R', rec[1], rec[3], rec[4]))
+
+	return ops
+
+# Replay ops[start:end], returns False if the replay runs out of memory.
+# When 'peaks' is given, update it with the peak entry use of each pool.
+def replayAllocOps(ps, ops, start, end, ptrmap, peaks=None):
+	pools = ps.state['pools']
+
+	try:
+		for i in xrange(start, end):
+			op = ops[i]
+
+			if op[0] == 'A':
+				ptr = ps.alloc(op[2])
+				if op[1] is not None:
+					ptrmap[op[1]] = ptr
+				if peaks is not None:
+					idx = ps.ptrmap[ptr][0]
+					peaks[idx] = max(peaks[idx], pools[idx]['ajs_use'])
+			elif op[0] == 'F':
+				ps.free(ptrmap[op[1]])
+				del ptrmap[op[1]]
+			else:
+				if op[1] is None:
+					oldptr = nullPtr
+				else:
+					oldptr = ptrmap[op[1]]
+				newsize = op[3]
+				newptr = ps.realloc(oldptr, newsize)
+				if newptr == nullPtr and newsize > 0:
+					# Failed/freed, don't update pointers
+					pass
+				else:
+					if op[1] is not None and ptrmap.has_key(op[1]):
+						del ptrmap[op[1]]
+					if op[2] is not None:
+						ptrmap[op[2]] = newptr
+				if peaks is not None and newptr != nullPtr and newptr != oldptr:
+					idx = ps.ptrmap[newptr][0]
+					use = pools[idx]['ajs_use']
+					if oldptr != nullPtr and ps.ptrmap[oldptr][0] == idx:
+						use += 1  # old entry was freed after the new one was allocated
+					peaks[idx] = max(peaks[idx], use)
+	except AllocFailedException:
+		return False
+
+	return True
+
+# Peak number of simultaneously live allocations which can only be placed
+# into pool 't' or a later pool, for each pool index 't'.  This doesn't
+# depend on pool counts so a config with fewer entries in pools t, t+1, ...
+# will certainly run out of memory.  A realloc is counted as if the old
+# entry was freed first, so the peaks are a lower bound.
+def peakDemand(ops, sizes):
+	fits = {}
+	live = {}  # ptr -> index of first pool the allocation fits
+	demand = [ 0 ] * len(sizes)
+	peaks = [ 0 ] * len(sizes)
+
+	def add(size):
+		if not fits.has_key(size):
+			fits[size] = len(sizes)
+			for idx, sz in enumerate(sizes):
+				if sz >= size:
+					fits[size] = idx
+					break
+		f = fits[size]
+		for t in xrange(min(f + 1, len(sizes))):
+			demand[t] += 1
+			peaks[t] = max(peaks[t], demand[t])
+		return f
+
+	def remove(f):
+		for t in xrange(min(f + 1, len(sizes))):
+			demand[t] -= 1
+
+	for op in ops:
+		if op[0] == 'A':
+			f = add(op[2])
+			if op[1] is not None:
+				live[op[1]] = f
+		elif op[0] == 'F':
+			if live.has_key(op[1]):
+				remove(live.pop(op[1]))
+		else:
+			if op[1] is not None and live.has_key(op[1]):
+				remove(live.pop(op[1]))
+			if op[3] > 0:
+				f = add(op[3])
+				if op[2] is not None:
+					live[op[2]] = f
+
+	return peaks
+
+class ReplayReference:
+	ops = None
+	interval = None
+	demand = None        # see peakDemand()
+	counts = None        # pool counts of the reference config
+	checkpoints = None   # (op index, PoolSimulator, ptrmap) every 'interval' ops
+	peaks = None         # for each checkpoint, peak use of each pool until next checkpoint
+
+	def __init__(self, ops, interval):
+		self.ops = ops
+		self.interval = interval
+
+	# Replay 'cfg' from the start.
+	def build(self, cfg):
+		self.demand = peakDemand(self.ops, [ p['size'] for p in cfg['pools'] ])
+		self.counts = [ p['count'] for p in cfg['pools'] ]
+		self.checkpoints = []
+		self.peaks = []
+
+		ps = PoolSimulator(cfg, borrow=True, extend=False)
+		ptrmap = {}
+		for start in xrange(0, len(self.ops), self.interval):
+			self.checkpoints.append((start, ps.clone(), dict(ptrmap)))
+			peaks = [ p['ajs_use'] for p in ps.state['pools'] ]
+			self.peaks.append(peaks)
+			end = min(start + self.interval, len(self.ops))
+			if not replayAllocOps(ps, self.ops, start, end, ptrmap, peaks):
+				raise Exception('reference pool config runs out of memory')
+		return self
+
+	# Index of the first checkpoint at or after checkpoint 'k' after which
+	# a replay with pool 'idx' count reduced to 'count' may diverge from
+	# the reference, None if it won't.
+	def findDivergence(self, idx, count, k):
+		for k in xrange(k, len(self.peaks)):
+			if self.peaks[k][idx] > count:
+				return k
+		return None
+
+	# Check whether pool 'idx' count reduced to 'count' is certain to run
+	# out of memory based on peakDemand().
+	def exceedsDemand(self, idx, count):
+		entries = 0
+		for t in xrange(len(self.counts) - 1, -1, -1):
+			if t == idx:
+				entries += count
+			else:
+				entries += self.counts[t]
+			if t <= idx and self.demand[t] > entries:
+				return True
+		return False
+
+	# State at checkpoint 'k' with pool 'idx' count reduced to 'count'.
+	def resumeState(self, k, idx, count):
+		start, ps, ptrmap = self.checkpoints[k]
+		ps = ps.clone()
+		ps.truncatePool(idx, count)
+		return start, ps, dict(ptrmap)
+
+	# Check whether a replay with pool 'idx' count reduced to 'count' is in
+	# the same state as the reference at checkpoint 'k'.  Only entry use
+	# and the pointer mapping matter for further allocation decisions.
+	def inSync(self, k, idx, count, ps, ptrmap):
+		start, ref_ps, ref_ptrmap = self.checkpoints[k]
+		if ptrmap != ref_ptrmap:
+			return False
+		for i, pe in enumerate(ps.entries):
+			ref_pe = ref_ps.entries[i]
+			if i == idx:
+				if pe.usedCount() != ref_pe.usedCount() or pe.alloc_sizes != ref_pe.alloc_sizes[:count]:
+					return False
+			elif pe.alloc_sizes != ref_pe.alloc_sizes:
+				return False
+		return True
+
+	# Replay the log with pool 'idx' count reduced to 'count', returns False
+	# if the replay runs out of memory.  Only the parts where the replay may
+	# diverge from the reference are actually replayed.  When 'res' is
+	# given, record the replay into it as a new reference.
+	def replayCount(self, idx, count, res=None):
+		num_checkpoints = len(self.checkpoints)
+		k = 0
+		synced = True
+
+		while k < num_checkpoints:
+			if synced:
+				next_k = self.findDivergence(idx, count, k)
+				if next_k is None:
+					next_k = num_checkpoints
+				if res is not None:
+					for i in xrange(k, next_k):
+						res.checkpoints.append(self.resumeState(i, idx, count))
+						res.peaks.append(self.peaks[i])
+				if next_k >= num_checkpoints:
+					break
+				k = next_k
+				start, ps, ptrmap = self.resumeState(k, idx, count)
+
+			peaks = None
+			if res is not None:
+				res.checkpoints.append((start, ps.clone(), dict(ptrmap)))
+				peaks = [ p['ajs_use'] for p in ps.state['pools'] ]
+				res.peaks.append(peaks)
+
+			k += 1
+			if k < num_checkpoints:
+				end = self.checkpoints[k][0]
+			else:
+				end = len(self.ops)
+			if not replayAllocOps(ps, self.ops, start, end, ptrmap, peaks):
+				return False
+			start = end
+			synced = k < num_checkpoints and self.inSync(k, idx, count, ps, ptrmap)
+
+		return True
+
+	# Check whether the log can be replayed with pool 'idx' count reduced
+	# to 'count'.
+	def tryCount(self, idx, count):
+		if self.findDivergence(idx, count, 0) is None:
+			return True
+		if self.exceedsDemand(idx, count):
+			return False
+		return self.replayCount(idx, count)
+
+	# New reference for the config with pool 'idx' count reduced to 'count'.
+	def derive(self, idx, count):
+		res = ReplayReference(self.ops, self.interval)
+		res.demand = self.demand
+		res.counts = list(self.counts)
+		res.counts[idx] = count
+		res.checkpoints = []
+		res.peaks = []
+		if not self.replayCount(idx, count, res):
+			raise Exception('reference pool config runs out of memory')
+		return res
+
+# Pool counts which the search in cmd_tight_counts() may try next, breadth
+# first, up to 'limit' counts whose outcome isn't known yet.
+def speculativeCounts(count, step, highest_fail, known, limit):
+	res = []
+	queue = [ (count, step, highest_fail) ]
+	while len(queue) > 0 and len(res) < limit:
+		count, step, highest_fail = queue.pop(0)
+		while count > 0 and step > 0:
+			c = count - step
+			if c <= highest_fail:
+				step /= 2
+				continue
+			success = known(c)
+			if success is None:
+				if c not in res:
+					res.append(c)
+				queue.append((c, step, highest_fail))
+				queue.append((count, step / 2, max(highest_fail, c)))
+				break
+			if success:
+				count = c
+			else:
+				highest_fail = max(highest_fail, c)
+				step /= 2
+	return res[:limit]
+
+# Reference used by tryPoolCount(), inherited by worker processes.
+replayRef = None
+
+def tryPoolCount(arg):
+	idx, count = arg
+	return replayRef.tryCount(idx, count)
+
 #---------------------------------------------------------------------------
 #
 #  Gnuplot helper
 #
 
 def gnuplotGraphs(ps, out_dir):
-	def plot(files, out_fn):
-		f = open('/tmp/gnuplot-commands', 'wb')
-		f.write('set terminal dumb\n')
-		for idx, fn in enumerate(files):
-			full_fn = os.path.join(out_dir, fn)
-			cmd = 'plot'
-			if idx > 0:
-				cmd = 'replot'
-			f.write('%s "%s" with lines\n' % (cmd, full_fn))
-			#f.write('%s "%s" with boxes\n' % (cmd, full_fn))
-		f.write('set terminal pngcairo size 1024,768\n')
-		f.write('set output "%s"\n' % os.path.join(out_dir, out_fn))
-		f.write('replot\n')
-		f.close()
-
-		os.system('gnuplot </tmp/gnuplot-commands >/dev/null 2>/dev/null')
-
-	plot([ 'alloc_bytes_all.txt',
-	       'waste_bytes_all.txt',
-	       'free_bytes_all.txt' ], 'alloc_waste_free_all.png')
-	plot([ 'alloc_bytes_all.txt',
-	       'waste_bytes_all.txt',
-	       'free_bytes_all.txt',
-	       'ajs_hwm_bytes_all.txt',
-	       'ajs_use_bytes_all.txt',
-	       'ajs_waste_bytes_all.txt' ], 'alloc_waste_free_withajs_all.png')
-	plot([ 'alloc_bytes_all.txt',
-	       'waste_bytes_all.txt' ], 'alloc_waste_all.png')
-	plot([ 'alloc_bytes_all.txt',
-	       'waste_bytes_all.txt',
-	       'ajs_hwm_bytes_all.txt',
-	       'ajs_use_bytes_all.txt',
-	       'ajs_waste_bytes_all.txt' ], 'alloc_waste_withajs_all.png')
+	columns = getStatsColumns(ps.getSizes())
+	cmds = []
+
+	# Plot columns of a stats file, columns are given by name.
+	def plot(names, out_fn, data_fn='stats.txt', data_columns=columns, x_column=1):
+		full_fn = os.path.join(out_dir, data_fn)
+		cmds.append('set output "%s"' % os.path.join(out_dir, out_fn))
+		plots = []
+		for name in names:
+			plots.append('"%s" using %d:%d title "%s" with lines' % \
+			             (full_fn, x_column, data_columns.index(name) + 1, name))
+			#plots.append('"%s" using %d:%d title "%s" with boxes' % \
+			#             (full_fn, x_column, data_columns.index(name) + 1, name))
+		cmds.append('plot ' + ', '.join(plots))
+
+	plot([ 'alloc_bytes_all',
+	       'waste_bytes_all',
+	       'free_bytes_all' ], 'alloc_waste_free_all.png')
+	plot([ 'alloc_bytes_all',
+	       'waste_bytes_all',
+	       'free_bytes_all',
+	       'ajs_hwm_bytes_all',
+	       'ajs_use_bytes_all',
+	       'ajs_waste_bytes_all' ], 'alloc_waste_free_withajs_all.png')
+	plot([ 'alloc_bytes_all',
+	       'waste_bytes_all' ], 'alloc_waste_all.png')
+	plot([ 'alloc_bytes_all',
+	       'waste_bytes_all',
+	       'ajs_hwm_bytes_all',
+	       'ajs_use_bytes_all',
+	       'ajs_waste_bytes_all' ], 'alloc_waste_withajs_all.png')
 
 	for sz in ps.getSizes():
-		plot([ 'alloc_bytes_%d.txt' % sz,
-		       'waste_bytes_%d.txt' % sz,
-		       'free_bytes_%d.txt' % sz ], 'alloc_waste_free_%d.png' % sz)
-		plot([ 'alloc_bytes_%d.txt' % sz,
-		       'waste_bytes_%d.txt' % sz,
-		       'free_bytes_%d.txt' % sz,
-		       'ajs_hwm_bytes_%d.txt' % sz,
-		       'ajs_use_bytes_%d.txt' % sz,
-		       'ajs_waste_bytes_%d.txt' % sz ], 'alloc_waste_free_withajs_%d.png' % sz)
-		plot([ 'alloc_bytes_%d.txt' % sz,
-		       'waste_bytes_%d.txt' % sz ], 'alloc_waste_%d.png' % sz)
-		plot([ 'alloc_bytes_%d.txt' % sz,
-		       'waste_bytes_%d.txt' % sz,
-		       'ajs_hwm_bytes_%d.txt' % sz,
-		       'ajs_use_bytes_%d.txt' % sz,
-		       'ajs_waste_bytes_%d.txt' % sz ], 'alloc_waste_withajs_%d.png' % sz)
+		plot([ 'alloc_bytes_%d' % sz,
+		       'waste_bytes_%d' % sz,
+		       'free_bytes_%d' % sz ], 'alloc_waste_free_%d.png' % sz)
+		plot([ 'alloc_bytes_%d' % sz,
+		       'waste_bytes_%d' % sz,
+		       'free_bytes_%d' % sz,
+		       'ajs_hwm_bytes_%d' % sz,
+		       'ajs_use_bytes_%d' % sz,
+		       'ajs_waste_bytes_%d' % sz ], 'alloc_waste_free_withajs_%d.png' % sz)
+		plot([ 'alloc_bytes_%d' % sz,
+		       'waste_bytes_%d' % sz ], 'alloc_waste_%d.png' % sz)
+		plot([ 'alloc_bytes_%d' % sz,
+		       'waste_bytes_%d' % sz,
+		       'ajs_hwm_bytes_%d' % sz,
+		       'ajs_use_bytes_%d' % sz,
+		       'ajs_waste_bytes_%d' % sz ], 'alloc_waste_withajs_%d.png' % sz)
 
 	# plots containing all pool sizes in a timeline
 	for name in [ 'alloc', 'waste' ]:
-		files = []
+		names = []
 		for sz in ps.getSizes():
-			files.append('%s_bytes_%d.txt' % (name, sz))
-		plot(files, '%s_bytes_allpools.png' % name)
+			names.append('%s_bytes_%d' % (name, sz))
+		plot(names, '%s_bytes_allpools.png' % name)
 
-	# autoplot for all data files
-	for fn in os.listdir(out_dir):
-		fn_txt = os.path.join(out_dir, fn)
-		if not fn_txt.endswith('.txt'):
-			continue
-		fn_png = os.path.splitext(fn_txt)[0] + '.png'
-		if os.path.exists(fn_png):
-			continue
+	# autoplot for all stats columns
+	for name in columns[1:]:
+		plot([ name ], name + '.png')
 
-		plot([ fn ], fn_png)
+	# autoplot for snapshots, x axis is log2 of pool size
+	bypool_columns = [ 'log2size', 'size' ] + statsColumnsPool
+	for fn in sorted(os.listdir(out_dir)):
+		if not (fn.startswith('bypool_') and fn.endswith('.txt')):
+			continue
+		count = int(fn[len('bypool_'):-len('.txt')])
+		for name in statsColumnsPool:
+			plot([ name ], '%s_bypool_%d.png' % (name, count), data_fn=fn,
+			     data_columns=bypool_columns, x_column=1)
+
+	# Run all plots with a single gnuplot invocation.
+	f = open('/tmp/gnuplot-commands', 'wb')
+	f.write('set terminal pngcairo size 1024,768\n')
+	f.write('\n'.join(cmds) + '\n')
+	f.close()
 
-	# XXX: plots for snapshots
+	os.system('gnuplot </tmp/gnuplot-commands >/dev/null 2>/dev/null')
 
 #---------------------------------------------------------------------------
 #
@@ -733,9 +1143,7 @@ def cmd_simulate(opts, args):
 	ps = PoolSimulator(readJson(opts.pool_config), borrow=True, extend=False)
 
 	dprint('Process allocation log')
-	f = open(opts.alloc_log)
-	processAllocLog(ps, f, opts.out_dir)
-	f.close()
+	processAllocLog(ps, alloc_log.readAllocLog(opts.alloc_log), opts.out_dir)
 
 	dprint('Write tight pool config based on hwm')
 	cfg = ps.getTightHwmConfig()
@@ -765,9 +1173,7 @@ def cmd_tight_counts(opts, args, borrow_optimize):
 
 	print('Get hwm pool count profile with autoextend enabled (= no borrowing)')
 	ps = PoolSimulator(readJson(opts.pool_config), borrow=False, extend=True)
-	f = open(opts.alloc_log)
-	processAllocLog(ps, f, opts.out_dir, throw_on_oom=True, emit_files=False)
-	f.close()
+	processAllocLog(ps, alloc_log.readAllocLog(opts.alloc_log), opts.out_dir, throw_on_oom=True, emit_files=False)
 
 	cfg = ps.getTightHwmConfig()
 	print('Tight config based on hwm, no borrowing: %s' % configOneLiner(cfg))
@@ -784,8 +1190,30 @@ def cmd_tight_counts(opts, args, borrow_optimize):
 
 	print('Optimizing pool counts taking borrowing into account (takes a while)...')
 
+	# Candidate counts are evaluated against a reference replay of the
+	# current config, see ReplayReference.  With multiple jobs, the counts
+	# the search may try next are evaluated speculatively in parallel;
+	# the search itself and its result are the same as with a single job.
+
+	global replayRef
+
+	ops = readAllocOps(opts.alloc_log)
+	ref = ReplayReference(ops, opts.checkpoint_interval).build(cfg)
+
 	for i in xrange(len(cfg['pools']) - 1, -1, -1):
 		p = cfg['pools'][i]
+		results = {}  # count -> success, for this pool
+		pool = None
+		replayRef = ref
+
+		def known(count):
+			if results.has_key(count):
+				return results[count]
+			if ref.findDivergence(i, count, 0) is None:
+				return True
+			if ref.exceedsDemand(i, count):
+				return False
+			return None
 
 		step = 1
 		while step < p['count']:
@@ -797,22 +1225,34 @@ def cmd_tight_counts(opts, args, borrow_optimize):
 			p['count'] -= step
 			print('Reduce count for pool size %d bytes from %r to %r and resimulate' % (p['size'], prev_count, p['count']))
 
-			# XXX: emits unused snapshots, optimize
-
 			if p['count'] <= highest_fail:
 				# we know this will fail
 				success = False
 			else:
-				ps = PoolSimulator(cfg, borrow=True, extend=False)
-				f = open(opts.alloc_log)
-				success = processAllocLog(ps, f, opts.out_dir, throw_on_oom=False, emit_files=False)
-				f.close()
+				success = known(p['count'])
+				if success is None:
+					counts = speculativeCounts(prev_count, step, highest_fail, known, opts.jobs)
+					if opts.jobs > 1 and len(counts) > 1:
+						if pool is None:
+							pool = multiprocessing.Pool(opts.jobs)
+						res = pool.map(tryPoolCount, [ (i, c) for c in counts ], 1)
+					else:
+						res = [ ref.tryCount(i, c) for c in counts ]
+					for c, r in zip(counts, res):
+						results[c] = r
+					success = results[p['count']]
 
 			if not success:
 				highest_fail = max(highest_fail, p['count'])
 				p['count'] = prev_count
 				step /= 2
 
+		if pool is not None:
+			pool.close()
+			pool.join()
+		if p['count'] < ref.counts[i]:
+			ref = ref.derive(i, p['count'])
+
 		print('Pool config after size %d: %s' % (p['size'], configOneLiner(cfg)))
 
 	print('Tight config based on hwm and optimizing borrowing: %s' % configOneLiner(cfg))
@@ -826,6 +1266,8 @@ def main():
 	parser.add_option('--alloc-log', dest='alloc_log')
 	parser.add_option('--out-pool-config', dest='out_pool_config')
 	parser.add_option('--out-ajsheap-config', dest='out_ajsheap_config', default=None)
+	parser.add_option('--jobs', dest='jobs', type='int', default=multiprocessing.cpu_count(), help='Number of parallel simulations when optimizing pool counts')
+	parser.add_option('--checkpoint-interval', dest='checkpoint_interval', type='int', default=2000, help='Allocation log operations between replay checkpoints when optimizing pool counts')
 	(opts, args) = parser.parse_args()
 
 	if not os.path.isdir(opts.out_dir):
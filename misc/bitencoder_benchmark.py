@@ -0,0 +1,108 @@
+#!/usr/bin/env python2
+#
+#  Micro-benchmark for dukutil.BitEncoder.  Encodes a random mix of bit
+#  fields and byte strings (similar to genbuiltins.py init data) using the
+#  current encoder and the original bit-per-list-entry encoder, checks that
+#  the outputs are identical, and prints timings.
+#
+#  $ python misc/bitencoder_benchmark.py [--count N] [--rounds N]
+#
+
+import os
+import sys
+import time
+import random
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import dukutil
+
+class ReferenceBitEncoder:
+	"Original BitEncoder, one list entry per bit."
+
+	def __init__(self):
+		self._bits = []
+
+	def bits(self, x, nbits):
+		if (x >> nbits) != 0:
+			raise Exception('input value has too many bits (value: %d, bits: %d)' % (x, nbits))
+		for i in xrange(nbits):
+			t = (x >> (nbits - i - 1)) & 0x01
+			self._bits.append(t)
+
+	def string(self, x):
+		for c in x:
+			self.bits(ord(c), 8)
+
+	def getNumBits(self):
+		return len(self._bits)
+
+	def getBytes(self):
+		bytes = []
+		for i in xrange((len(self._bits) + 7) / 8):
+			t = 0
+			for j in xrange(8):
+				off = i*8 + j
+				if off >= len(self._bits):
+					t = (t << 1)
+				else:
+					t = (t << 1) + self._bits[off]
+			bytes.append(t)
+		return bytes
+
+	def getByteString(self):
+		return ''.join([chr(i) for i in self.getBytes()])
+
+def make_ops(count, seed):
+	rnd = random.Random(seed)
+	ops = []
+	for i in xrange(count):
+		if rnd.random() < 0.02:
+			# 8-byte double constants are written with string().
+			ops.append(('s', ''.join([ chr(rnd.randint(0, 255)) for j in xrange(8) ])))
+		else:
+			nbits = rnd.choice([ 1, 1, 1, 2, 3, 5, 5, 5, 7, 8, 9, 16, 32 ])
+			ops.append(('b', rnd.randint(0, (1 << nbits) - 1), nbits))
+	return ops
+
+def run(cls, ops):
+	be = cls()
+	for op in ops:
+		if op[0] == 'b':
+			be.bits(op[1], op[2])
+		else:
+			be.string(op[1])
+	return be.getNumBits(), be.getByteString()
+
+def bench(cls, ops, rounds):
+	best = None
+	res = None
+	for i in xrange(rounds):
+		start = time.time()
+		res = run(cls, ops)
+		elapsed = time.time() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return best, res
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option('--count', dest='count', type='int', default=200000, help='Number of encoder calls per round')
+	parser.add_option('--rounds', dest='rounds', type='int', default=3, help='Number of rounds, minimum time is reported')
+	parser.add_option('--seed', dest='seed', type='int', default=1, help='Random seed')
+	(opts, args) = parser.parse_args()
+
+	ops = make_ops(opts.count, opts.seed)
+
+	t_ref, res_ref = bench(ReferenceBitEncoder, ops, opts.rounds)
+	t_new, res_new = bench(dukutil.BitEncoder, ops, opts.rounds)
+
+	if res_ref != res_new:
+		raise Exception('output mismatch between reference and current encoder')
+
+	print('%d calls, %d bits, %d bytes, outputs identical' % (opts.count, res_new[0], len(res_new[1])))
+	print('reference: %.3f s' % t_ref)
+	print('current:   %.3f s (%.1fx)' % (t_new, t_ref / max(t_new, 1e-9)))
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python2
+#
+#  Benchmark for genconfig.py helper snippet dependency resolution.
+#  Resolves snippets requiring every define provided by the helper
+#  snippets (optionally extended with a synthetic helper library), using
+#  both the current fill_dependencies_for_snippets() and the original
+#  list scanning algorithm, checks that the resulting snippet order is
+#  identical, and prints timings.
+#
+#  $ python misc/genconfig_snippet_benchmark.py [--synthetic N] [--rounds N]
+#
+
+import os
+import sys
+import time
+import random
+import optparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config'))
+import genconfig
+
+def reference_fill_dependencies_for_snippets(snippets, idx_deps):
+	"Original algorithm: linear provides scans and restarting serialization."
+
+	graph = {}
+	snlist = []
+
+	def add(sn):
+		if sn in snlist:
+			return
+		snlist.append(sn)
+
+		to_add = []
+
+		for k in sn.requires.keys():
+			if genconfig.assumed_provides.has_key(k):
+				continue
+
+			found = False
+			for sn2 in snlist:
+				if sn2.provides.has_key(k):
+					if not graph.has_key(sn):
+						graph[sn] = []
+					graph[sn].append(sn2)
+					found = True
+
+			if not found:
+				sn_req = None
+				for sn2 in genconfig.helper_snippets:
+					if sn2.provides.has_key(k):
+						sn_req = sn2
+						break
+				if sn_req is None:
+					raise Exception('cannot resolve missing require: %r' % k)
+				to_add.append(sn_req)
+				if not graph.has_key(sn):
+					graph[sn] = []
+				graph[sn].append(sn_req)
+
+		for sn in to_add:
+			add(sn)
+
+	for sn in snippets:
+		add(sn)
+
+	handled = {}
+	for sn in snippets:
+		handled[sn] = True
+	keepgoing = True
+	while keepgoing:
+		keepgoing = False
+		for sn in snlist:
+			if handled.has_key(sn):
+				continue
+			success = True
+			for dep in graph.get(sn, []):
+				if not handled.has_key(dep):
+					success = False
+			if success:
+				snippets.insert(idx_deps, sn)
+				idx_deps += 1
+				snippets.insert(idx_deps, genconfig.Snippet([ '' ]))
+				idx_deps += 1
+				handled[sn] = True
+				keepgoing = True
+				break
+
+def make_synthetic_helpers(count, seed):
+	# DUK_F_SYNTH_n helpers, each depending on a few lower numbered
+	# helpers (so the graph is acyclic).  Listed in random order.
+	rnd = random.Random(seed)
+	helpers = []
+	for i in xrange(count):
+		lines = [ '#define DUK_F_SYNTH_%d' % i ]
+		for j in xrange(rnd.randint(0, 3)):
+			if i > 0:
+				lines.append('#if defined(DUK_F_SYNTH_%d)' % rnd.randint(0, i - 1))
+				lines.append('#endif')
+		helpers.append(genconfig.Snippet(lines))
+	rnd.shuffle(helpers)
+	return helpers
+
+def make_request_snippets():
+	# One snippet per provided define, so that the whole helper set
+	# gets pulled in.
+	defs = {}
+	for sn in genconfig.helper_snippets:
+		for k in sn.provides.keys():
+			defs[k] = True
+	res = []
+	for k in sorted(defs.keys()):
+		res.append(genconfig.Snippet([ '#if defined(%s)' % k, '#endif' ]))
+	return res
+
+def bench(fn, requests, rounds):
+	best = None
+	res = None
+	old_stdout = sys.stdout
+	for i in xrange(rounds):
+		snippets = [ genconfig.Snippet([ '/* start */' ]) ] + list(requests)
+		sys.stdout = open(os.devnull, 'wb')
+		try:
+			start = time.time()
+			fn(snippets, 1)
+			elapsed = time.time() - start
+		finally:
+			sys.stdout.close()
+			sys.stdout = old_stdout
+		if best is None or elapsed < best:
+			best = elapsed
+		res = [ '\n'.join(sn.lines) for sn in snippets ]
+	return best, res
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option('--metadata', dest='metadata', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config'), help='Genconfig metadata directory')
+	parser.add_option('--synthetic', dest='synthetic', type='int', default=1000, help='Number of synthetic helper snippets to add')
+	parser.add_option('--rounds', dest='rounds', type='int', default=3, help='Number of rounds, minimum time is reported')
+	parser.add_option('--seed', dest='seed', type='int', default=1, help='Random seed')
+	(opts, args) = parser.parse_args()
+
+	genconfig.scan_helper_snippets(os.path.join(opts.metadata, 'helper-snippets'))
+	num_real = len(genconfig.helper_snippets)
+	genconfig.helper_snippets += make_synthetic_helpers(opts.synthetic, opts.seed)
+	requests = make_request_snippets()
+
+	t_ref, res_ref = bench(reference_fill_dependencies_for_snippets, requests, opts.rounds)
+	t_new, res_new = bench(genconfig.fill_dependencies_for_snippets, requests, opts.rounds)
+
+	if res_ref != res_new:
+		raise Exception('snippet order mismatch between reference and current algorithm')
+
+	print('%d helper snippets (%d synthetic), %d requiring snippets, outputs identical' % \
+	      (len(genconfig.helper_snippets), len(genconfig.helper_snippets) - num_real, len(requests)))
+	print('reference: %.3f s' % t_ref)
+	print('current:   %.3f s (%.1fx)' % (t_new, t_ref / max(t_new, 1e-9)))
+
+if __name__ == '__main__':
+	main()
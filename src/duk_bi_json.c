@@ -2384,6 +2384,7 @@ DUK_LOCAL duk_bool_t duk__json_stringify_fast_value(duk_json_enc_ctx *js_ctx, du
 				goto abort_fastpath;
 			}
 
+			DUK_HOBJECT_MATERIALIZE_LAZY(js_ctx->thr, obj);
 			for (i = 0; i < (duk_uint_fast32_t) DUK_HOBJECT_GET_ENEXT(obj); i++) {
 				duk_hstring *k;
 				duk_size_t prev_size;
@@ -1948,6 +1948,7 @@ DUK_LOCAL const char * const duk__debug_getinfo_hobject_keys[] = {
 	"extensible",
 	"constructable",
 	"boundfunc",
+	"lazy_builtin",
 	"compfunc",
 	"natfunc",
 	"bufobj",
@@ -1970,6 +1971,7 @@ DUK_LOCAL duk_uint_t duk__debug_getinfo_hobject_masks[] = {
 	DUK_HOBJECT_FLAG_EXTENSIBLE,
 	DUK_HOBJECT_FLAG_CONSTRUCTABLE,
 	DUK_HOBJECT_FLAG_BOUNDFUNC,
+	DUK_HOBJECT_FLAG_LAZY_BUILTIN,
 	DUK_HOBJECT_FLAG_COMPFUNC,
 	DUK_HOBJECT_FLAG_NATFUNC,
 	DUK_HOBJECT_FLAG_BUFOBJ,
@@ -2325,6 +2327,7 @@ DUK_LOCAL void duk__debug_handle_get_obj_prop_desc_range(duk_hthread *thr, duk_h
 		goto fail_args;
 	}
 	h_obj = (duk_hobject *) h;
+	DUK_HOBJECT_MATERIALIZE_LAZY(thr, h_obj);
 
 	/* The index range space is conceptually the array part followed by the
 	 * entry part.  Unlike normal enumeration all slots are exposed here as
@@ -8,6 +8,7 @@
 #define DUK__BITPACK_LETTER_LIMIT  26
 #define DUK__BITPACK_UNDERSCORE    26
 #define DUK__BITPACK_FF            27
+#define DUK__BITPACK_BACKREF       28
 #define DUK__BITPACK_SWITCH1       29
 #define DUK__BITPACK_SWITCH        30
 #define DUK__BITPACK_SEVENBIT      31
@@ -392,7 +393,28 @@ DUK_LOCAL duk_bool_t duk__init_heap_strings(duk_heap *heap) {
 		mode = 32;  /* 0 = uppercase, 32 = lowercase (= 'a' - 'A') */
 		for (j = 0; j < len; j++) {
 			t = duk_bd_decode(bd, 5);
-			if (t < DUK__BITPACK_LETTER_LIMIT) {
+			if (t == DUK__BITPACK_BACKREF) {
+				/* Copy a substring of an earlier (already interned)
+				 * built-in string, doesn't affect case mode.
+				 */
+				duk_hstring *h_ref;
+				duk_small_uint_t ref_off;
+				duk_small_uint_t ref_len;
+
+				t = duk_bd_decode(bd, 8);
+				DUK_ASSERT(t < i);
+				h_ref = DUK_HEAP_GET_STRING(heap, t);
+				DUK_ASSERT(h_ref != NULL);
+				ref_off = duk_bd_decode(bd, 4);
+				ref_len = duk_bd_decode(bd, 3) + 3;
+				DUK_ASSERT(ref_off + ref_len <= DUK_HSTRING_GET_BYTELEN(h_ref));
+				DUK_ASSERT(j + ref_len <= len);
+				DUK_MEMCPY((void *) (tmp + j),
+				           (const void *) (DUK_HSTRING_GET_DATA(h_ref) + ref_off),
+				           (size_t) ref_len);
+				j += ref_len - 1;  /* loop increments once */
+				continue;
+			} else if (t < DUK__BITPACK_LETTER_LIMIT) {
 				t = t + DUK_ASC_UC_A + mode;
 			} else if (t == DUK__BITPACK_UNDERSCORE) {
 				t = DUK_ASC_UNDERSCORE;
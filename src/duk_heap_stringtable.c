@@ -891,11 +891,16 @@ DUK_LOCAL duk_hstring *duk__do_lookup(duk_heap *heap, const duk_uint8_t *str, du
 
 #if defined(DUK_USE_ROM_STRINGS)
 	{
-		duk_small_uint_t i;
-		/* XXX: This is VERY inefficient now, and should be e.g. a
-		 * binary search or perfect hash, to be fixed.
+		duk_small_uint_t i, i_end;
+		duk_small_uint_t slot;
+
+		/* ROM strings are grouped into buckets based on the low bits
+		 * of their hash, see genbuiltins.py.  The low bits are the
+		 * same for 16-bit and 32-bit hashes.
 		 */
-		for (i = 0; i < (duk_small_uint_t) (sizeof(duk_rom_strings) / sizeof(duk_hstring *)); i++) {
+		slot = (duk_small_uint_t) (*out_strhash & DUK_ROM_STRINGS_LOOKUP_MASK);
+		i_end = (duk_small_uint_t) duk_rom_strings_lookup[slot + 1];
+		for (i = (duk_small_uint_t) duk_rom_strings_lookup[slot]; i < i_end; i++) {
 			duk_hstring *romstr;
 			romstr = (duk_hstring *) DUK_LOSE_CONST(duk_rom_strings[i]);
 			if (blen == DUK_HSTRING_GET_BYTELEN(romstr) &&
@@ -408,6 +408,7 @@ DUK_INTERNAL void duk_hobject_enumerator_create(duk_context *ctx, duk_small_uint
 		 *  Entries part
 		 */
 
+		DUK_HOBJECT_MATERIALIZE_LAZY(thr, curr);
 		for (i = 0; i < (duk_uint_fast32_t) DUK_HOBJECT_GET_ENEXT(curr); i++) {
 			duk_hstring *k;
 
@@ -1113,6 +1113,16 @@ DUK_INTERNAL void duk_hobject_find_existing_entry(duk_heap *heap, duk_hobject *o
 	DUK_ASSERT(h_idx != NULL);
 	DUK_UNREF(heap);
 
+#if defined(DUK_USE_LAZY_BUILTINS) && !defined(DUK_USE_ROM_OBJECTS)
+	/* All entry lookups go through here so this is where lazy built-ins
+	 * get materialized.  Internal properties are created eagerly so
+	 * internal key lookups (which may happen e.g. during GC) are skipped.
+	 */
+	if (DUK_UNLIKELY(DUK_HOBJECT_HAS_LAZY_BUILTIN(obj)) && !DUK_HSTRING_HAS_INTERNAL(key)) {
+		duk_hthread_materialize_builtin(heap, obj);
+	}
+#endif
+
 	if (DUK_LIKELY(DUK_HOBJECT_GET_HSIZE(obj) == 0))
 	{
 		/* Linear scan: more likely because most objects are small.
@@ -4683,6 +4693,28 @@ DUK_INTERNAL void duk_hobject_define_accessor_internal(duk_hthread *thr, duk_hob
 
 	DUK_ASSERT_VALSTACK_SPACE(thr, DUK__VALSTACK_SPACE);
 
+	/* An existing accessor is replaced in place.  This happens when
+	 * a lazy built-in is materialized again after a failed attempt
+	 * (see duk_hthread_materialize_builtin()).
+	 */
+	duk_hobject_find_existing_entry(thr->heap, obj, key, &e_idx, &h_idx);
+	if (e_idx >= 0 && DUK_HOBJECT_E_SLOT_IS_ACCESSOR(thr->heap, obj, e_idx)) {
+		duk_hobject *old_getter;
+		duk_hobject *old_setter;
+
+		DUK_DDD(DUK_DDDPRINT("existing accessor slot: e_idx=%ld, h_idx=%ld", (long) e_idx, (long) h_idx));
+		old_getter = DUK_HOBJECT_E_GET_VALUE_GETTER(thr->heap, obj, e_idx);
+		old_setter = DUK_HOBJECT_E_GET_VALUE_SETTER(thr->heap, obj, e_idx);
+		DUK_HOBJECT_E_SET_FLAGS(thr->heap, obj, e_idx, propflags | DUK_PROPDESC_FLAG_ACCESSOR);
+		DUK_HOBJECT_E_SET_VALUE_GETTER(thr->heap, obj, e_idx, getter);
+		DUK_HOBJECT_E_SET_VALUE_SETTER(thr->heap, obj, e_idx, setter);
+		DUK_HOBJECT_INCREF_ALLOWNULL(thr, getter);
+		DUK_HOBJECT_INCREF_ALLOWNULL(thr, setter);
+		DUK_HOBJECT_DECREF_ALLOWNULL(thr, old_getter);  /* side effects */
+		DUK_HOBJECT_DECREF_ALLOWNULL(thr, old_setter);  /* side effects */
+		return;
+	}
+
 	/* force the property to 'undefined' to create a slot for it */
 	duk_push_undefined(ctx);
 	duk_hobject_define_property_internal(thr, obj, key, propflags);
@@ -5925,6 +5957,7 @@ DUK_INTERNAL void duk_hobject_object_seal_freeze_helper(duk_hthread *thr, duk_ho
 	 *  for the same object; not likely).
 	 */
 
+	DUK_HOBJECT_MATERIALIZE_LAZY(thr, obj);
 	duk__abandon_array_checked(thr, obj);
 	DUK_ASSERT(DUK_HOBJECT_GET_ASIZE(obj) == 0);
 
@@ -5969,13 +6002,17 @@ DUK_INTERNAL duk_bool_t duk_hobject_object_is_sealed_frozen_helper(duk_hthread *
 	DUK_ASSERT(obj != NULL);
 	DUK_UNREF(thr);
 
-	/* Note: no allocation pressure, no need to check refcounts etc */
+	/* Note: no allocation pressure (except when materializing a lazy
+	 * built-in), no need to check refcounts etc.
+	 */
 
 	/* must not be extensible */
 	if (DUK_HOBJECT_HAS_EXTENSIBLE(obj)) {
 		return 0;
 	}
 
+	DUK_HOBJECT_MATERIALIZE_LAZY(thr, obj);
+
 	/* all virtual properties are non-configurable and non-writable */
 
 	/* entry part must not contain any configurable properties, or
@@ -365,6 +365,9 @@ struct duk_hthread {
 
 DUK_INTERNAL_DECL void duk_hthread_copy_builtin_objects(duk_hthread *thr_from, duk_hthread *thr_to);
 DUK_INTERNAL_DECL void duk_hthread_create_builtin_objects(duk_hthread *thr);
+#if defined(DUK_USE_LAZY_BUILTINS) && !defined(DUK_USE_ROM_OBJECTS)
+DUK_INTERNAL_DECL void duk_hthread_materialize_builtin(duk_heap *heap, duk_hobject *obj);
+#endif
 DUK_INTERNAL_DECL duk_bool_t duk_hthread_init_stacks(duk_heap *heap, duk_hthread *thr);
 DUK_INTERNAL_DECL void duk_hthread_terminate(duk_hthread *thr);
 
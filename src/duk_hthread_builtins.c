@@ -207,12 +207,474 @@ DUK_LOCAL void duk__push_double(duk_context *ctx, duk_bitdecoder_ctx *bd) {
 	duk_push_number(ctx, du.d);  /* push operation normalizes NaNs */
 }
 
+DUK_LOCAL void duk__push_builtin(duk_context *ctx, duk_small_uint_t bidx) {
+	duk_hthread *thr = (duk_hthread *) ctx;
+
+	/* Objects with a thr->builtins[] index are looked up from there so
+	 * that this also works when materializing a lazy built-in.  Other
+	 * objects only exist on the value stack during heap creation, and
+	 * genbuiltins.py ensures lazy built-ins never refer to them.
+	 */
+	DUK_ASSERT(bidx != DUK__NO_BIDX_MARKER);
+	if (bidx < DUK_NUM_BUILTINS) {
+		duk_push_hobject(ctx, thr->builtins[bidx]);
+	} else {
+		duk_dup(ctx, (duk_idx_t) bidx);
+	}
+}
+
+/* Decode 'num' normal valued properties of built-in 'i' (at 'obj_idx'). */
+DUK_LOCAL void duk__init_builtin_normal_props(duk_hthread *thr, duk_bitdecoder_ctx *bd, duk_idx_t obj_idx, duk_small_uint_t i, duk_small_uint_t num) {
+	duk_context *ctx = (duk_context *) thr;
+	duk_small_uint_t j;
+
+	DUK_UNREF(i);  /* debug prints only */
+	DUK_DDD(DUK_DDDPRINT("built-in object %ld, %ld normal valued properties", (long) i, (long) num));
+	for (j = 0; j < num; j++) {
+		duk_small_uint_t prop_flags;
+		duk_small_uint_t t;
+
+		duk__push_stridx_or_string(ctx, bd);
+
+		/*
+		 *  Property attribute defaults are defined in E5 Section 15 (first
+		 *  few pages); there is a default for all properties and a special
+		 *  default for 'length' properties.  Variation from the defaults is
+		 *  signaled using a single flag bit in the bitstream.
+		 */
+
+		if (duk_bd_decode_flag(bd)) {
+			prop_flags = (duk_small_uint_t) duk_bd_decode(bd, DUK__PROP_FLAGS_BITS);
+		} else {
+			prop_flags = DUK_PROPDESC_FLAGS_WC;
+		}
+
+		t = (duk_small_uint_t) duk_bd_decode(bd, DUK__PROP_TYPE_BITS);
+
+		DUK_DDD(DUK_DDDPRINT("built-in %ld, normal-valued property %ld, key %!T, flags 0x%02lx, type %ld",
+		                     (long) i, (long) j, duk_get_tval(ctx, -1), (unsigned long) prop_flags, (long) t));
+
+		switch (t) {
+		case DUK__PROP_TYPE_DOUBLE: {
+			duk__push_double(ctx, bd);
+			break;
+		}
+		case DUK__PROP_TYPE_STRING: {
+			duk__push_string(ctx, bd);
+			break;
+		}
+		case DUK__PROP_TYPE_STRIDX: {
+			duk__push_stridx(ctx, bd);
+			break;
+		}
+		case DUK__PROP_TYPE_BUILTIN: {
+			duk_small_uint_t bidx;
+
+			bidx = (duk_small_uint_t) duk_bd_decode(bd, DUK__BIDX_BITS);
+			DUK_ASSERT(bidx != DUK__NO_BIDX_MARKER);
+			duk__push_builtin(ctx, bidx);
+			break;
+		}
+		case DUK__PROP_TYPE_UNDEFINED: {
+			duk_push_undefined(ctx);
+			break;
+		}
+		case DUK__PROP_TYPE_BOOLEAN_TRUE: {
+			duk_push_true(ctx);
+			break;
+		}
+		case DUK__PROP_TYPE_BOOLEAN_FALSE: {
+			duk_push_false(ctx);
+			break;
+		}
+		case DUK__PROP_TYPE_ACCESSOR: {
+			duk_small_uint_t natidx_getter = (duk_small_uint_t) duk_bd_decode(bd, DUK__NATIDX_BITS);
+			duk_small_uint_t natidx_setter = (duk_small_uint_t) duk_bd_decode(bd, DUK__NATIDX_BITS);
+			duk_c_function c_func_getter;
+			duk_c_function c_func_setter;
+
+			/* XXX: this is a bit awkward because there is no exposed helper
+			 * in the API style, only this internal helper.
+			 */
+			DUK_DDD(DUK_DDDPRINT("built-in accessor property: objidx=%ld, key=%!T, getteridx=%ld, setteridx=%ld, flags=0x%04lx",
+			                     (long) i, duk_get_tval(ctx, -1), (long) natidx_getter, (long) natidx_setter, (unsigned long) prop_flags));
+
+			c_func_getter = duk_bi_native_functions[natidx_getter];
+			c_func_setter = duk_bi_native_functions[natidx_setter];
+			duk_push_c_function_noconstruct_noexotic(ctx, c_func_getter, 0);  /* always 0 args */
+			duk_push_c_function_noconstruct_noexotic(ctx, c_func_setter, 1);  /* always 1 arg */
+
+			/* XXX: magic for getter/setter? use duk_def_prop()? */
+
+			DUK_ASSERT((prop_flags & DUK_PROPDESC_FLAG_WRITABLE) == 0);  /* genbuiltins.py ensures */
+
+			prop_flags |= DUK_PROPDESC_FLAG_ACCESSOR;  /* accessor flag not encoded explicitly */
+			duk_hobject_define_accessor_internal(thr,
+			                                     duk_require_hobject(ctx, obj_idx),
+			                                     duk_get_hstring(ctx, -3),
+			                                     duk_require_hobject(ctx, -2),
+			                                     duk_require_hobject(ctx, -1),
+			                                     prop_flags);
+			duk_pop_3(ctx);  /* key, getter and setter, now reachable through object */
+			goto skip_value;
+		}
+		default: {
+			/* exhaustive */
+			DUK_UNREACHABLE();
+		}
+		}
+
+		DUK_ASSERT((prop_flags & DUK_PROPDESC_FLAG_ACCESSOR) == 0);
+		duk_xdef_prop(ctx, obj_idx, prop_flags);
+
+	 skip_value:
+		continue;  /* avoid empty label at the end of a compound statement */
+	}
+}
+
+/* Decode the properties of built-in 'i' (at 'obj_idx') which follow the
+ * internal prototype, i.e. the whole property data of an eagerly created
+ * built-in or the deferred section of a lazy one.  Special post-tweaks for
+ * individual objects are applied here too so that they happen whenever the
+ * object's properties are actually created.
+ */
+DUK_LOCAL void duk__init_builtin_props(duk_hthread *thr, duk_bitdecoder_ctx *bd, duk_idx_t obj_idx, duk_small_uint_t i) {
+	duk_context *ctx = (duk_context *) thr;
+	duk_small_uint_t t;
+	duk_small_uint_t num;
+	duk_small_uint_t j;
+
+	t = (duk_small_uint_t) duk_bd_decode(bd, DUK__BIDX_BITS);
+	if (t != DUK__NO_BIDX_MARKER) {
+		/* 'prototype' property for all built-in objects (which have it) has attributes:
+		 *  [[Writable]] = false,
+		 *  [[Enumerable]] = false,
+		 *  [[Configurable]] = false
+		 */
+		DUK_DDD(DUK_DDDPRINT("set external prototype: built-in %ld", (long) t));
+		duk_xdef_prop_stridx_builtin(ctx, obj_idx, DUK_STRIDX_PROTOTYPE, t, DUK_PROPDESC_FLAGS_NONE);
+	}
+
+	t = (duk_small_uint_t) duk_bd_decode(bd, DUK__BIDX_BITS);
+	if (t != DUK__NO_BIDX_MARKER) {
+		/* 'constructor' property for all built-in objects (which have it) has attributes:
+		 *  [[Writable]] = true,
+		 *  [[Enumerable]] = false,
+		 *  [[Configurable]] = true
+		 */
+		DUK_DDD(DUK_DDDPRINT("set external constructor: built-in %ld", (long) t));
+		duk_xdef_prop_stridx_builtin(ctx, obj_idx, DUK_STRIDX_CONSTRUCTOR, t, DUK_PROPDESC_FLAGS_WC);
+	}
+
+	/* normal valued properties */
+	num = (duk_small_uint_t) duk_bd_decode(bd, DUK__NUM_NORMAL_PROPS_BITS);
+	duk__init_builtin_normal_props(thr, bd, obj_idx, i, num);
+
+	/* native function properties */
+	num = (duk_small_uint_t) duk_bd_decode(bd, DUK__NUM_FUNC_PROPS_BITS);
+	DUK_DDD(DUK_DDDPRINT("built-in object %ld, %ld function valued properties", (long) i, (long) num));
+	for (j = 0; j < num; j++) {
+		duk_hstring *h_key;
+		duk_small_uint_t natidx;
+		duk_int_t c_nargs;  /* must hold DUK_VARARGS */
+		duk_small_uint_t c_length;
+		duk_int16_t magic;
+		duk_c_function c_func;
+		duk_hnatfunc *h_func;
+#if defined(DUK_USE_LIGHTFUNC_BUILTINS)
+		duk_small_int_t lightfunc_eligible;
+#endif
+
+		duk__push_stridx_or_string(ctx, bd);
+		h_key = duk_get_hstring(ctx, -1);
+		DUK_ASSERT(h_key != NULL);
+		DUK_UNREF(h_key);
+		natidx = (duk_small_uint_t) duk_bd_decode(bd, DUK__NATIDX_BITS);
+
+		c_length = (duk_small_uint_t) duk_bd_decode(bd, DUK__LENGTH_PROP_BITS);
+		c_nargs = (duk_int_t) duk_bd_decode_flagged(bd, DUK__NARGS_BITS, (duk_int32_t) c_length /*def_value*/);
+		if (c_nargs == DUK__NARGS_VARARGS_MARKER) {
+			c_nargs = DUK_VARARGS;
+		}
+
+		c_func = duk_bi_native_functions[natidx];
+
+		DUK_DDD(DUK_DDDPRINT("built-in %ld, function-valued property %ld, key %!O, natidx %ld, length %ld, nargs %ld",
+		                     (long) i, (long) j, (duk_heaphdr *) h_key, (long) natidx, (long) c_length,
+		                     (c_nargs == DUK_VARARGS ? (long) -1 : (long) c_nargs)));
+
+		/* Cast converts magic to 16-bit signed value */
+		magic = (duk_int16_t) duk_bd_decode_flagged(bd, DUK__MAGIC_BITS, 0);
+
+#if defined(DUK_USE_LIGHTFUNC_BUILTINS)
+		lightfunc_eligible =
+			((c_nargs >= DUK_LFUNC_NARGS_MIN && c_nargs <= DUK_LFUNC_NARGS_MAX) || (c_nargs == DUK_VARARGS)) &&
+			(c_length <= DUK_LFUNC_LENGTH_MAX) &&
+			(magic >= DUK_LFUNC_MAGIC_MIN && magic <= DUK_LFUNC_MAGIC_MAX);
+
+		if (h_key == DUK_HTHREAD_STRING_EVAL(thr) ||
+		    h_key == DUK_HTHREAD_STRING_YIELD(thr) ||
+		    h_key == DUK_HTHREAD_STRING_RESUME(thr)) {
+			/* These functions have trouble working as lightfuncs.
+			 * Some of them have specific asserts and some may have
+		         * additional properties (e.g. 'require.id' may be written).
+			 */
+			DUK_D(DUK_DPRINT("reject as lightfunc: key=%!O, i=%d, j=%d", (duk_heaphdr *) h_key, (int) i, (int) j));
+			lightfunc_eligible = 0;
+		}
+
+		if (lightfunc_eligible) {
+			duk_tval tv_lfunc;
+			duk_small_uint_t lf_nargs = (c_nargs == DUK_VARARGS ? DUK_LFUNC_NARGS_VARARGS : c_nargs);
+			duk_small_uint_t lf_flags = DUK_LFUNC_FLAGS_PACK(magic, c_length, lf_nargs);
+			DUK_TVAL_SET_LIGHTFUNC(&tv_lfunc, c_func, lf_flags);
+			duk_push_tval(ctx, &tv_lfunc);
+			DUK_D(DUK_DPRINT("built-in function eligible as light function: i=%d, j=%d c_length=%ld, c_nargs=%ld, magic=%ld -> %!iT", (int) i, (int) j, (long) c_length, (long) c_nargs, (long) magic, duk_get_tval(ctx, -1)));
+			goto lightfunc_skip;
+		}
+
+		DUK_D(DUK_DPRINT("built-in function NOT ELIGIBLE as light function: i=%d, j=%d c_length=%ld, c_nargs=%ld, magic=%ld", (int) i, (int) j, (long) c_length, (long) c_nargs, (long) magic));
+#endif  /* DUK_USE_LIGHTFUNC_BUILTINS */
+
+		/* [ (builtin objects) name ] */
+
+		duk_push_c_function_noconstruct_noexotic(ctx, c_func, c_nargs);
+		h_func = duk_require_hnatfunc(ctx, -1);
+		DUK_UNREF(h_func);
+
+		/* Currently all built-in native functions are strict.
+		 * This doesn't matter for many functions, but e.g.
+		 * String.prototype.charAt (and other string functions)
+		 * rely on being strict so that their 'this' binding is
+		 * not automatically coerced.
+		 */
+		DUK_HOBJECT_SET_STRICT((duk_hobject *) h_func);
+
+		/* No built-in functions are constructable except the top
+		 * level ones (Number, etc).
+		 */
+		DUK_ASSERT(!DUK_HOBJECT_HAS_CONSTRUCTABLE((duk_hobject *) h_func));
+
+		/* XXX: any way to avoid decoding magic bit; there are quite
+		 * many function properties and relatively few with magic values.
+		 */
+		h_func->magic = magic;
+
+		/* [ (builtin objects) name func ] */
+
+		duk_push_int(ctx, c_length);
+		duk_xdef_prop_stridx(ctx, -2, DUK_STRIDX_LENGTH, DUK_PROPDESC_FLAGS_NONE);
+
+		duk_dup(ctx, -2);
+		duk_xdef_prop_stridx(ctx, -2, DUK_STRIDX_NAME, DUK_PROPDESC_FLAGS_NONE);
+
+		/* XXX: other properties of function instances; 'arguments', 'caller'. */
+
+		DUK_DD(DUK_DDPRINT("built-in object %ld, function property %ld -> %!T",
+		                   (long) i, (long) j, (duk_tval *) duk_get_tval(ctx, -1)));
+
+		/* [ (builtin objects) name func ] */
+
+		/*
+		 *  The default property attributes are correct for all
+		 *  function valued properties of built-in objects now.
+		 */
+
+#if defined(DUK_USE_LIGHTFUNC_BUILTINS)
+	 lightfunc_skip:
+#endif
+
+		duk_xdef_prop(ctx, obj_idx, DUK_PROPDESC_FLAGS_WC);
+
+		/* [ (builtin objects) ] */
+	}
+
+	/*
+	 *  Special post-tweaks, for cases not covered by the init data format.
+	 *
+	 *  - Set Date.prototype.toGMTString to Date.prototype.toUTCString.
+	 *    toGMTString is required to have the same Function object as
+	 *    toUTCString in E5 Section B.2.6.  Note that while Smjs respects
+	 *    this, V8 does not (the Function objects are distinct).
+	 *
+	 *  - Possibly remove some properties (values or methods) which are not
+	 *    desirable with current feature options but are not currently
+	 *    conditional in init data.
+	 */
+
+	if (i == DUK_BIDX_DATE_PROTOTYPE) {
+		duk_get_prop_stridx(ctx, obj_idx, DUK_STRIDX_TO_UTC_STRING);
+		duk_xdef_prop_stridx(ctx, obj_idx, DUK_STRIDX_TO_GMT_STRING, DUK_PROPDESC_FLAGS_WC);
+	}
+
+#if !defined(DUK_USE_ES6_OBJECT_PROTO_PROPERTY)
+	if (i == DUK_BIDX_OBJECT_PROTOTYPE) {
+		DUK_DD(DUK_DDPRINT("delete Object.prototype.__proto__ built-in which is not enabled in features"));
+		(void) duk_hobject_delprop_raw(thr, thr->builtins[DUK_BIDX_OBJECT_PROTOTYPE], DUK_HTHREAD_STRING___PROTO__(thr), DUK_DELPROP_FLAG_THROW);
+	}
+#endif
+
+#if !defined(DUK_USE_ES6_OBJECT_SETPROTOTYPEOF)
+	if (i == DUK_BIDX_OBJECT_CONSTRUCTOR) {
+		DUK_DD(DUK_DDPRINT("delete Object.setPrototypeOf built-in which is not enabled in features"));
+		(void) duk_hobject_delprop_raw(thr, thr->builtins[DUK_BIDX_OBJECT_CONSTRUCTOR], DUK_HTHREAD_STRING_SET_PROTOTYPE_OF(thr), DUK_DELPROP_FLAG_THROW);
+	}
+#endif
+}
+
+#if defined(DUK_USE_LAZY_BUILTINS)
+/* Decode the deferred property section of lazy built-in 'i' (at 'obj_idx'),
+ * located using the bit offsets emitted by genbuiltins.py.
+ */
+DUK_LOCAL void duk__init_builtin_lazy_props(duk_hthread *thr, duk_idx_t obj_idx, duk_small_uint_t i) {
+	duk_bitdecoder_ctx bd_ctx;
+	duk_bitdecoder_ctx *bd = &bd_ctx;  /* convenience */
+	duk_uint32_t bitoff;
+
+	DUK_ASSERT(i < DUK_NUM_BUILTINS);
+	bitoff = (duk_uint32_t) duk_builtins_lazy_offsets[i];
+	DUK_ASSERT(bitoff > 0);
+
+	DUK_MEMZERO(&bd_ctx, sizeof(bd_ctx));
+	bd->data = (const duk_uint8_t *) duk_builtins_data;
+	bd->length = (duk_size_t) DUK_BUILTINS_DATA_LENGTH;
+	bd->offset = (duk_size_t) (bitoff >> 3);
+	if (bitoff & 0x07) {
+		(void) duk_bd_decode(bd, (duk_small_int_t) (bitoff & 0x07));
+	}
+
+	duk__init_builtin_props(thr, bd, obj_idx, i);
+}
+
+/* Materialize a lazy built-in on first access, called from property lookup
+ * code (see DUK_HOBJECT_MATERIALIZE_LAZY()).  Only the heap's initial realm
+ * (heap_thread) has lazy built-ins, so the object and any built-ins it
+ * refers to are resolved using heap_thread regardless of the calling
+ * thread, which may belong to another realm or have a replaced global
+ * object.  The caller may hold pointers into the value stack and other
+ * objects' property tables, so:
+ *
+ *   - The value stack is never resized: only plain pushes are used and the
+ *     internal spare (DUK_VALSTACK_INTERNAL_EXTRA) is assumed to suffice.
+ *
+ *   - Finalizers and object compaction are prevented while materializing,
+ *     like in duk_hobject_realloc_props().
+ *
+ * Decoding may fail midway, e.g. on out-of-memory.  The error is caught so
+ * that the object can be marked lazy again before rethrowing, and the next
+ * access retries.  Re-decoding is safe because the deferred properties are
+ * defined with forced (internal) defines which overwrite existing values.
+ *
+ * Internal properties are created eagerly, so lookups for internal keys
+ * (e.g. finalizer lookups during GC) never get here.
+ */
+DUK_INTERNAL void duk_hthread_materialize_builtin(duk_heap *heap, duk_hobject *obj) {
+	duk_hthread *thr;
+	duk_context *ctx;
+	duk_small_uint_t i;
+	duk_idx_t entry_top;
+	duk_jmpbuf our_jmpbuf;
+	duk_jmpbuf *old_jmpbuf_ptr;
+#if defined(DUK_USE_MARK_AND_SWEEP)
+	duk_small_uint_t prev_mark_and_sweep_base_flags;
+#endif
+
+	DUK_ASSERT(heap != NULL);
+	DUK_ASSERT(obj != NULL);
+	DUK_ASSERT(DUK_HOBJECT_HAS_LAZY_BUILTIN(obj));
+
+	thr = heap->heap_thread;
+	ctx = (duk_context *) thr;
+	DUK_ASSERT(thr != NULL);
+
+	/* The only heap_thread->builtins[] entries modified after heap
+	 * creation are DUK_BIDX_GLOBAL and DUK_BIDX_GLOBAL_ENV, replaced by
+	 * duk_set_global_object() on the heap's initial context.
+	 * genbuiltins.py never makes those lazy or lets a lazy built-in
+	 * refer to them, so a lazy built-in is always found here and the
+	 * built-ins it refers to are the original ones.
+	 */
+	DUK_ASSERT(duk_builtins_lazy_offsets[DUK_BIDX_GLOBAL] == 0);
+	DUK_ASSERT(duk_builtins_lazy_offsets[DUK_BIDX_GLOBAL_ENV] == 0);
+	for (i = 0; i < DUK_NUM_BUILTINS; i++) {
+		if (thr->builtins[i] == obj) {
+			break;
+		}
+	}
+	if (i >= DUK_NUM_BUILTINS) {
+		/* Should never happen.  Leave the object lazy and fail the
+		 * access rather than let it appear empty.
+		 */
+		DUK_D(DUK_DPRINT("lazy built-in not found in heap_thread builtins: %p", (void *) obj));
+		DUK_ASSERT(0);
+		DUK_ERROR_INTERNAL(thr);
+	}
+	DUK_ASSERT(duk_builtins_lazy_offsets[i] != 0);
+
+	/* Clear before decoding: the property writes below look up the object. */
+	DUK_HOBJECT_CLEAR_LAZY_BUILTIN(obj);
+
+	DUK_DD(DUK_DDPRINT("materialize lazy built-in %ld: %!O", (long) i, (duk_heaphdr *) obj));
+
+#if defined(DUK_USE_MARK_AND_SWEEP)
+	prev_mark_and_sweep_base_flags = thr->heap->mark_and_sweep_base_flags;
+	thr->heap->mark_and_sweep_base_flags |=
+	        DUK_MS_FLAG_NO_FINALIZERS |         /* avoid attempts to add/remove object keys */
+	        DUK_MS_FLAG_NO_OBJECT_COMPACTION;   /* avoid compacting objects the caller may be accessing */
+#endif
+
+	entry_top = duk_get_top(ctx);
+	old_jmpbuf_ptr = thr->heap->lj.jmpbuf_ptr;
+	thr->heap->lj.jmpbuf_ptr = &our_jmpbuf;
+
+#if defined(DUK_USE_CPP_EXCEPTIONS)
+	try {
+#else
+	if (DUK_SETJMP(our_jmpbuf.jb) == 0) {
+#endif
+		duk_push_hobject(ctx, obj);
+		duk__init_builtin_lazy_props(thr, duk_get_top_index(ctx), i);
+		duk_pop(ctx);
+		duk_hobject_compact_props(thr, obj);
+
+		thr->heap->lj.jmpbuf_ptr = old_jmpbuf_ptr;
+#if defined(DUK_USE_CPP_EXCEPTIONS)
+	} catch (duk_internal_exception &exc) {
+		DUK_UNREF(exc);
+#else
+	} else {
+#endif
+		/* Restore the catcher first so that errors in error handling
+		 * propagate outwards.  The error being thrown is kept in
+		 * heap->lj, which is reachable for GC, while the partially
+		 * decoded values are popped.
+		 */
+		DUK_D(DUK_DPRINT("materializing lazy built-in %ld failed, leave it lazy: %!T",
+		                 (long) i, (duk_tval *) &thr->heap->lj.value1));
+		DUK_ASSERT(thr->heap->lj.type == DUK_LJ_TYPE_THROW);
+		thr->heap->lj.jmpbuf_ptr = old_jmpbuf_ptr;
+		duk_set_top(ctx, entry_top);
+		DUK_HOBJECT_SET_LAZY_BUILTIN(obj);
+#if defined(DUK_USE_MARK_AND_SWEEP)
+		thr->heap->mark_and_sweep_base_flags = prev_mark_and_sweep_base_flags;
+#endif
+		duk_err_longjmp(thr);
+		DUK_UNREACHABLE();
+	}
+
+#if defined(DUK_USE_MARK_AND_SWEEP)
+	thr->heap->mark_and_sweep_base_flags = prev_mark_and_sweep_base_flags;
+#endif
+}
+#endif  /* DUK_USE_LAZY_BUILTINS */
+
 DUK_INTERNAL void duk_hthread_create_builtin_objects(duk_hthread *thr) {
 	duk_context *ctx = (duk_context *) thr;
 	duk_bitdecoder_ctx bd_ctx;
 	duk_bitdecoder_ctx *bd = &bd_ctx;  /* convenience */
 	duk_hobject *h;
-	duk_small_uint_t i, j;
+	duk_small_uint_t i;
+	duk_small_int_t lazy_init;
 
 	DUK_D(DUK_DPRINT("INITBUILTINS BEGIN: DUK_NUM_BUILTINS=%d, DUK_NUM_BUILTINS_ALL=%d", (int) DUK_NUM_BUILTINS, (int) DUK_NUM_ALL_BUILTINS));
 
@@ -379,296 +841,71 @@ DUK_INTERNAL void duk_hthread_create_builtin_objects(duk_hthread *thr) {
 	for (i = 0; i < DUK_NUM_ALL_BUILTINS; i++) {
 		duk_small_uint_t t;
 		duk_small_uint_t num;
+		duk_small_int_t lazy;
 
 		DUK_DDD(DUK_DDDPRINT("initializing built-in object at index %ld", (long) i));
 		h = duk_require_hobject(ctx, i);
 		DUK_ASSERT(h != NULL);
 
+		lazy = duk_bd_decode_flag(bd);
+
 		t = (duk_small_uint_t) duk_bd_decode(bd, DUK__BIDX_BITS);
 		if (t != DUK__NO_BIDX_MARKER) {
 			DUK_DDD(DUK_DDDPRINT("set internal prototype: built-in %ld", (long) t));
 			DUK_HOBJECT_SET_PROTOTYPE_UPDREF(thr, h, duk_require_hobject(ctx, t));
 		}
 
-		t = (duk_small_uint_t) duk_bd_decode(bd, DUK__BIDX_BITS);
-		if (t != DUK__NO_BIDX_MARKER) {
-			/* 'prototype' property for all built-in objects (which have it) has attributes:
-			 *  [[Writable]] = false,
-			 *  [[Enumerable]] = false,
-			 *  [[Configurable]] = false
-			 */
-			DUK_DDD(DUK_DDDPRINT("set external prototype: built-in %ld", (long) t));
-			duk_xdef_prop_stridx_builtin(ctx, i, DUK_STRIDX_PROTOTYPE, t, DUK_PROPDESC_FLAGS_NONE);
+		if (!lazy) {
+			duk__init_builtin_props(thr, bd, i, i);
+			continue;
 		}
 
-		t = (duk_small_uint_t) duk_bd_decode(bd, DUK__BIDX_BITS);
-		if (t != DUK__NO_BIDX_MARKER) {
-			/* 'constructor' property for all built-in objects (which have it) has attributes:
-			 *  [[Writable]] = true,
-			 *  [[Enumerable]] = false,
-			 *  [[Configurable]] = true
-			 */
-			DUK_DDD(DUK_DDDPRINT("set external constructor: built-in %ld", (long) t));
-			duk_xdef_prop_stridx_builtin(ctx, i, DUK_STRIDX_CONSTRUCTOR, t, DUK_PROPDESC_FLAGS_WC);
-		}
-
-		/* normal valued properties */
-		num = (duk_small_uint_t) duk_bd_decode(bd, DUK__NUM_NORMAL_PROPS_BITS);
-		DUK_DDD(DUK_DDDPRINT("built-in object %ld, %ld normal valued properties", (long) i, (long) num));
-		for (j = 0; j < num; j++) {
-			duk_small_uint_t prop_flags;
-
-			duk__push_stridx_or_string(ctx, bd);
-
-			/*
-			 *  Property attribute defaults are defined in E5 Section 15 (first
-			 *  few pages); there is a default for all properties and a special
-			 *  default for 'length' properties.  Variation from the defaults is
-			 *  signaled using a single flag bit in the bitstream.
-			 */
-
-			if (duk_bd_decode_flag(bd)) {
-				prop_flags = (duk_small_uint_t) duk_bd_decode(bd, DUK__PROP_FLAGS_BITS);
-			} else {
-				prop_flags = DUK_PROPDESC_FLAGS_WC;
-			}
-
-			t = (duk_small_uint_t) duk_bd_decode(bd, DUK__PROP_TYPE_BITS);
-
-			DUK_DDD(DUK_DDDPRINT("built-in %ld, normal-valued property %ld, key %!T, flags 0x%02lx, type %ld",
-			                     (long) i, (long) j, duk_get_tval(ctx, -1), (unsigned long) prop_flags, (long) t));
-
-			switch (t) {
-			case DUK__PROP_TYPE_DOUBLE: {
-				duk__push_double(ctx, bd);
-				break;
-			}
-			case DUK__PROP_TYPE_STRING: {
-				duk__push_string(ctx, bd);
-				break;
-			}
-			case DUK__PROP_TYPE_STRIDX: {
-				duk__push_stridx(ctx, bd);
-				break;
-			}
-			case DUK__PROP_TYPE_BUILTIN: {
-				duk_small_uint_t bidx;
-
-				bidx = (duk_small_uint_t) duk_bd_decode(bd, DUK__BIDX_BITS);
-				DUK_ASSERT(bidx != DUK__NO_BIDX_MARKER);
-				duk_dup(ctx, (duk_idx_t) bidx);
-				break;
-			}
-			case DUK__PROP_TYPE_UNDEFINED: {
-				duk_push_undefined(ctx);
-				break;
-			}
-			case DUK__PROP_TYPE_BOOLEAN_TRUE: {
-				duk_push_true(ctx);
-				break;
-			}
-			case DUK__PROP_TYPE_BOOLEAN_FALSE: {
-				duk_push_false(ctx);
-				break;
-			}
-			case DUK__PROP_TYPE_ACCESSOR: {
-				duk_small_uint_t natidx_getter = (duk_small_uint_t) duk_bd_decode(bd, DUK__NATIDX_BITS);
-				duk_small_uint_t natidx_setter = (duk_small_uint_t) duk_bd_decode(bd, DUK__NATIDX_BITS);
-				duk_c_function c_func_getter;
-				duk_c_function c_func_setter;
-
-				/* XXX: this is a bit awkward because there is no exposed helper
-				 * in the API style, only this internal helper.
-				 */
-				DUK_DDD(DUK_DDDPRINT("built-in accessor property: objidx=%ld, key=%!T, getteridx=%ld, setteridx=%ld, flags=0x%04lx",
-				                     (long) i, duk_get_tval(ctx, -1), (long) natidx_getter, (long) natidx_setter, (unsigned long) prop_flags));
-
-				c_func_getter = duk_bi_native_functions[natidx_getter];
-				c_func_setter = duk_bi_native_functions[natidx_setter];
-				duk_push_c_function_noconstruct_noexotic(ctx, c_func_getter, 0);  /* always 0 args */
-				duk_push_c_function_noconstruct_noexotic(ctx, c_func_setter, 1);  /* always 1 arg */
-
-				/* XXX: magic for getter/setter? use duk_def_prop()? */
-
-				DUK_ASSERT((prop_flags & DUK_PROPDESC_FLAG_WRITABLE) == 0);  /* genbuiltins.py ensures */
-
-				prop_flags |= DUK_PROPDESC_FLAG_ACCESSOR;  /* accessor flag not encoded explicitly */
-				duk_hobject_define_accessor_internal(thr,
-				                                     duk_require_hobject(ctx, i),
-				                                     duk_get_hstring(ctx, -3),
-				                                     duk_require_hobject(ctx, -2),
-				                                     duk_require_hobject(ctx, -1),
-				                                     prop_flags);
-				duk_pop_3(ctx);  /* key, getter and setter, now reachable through object */
-				goto skip_value;
-			}
-			default: {
-				/* exhaustive */
-				DUK_UNREACHABLE();
-			}
-			}
-
-			DUK_ASSERT((prop_flags & DUK_PROPDESC_FLAG_ACCESSOR) == 0);
-			duk_xdef_prop(ctx, i, prop_flags);
+		/* Lazy built-in: internal properties are created right away,
+		 * the rest is in a deferred section decoded below or on first
+		 * access.  The flag marks the object for both cases.
+		 */
+		DUK_ASSERT(i < DUK_NUM_BUILTINS);
+		num = (duk_small_uint_t) duk_bd_decode_flagged(bd, DUK__NUM_NORMAL_PROPS_BITS, 0 /*def_value*/);
+		duk__init_builtin_normal_props(thr, bd, i, i, num);
+		DUK_HOBJECT_SET_LAZY_BUILTIN(h);
+	}
 
-		 skip_value:
-			continue;  /* avoid empty label at the end of a compound statement */
-		}
+	/*
+	 *  The deferred sections of lazy built-ins follow the per-object data
+	 *  in built-in index order.  With DUK_USE_LAZY_BUILTINS they're left
+	 *  to be decoded on first access for the heap's initial realm.  Realms
+	 *  created later with duk_push_thread_new_globalenv() are initialized
+	 *  eagerly because materialization resolves built-ins through
+	 *  heap_thread.
+	 */
 
-		/* native function properties */
-		num = (duk_small_uint_t) duk_bd_decode(bd, DUK__NUM_FUNC_PROPS_BITS);
-		DUK_DDD(DUK_DDDPRINT("built-in object %ld, %ld function valued properties", (long) i, (long) num));
-		for (j = 0; j < num; j++) {
-			duk_hstring *h_key;
-			duk_small_uint_t natidx;
-			duk_int_t c_nargs;  /* must hold DUK_VARARGS */
-			duk_small_uint_t c_length;
-			duk_int16_t magic;
-			duk_c_function c_func;
-			duk_hnatfunc *h_func;
-#if defined(DUK_USE_LIGHTFUNC_BUILTINS)
-			duk_small_int_t lightfunc_eligible;
+	lazy_init = 0;
+#if defined(DUK_USE_LAZY_BUILTINS)
+	lazy_init = (thr == thr->heap->heap_thread);
 #endif
-
-			duk__push_stridx_or_string(ctx, bd);
-			h_key = duk_get_hstring(ctx, -1);
-			DUK_ASSERT(h_key != NULL);
-			DUK_UNREF(h_key);
-			natidx = (duk_small_uint_t) duk_bd_decode(bd, DUK__NATIDX_BITS);
-
-			c_length = (duk_small_uint_t) duk_bd_decode(bd, DUK__LENGTH_PROP_BITS);
-			c_nargs = (duk_int_t) duk_bd_decode_flagged(bd, DUK__NARGS_BITS, (duk_int32_t) c_length /*def_value*/);
-			if (c_nargs == DUK__NARGS_VARARGS_MARKER) {
-				c_nargs = DUK_VARARGS;
+	if (!lazy_init) {
+		for (i = 0; i < DUK_NUM_BUILTINS; i++) {
+			h = duk_require_hobject(ctx, i);
+			if (DUK_HOBJECT_HAS_LAZY_BUILTIN(h)) {
+				DUK_HOBJECT_CLEAR_LAZY_BUILTIN(h);
+				duk__init_builtin_props(thr, bd, i, i);
 			}
-
-			c_func = duk_bi_native_functions[natidx];
-
-			DUK_DDD(DUK_DDDPRINT("built-in %ld, function-valued property %ld, key %!O, natidx %ld, length %ld, nargs %ld",
-			                     (long) i, (long) j, (duk_heaphdr *) h_key, (long) natidx, (long) c_length,
-			                     (c_nargs == DUK_VARARGS ? (long) -1 : (long) c_nargs)));
-
-			/* Cast converts magic to 16-bit signed value */
-			magic = (duk_int16_t) duk_bd_decode_flagged(bd, DUK__MAGIC_BITS, 0);
-
-#if defined(DUK_USE_LIGHTFUNC_BUILTINS)
-			lightfunc_eligible =
-				((c_nargs >= DUK_LFUNC_NARGS_MIN && c_nargs <= DUK_LFUNC_NARGS_MAX) || (c_nargs == DUK_VARARGS)) &&
-				(c_length <= DUK_LFUNC_LENGTH_MAX) &&
-				(magic >= DUK_LFUNC_MAGIC_MIN && magic <= DUK_LFUNC_MAGIC_MAX);
-
-			if (h_key == DUK_HTHREAD_STRING_EVAL(thr) ||
-			    h_key == DUK_HTHREAD_STRING_YIELD(thr) ||
-			    h_key == DUK_HTHREAD_STRING_RESUME(thr)) {
-				/* These functions have trouble working as lightfuncs.
-				 * Some of them have specific asserts and some may have
-			         * additional properties (e.g. 'require.id' may be written).
-				 */
-				DUK_D(DUK_DPRINT("reject as lightfunc: key=%!O, i=%d, j=%d", (duk_heaphdr *) h_key, (int) i, (int) j));
-				lightfunc_eligible = 0;
-			}
-
-			if (lightfunc_eligible) {
-				duk_tval tv_lfunc;
-				duk_small_uint_t lf_nargs = (c_nargs == DUK_VARARGS ? DUK_LFUNC_NARGS_VARARGS : c_nargs);
-				duk_small_uint_t lf_flags = DUK_LFUNC_FLAGS_PACK(magic, c_length, lf_nargs);
-				DUK_TVAL_SET_LIGHTFUNC(&tv_lfunc, c_func, lf_flags);
-				duk_push_tval(ctx, &tv_lfunc);
-				DUK_D(DUK_DPRINT("built-in function eligible as light function: i=%d, j=%d c_length=%ld, c_nargs=%ld, magic=%ld -> %!iT", (int) i, (int) j, (long) c_length, (long) c_nargs, (long) magic, duk_get_tval(ctx, -1)));
-				goto lightfunc_skip;
-			}
-
-			DUK_D(DUK_DPRINT("built-in function NOT ELIGIBLE as light function: i=%d, j=%d c_length=%ld, c_nargs=%ld, magic=%ld", (int) i, (int) j, (long) c_length, (long) c_nargs, (long) magic));
-#endif  /* DUK_USE_LIGHTFUNC_BUILTINS */
-
-			/* [ (builtin objects) name ] */
-
-			duk_push_c_function_noconstruct_noexotic(ctx, c_func, c_nargs);
-			h_func = duk_require_hnatfunc(ctx, -1);
-			DUK_UNREF(h_func);
-
-			/* Currently all built-in native functions are strict.
-			 * This doesn't matter for many functions, but e.g.
-			 * String.prototype.charAt (and other string functions)
-			 * rely on being strict so that their 'this' binding is
-			 * not automatically coerced.
-			 */
-			DUK_HOBJECT_SET_STRICT((duk_hobject *) h_func);
-
-			/* No built-in functions are constructable except the top
-			 * level ones (Number, etc).
-			 */
-			DUK_ASSERT(!DUK_HOBJECT_HAS_CONSTRUCTABLE((duk_hobject *) h_func));
-
-			/* XXX: any way to avoid decoding magic bit; there are quite
-			 * many function properties and relatively few with magic values.
-			 */
-			h_func->magic = magic;
-
-			/* [ (builtin objects) name func ] */
-
-			duk_push_int(ctx, c_length);
-			duk_xdef_prop_stridx(ctx, -2, DUK_STRIDX_LENGTH, DUK_PROPDESC_FLAGS_NONE);
-
-			duk_dup(ctx, -2);
-			duk_xdef_prop_stridx(ctx, -2, DUK_STRIDX_NAME, DUK_PROPDESC_FLAGS_NONE);
-
-			/* XXX: other properties of function instances; 'arguments', 'caller'. */
-
-			DUK_DD(DUK_DDPRINT("built-in object %ld, function property %ld -> %!T",
-			                   (long) i, (long) j, (duk_tval *) duk_get_tval(ctx, -1)));
-
-			/* [ (builtin objects) name func ] */
-
-			/*
-			 *  The default property attributes are correct for all
-			 *  function valued properties of built-in objects now.
-			 */
-
-#if defined(DUK_USE_LIGHTFUNC_BUILTINS)
-		 lightfunc_skip:
-#endif
-
-			duk_xdef_prop(ctx, i, DUK_PROPDESC_FLAGS_WC);
-
-			/* [ (builtin objects) ] */
 		}
 	}
 
 	/*
 	 *  Special post-tweaks, for cases not covered by the init data format.
-	 *
-	 *  - Set Date.prototype.toGMTString to Date.prototype.toUTCString.
-	 *    toGMTString is required to have the same Function object as
-	 *    toUTCString in E5 Section B.2.6.  Note that while Smjs respects
-	 *    this, V8 does not (the Function objects are distinct).
+	 *  Tweaks which add or remove properties are in duk__init_builtin_props().
 	 *
 	 *  - Make DoubleError non-extensible.
 	 *
 	 *  - Add info about most important effective compile options to Duktape.
-	 *
-	 *  - Possibly remove some properties (values or methods) which are not
-	 *    desirable with current feature options but are not currently
-	 *    conditional in init data.
 	 */
 
-	duk_get_prop_stridx(ctx, DUK_BIDX_DATE_PROTOTYPE, DUK_STRIDX_TO_UTC_STRING);
-	duk_xdef_prop_stridx(ctx, DUK_BIDX_DATE_PROTOTYPE, DUK_STRIDX_TO_GMT_STRING, DUK_PROPDESC_FLAGS_WC);
-
 	h = duk_require_hobject(ctx, DUK_BIDX_DOUBLE_ERROR);
 	DUK_ASSERT(h != NULL);
 	DUK_HOBJECT_CLEAR_EXTENSIBLE(h);
 
-#if !defined(DUK_USE_ES6_OBJECT_PROTO_PROPERTY)
-	DUK_DD(DUK_DDPRINT("delete Object.prototype.__proto__ built-in which is not enabled in features"));
-	(void) duk_hobject_delprop_raw(thr, thr->builtins[DUK_BIDX_OBJECT_PROTOTYPE], DUK_HTHREAD_STRING___PROTO__(thr), DUK_DELPROP_FLAG_THROW);
-#endif
-
-#if !defined(DUK_USE_ES6_OBJECT_SETPROTOTYPEOF)
-	DUK_DD(DUK_DDPRINT("delete Object.setPrototypeOf built-in which is not enabled in features"));
-	(void) duk_hobject_delprop_raw(thr, thr->builtins[DUK_BIDX_OBJECT_CONSTRUCTOR], DUK_HTHREAD_STRING_SET_PROTOTYPE_OF(thr), DUK_DELPROP_FLAG_THROW);
-#endif
-
 	/* XXX: relocate */
 	duk_push_string(ctx,
 			/* Endianness indicator */
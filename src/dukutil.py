@@ -9,60 +9,58 @@ import json
 class BitEncoder:
 	"Bitstream encoder."
 
-	_bits = None
+	# Complete bytes are appended to a bytearray; the trailing partial
+	# byte (fewer than 8 bits) is kept in an integer accumulator.
+
+	_bytes = None
+	_acc = None
+	_accbits = None
 
 	def __init__(self):
-		self._bits = []
+		self._bytes = bytearray()
+		self._acc = 0
+		self._accbits = 0
 
 	def bits(self, x, nbits):
 		if (x >> nbits) != 0:
 			raise Exception('input value has too many bits (value: %d, bits: %d)' % (x, nbits))
-		for i in xrange(nbits):
-			t = (x >> (nbits - i - 1)) & 0x01
-			self._bits.append(t)
+		acc = (self._acc << nbits) | x
+		accbits = self._accbits + nbits
+		while accbits >= 8:
+			accbits -= 8
+			self._bytes.append((acc >> accbits) & 0xff)
+		self._acc = acc & ((1 << accbits) - 1)
+		self._accbits = accbits
 
 	def string(self, x):
-		nbits = len(x) * 8
-
-		for i in xrange(nbits):
-			byteidx = i / 8
-			bitidx = i % 8
-			if byteidx < 0 or byteidx >= len(x):
-				self._bits.append(0)
-			else:
-				t = (ord(x[byteidx]) >> (7 - bitidx)) & 0x01
-				self._bits.append(t)
+		if self._accbits == 0:
+			# Byte aligned, no shifting needed.
+			self._bytes.extend(x)
+			return
+		for c in x:
+			self.bits(ord(c), 8)
 
 	def getNumBits(self):
 		"Get current number of encoded bits."
-		return len(self._bits)
+		return len(self._bytes) * 8 + self._accbits
 
 	def getNumBytes(self):
 		"Get current number of encoded bytes, rounded up."
-		nbits = len(self._bits)
-		while (nbits % 8) != 0:
-			nbits += 1
-		return nbits / 8
+		return (self.getNumBits() + 7) / 8
 
 	def getBytes(self):
 		"Get current bitstream as a byte sequence, padded with zero bits."
-		bytes = []
-
-		for i in xrange(self.getNumBytes()):
-			t = 0
-			for j in xrange(8):
-				off = i*8 + j
-				if off >= len(self._bits):
-					t = (t << 1)
-				else:
-					t = (t << 1) + self._bits[off]
-			bytes.append(t)
-
-		return bytes
+		return list(self._getPadded())
 
 	def getByteString(self):
 		"Get current bitstream as a string."
-		return ''.join([chr(i) for i in self.getBytes()])
+		return str(self._getPadded())
+
+	def _getPadded(self):
+		res = bytearray(self._bytes)
+		if self._accbits > 0:
+			res.append((self._acc << (8 - self._accbits)) & 0xff)
+		return res
 
 class GenerateC:
 	"Helper for generating C source and header files."
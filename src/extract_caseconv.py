@@ -17,46 +17,21 @@
 #  above U+FFFF) are omitted as they're not required for standard
 #  Ecmascript.
 #
+#  UnicodeData.txt is read using unicode_db.py.  make_dist calls
+#  generate_caseconv_files() directly with a shared database.
+#
 
 import os, sys, math
 import optparse
 import dukutil
-
-class UnicodeData:
-        "Read UnicodeData.txt into an internal representation."
-
-	def __init__(self, filename):
-		self.data = self.read_unicode_data(filename)
-		print 'read %d unicode data entries' % len(self.data)
-
-	def read_unicode_data(self, filename):
-		res = []
-		f = open(filename, 'rb')
-		for line in f:
-			if line.startswith('#'):
-				continue
-			line = line.strip()
-			if line == '':
-				continue
-			parts = line.split(';')
-			if len(parts) != 15:
-				raise Exception('invalid unicode data line')
-			res.append(parts)
-		f.close()
-
-		# Sort based on Unicode codepoint
-		def mycmp(a,b):
-			return cmp(long(a[0], 16), long(b[0], 16))
-
-		res.sort(cmp=mycmp)
-		return res
+import unicode_db
 
 class SpecialCasing:
 	"Read SpecialCasing.txt into an internal representation."
 
-	def __init__(self, filename):
+	def __init__(self, filename, log=sys.stdout):
 		self.data = self.read_special_casing_data(filename)
-		print 'read %d special casing entries' % len(self.data)
+		log.write('read %d special casing entries\n' % len(self.data))
 
 	def read_special_casing_data(self, filename):
 		res = []
@@ -87,37 +62,36 @@ def parse_unicode_sequence(x):
 		res += unichr(long(i, 16))
 	return res
 
-def get_base_conversion_maps(unicode_data):
+def get_base_conversion_maps(db):
 	"Create case conversion tables without handling special casing yet."
 
 	uc = {}		# codepoint (number) -> string
 	lc = {}
 	tc = {}         # titlecase
 
-	for x in unicode_data.data:
-		c1 = long(x[0], 16)
+	for c1, f_uc, f_lc, f_tc in db.case_mappings:
 
 		# just 16-bit support needed
 		if c1 >= 0x10000:
 			continue
 
-		if x[12] != '':
+		if f_uc != '':
 			# field 12: simple uppercase mapping
-			c2 = parse_unicode_sequence(x[12])
+			c2 = parse_unicode_sequence(f_uc)
 			uc[c1] = c2
 			tc[c1] = c2	# titlecase default == uppercase, overridden below if necessary
-		if x[13] != '':
+		if f_lc != '':
 			# field 13: simple lowercase mapping
-			c2 = parse_unicode_sequence(x[13])
+			c2 = parse_unicode_sequence(f_lc)
 			lc[c1] = c2
-		if x[14] != '':
+		if f_tc != '':
 			# field 14: simple titlecase mapping
-			c2 = parse_unicode_sequence(x[14])
+			c2 = parse_unicode_sequence(f_tc)
 			tc[c1] = c2
 
 	return uc, lc, tc
 
-def update_special_casings(uc, lc, tc, special_casing):
+def update_special_casings(uc, lc, tc, special_casing, log=sys.stdout):
 	"Update case conversion tables with special case conversion rules."
 
 	for x in special_casing.data:
@@ -138,7 +112,7 @@ def update_special_casings(uc, lc, tc, special_casing):
 		if len(title) > 1:
 			tc[c1] = title
 
-		print 'special case: %d %d %d' % (len(lower), len(upper), len(title))
+		log.write('special case: %d %d %d\n' % (len(lower), len(upper), len(title)))
 
 def remove_ascii_part(convmap):
 	"Remove ASCII case conversion parts (handled by C fast path)."
@@ -186,9 +160,34 @@ def scan_range_with_skip(convmap, start_idx, skip):
 
 	return start_i, start_o, count
 
+def find_ranges_with_skip(convmap, skip):
+	"Find all ranges with a certain 'skip' value, removing them from convmap."
+
+	# Single sweep in ascending codepoint order.  This is equivalent to
+	# calling find_first_range_with_skip() until it fails: ranges are only
+	# ever removed, so a codepoint which doesn't start a range can't start
+	# one later and a rescan from zero would find nothing before the current
+	# position.
+
+	res = []
+	k = [ i for i in convmap.keys() if i < 65536 ]
+	k.sort()
+	for i in k:
+		if not convmap.has_key(i):
+			continue  # removed as part of an earlier range
+		start_i, start_o, count = scan_range_with_skip(convmap, i, skip)
+		if start_i is None:
+			continue
+		res.append((start_i, start_o, count))
+
+	return res
+
 def find_first_range_with_skip(convmap, skip):
 	"Find first range with a certain 'skip' value."
 
+	# Original, quadratic range scan.  Only used as a reference when
+	# verifying find_ranges_with_skip() (--verify-ranges).
+
 	for i in xrange(65536):
 		start_i, start_o, count = scan_range_with_skip(convmap, i, skip)
 		if start_i is None:
@@ -197,7 +196,25 @@ def find_first_range_with_skip(convmap, skip):
 
 	return None, None, None
 
-def generate_tables(convmap):
+def verify_ranges(convmap):
+	"Check that the range sweep matches the original range scan."
+
+	t1 = clonedict(convmap)
+	t2 = clonedict(convmap)
+	for skip in xrange(1,6+1):
+		ranges1 = find_ranges_with_skip(t1, skip)
+		ranges2 = []
+		while True:
+			start_i, start_o, count = find_first_range_with_skip(t2, skip)
+			if start_i is None:
+				break
+			ranges2.append((start_i, start_o, count))
+		if ranges1 != ranges2:
+			raise Exception('range scan mismatch for skip %d: %r vs. %r' % (skip, ranges1, ranges2))
+	if t1 != t2:
+		raise Exception('range scan mismatch in remaining mappings')
+
+def generate_tables(convmap, log=sys.stdout):
 	"Generate bit-packed case conversion table for a given conversion map."
 
 	# The bitstream encoding is based on manual inspection for whatever
@@ -210,8 +227,8 @@ def generate_tables(convmap):
 	# output the remaining case conversions (1:1 and 1:n) on a per codepoint
 	# basis.
 	#
-	# This is very slow because we always scan from scratch, but its the
-	# most reliable and simple way to scan
+	# Each skip is handled with a single sweep over the sorted codepoints,
+	# see find_ranges_with_skip().
 
 	ranges = []		# range mappings (2 or more consecutive mappings with a certain skip)
 	singles = []		# 1:1 character mappings
@@ -220,11 +237,8 @@ def generate_tables(convmap):
 	# Ranges with skips
 
 	for skip in xrange(1,6+1):	# skips 1...6 are useful
-		while True:
-			start_i, start_o, count = find_first_range_with_skip(convmap, skip)
-			if start_i is None:
-				break
-			print 'skip %d: %d %d %d' % (skip, start_i, start_o, count)
+		for start_i, start_o, count in find_ranges_with_skip(convmap, skip):
+			log.write('skip %d: %d %d %d\n' % (skip, start_i, start_o, count))
 			ranges.append([start_i, start_o, count, skip])
 
 	# 1:1 conversions
@@ -278,15 +292,15 @@ def generate_tables(convmap):
 		del convmap[i]
 
 	for t in singles:
-		print repr(t)
+		log.write(repr(t) + '\n')
 
 	for t in complex:
-		print repr(t)
+		log.write(repr(t) + '\n')
 
-	print 'range mappings: %d' % len(ranges)
-	print 'single character mappings: %d' % len(singles)
-	print 'complex mappings (1:n): %d' % len(complex)
-	print 'remaining (should be zero): %d' % len(convmap.keys())
+	log.write('range mappings: %d\n' % len(ranges))
+	log.write('single character mappings: %d\n' % len(singles))
+	log.write('complex mappings (1:n): %d\n' % len(complex))
+	log.write('remaining (should be zero): %d\n' % len(convmap.keys()))
 
 	# XXX: opportunities for diff encoding skip=3 ranges?
 	prev = None
@@ -295,9 +309,9 @@ def generate_tables(convmap):
 		if t[3] != 3:
 			continue
 		if prev is not None:
-			print '%d %d' % (t[0] - prev[0], t[1] - prev[1])
+			log.write('%d %d\n' % (t[0] - prev[0], t[1] - prev[1]))
 		else:
-			print 'start: %d %d' % (t[0], t[1])
+			log.write('start: %d %d\n' % (t[0], t[1]))
 		prev = t
 
 	# bit packed encoding
@@ -312,7 +326,7 @@ def generate_tables(convmap):
 				continue
 			count += 1
 		be.bits(count, 6)
-		print 'encode: skip=%d, count=%d' % (curr_skip, count)
+		log.write('encode: skip=%d, count=%d\n' % (curr_skip, count))
 
 		for r in ranges:
 			start_i, start_o, r_count, skip = r[0], r[1], r[2], r[3]
@@ -341,7 +355,7 @@ def generate_tables(convmap):
 
 	return be.getBytes(), be.getNumBits()
 
-def generate_regexp_canonicalize_lookup(convmap):
+def generate_regexp_canonicalize_lookup(convmap, log=sys.stdout):
 	res = []
 
 	highest_nonid = -1
@@ -363,7 +377,7 @@ def generate_regexp_canonicalize_lookup(convmap):
 
 	# At the moment this is 65370, which means there's very little
 	# gain in assuming 1:1 mapping above a certain BMP codepoint.
-	print('HIGHEST NON-ID MAPPING: %d' % highest_nonid)
+	log.write('HIGHEST NON-ID MAPPING: %d\n' % highest_nonid)
 	return res
 
 def clonedict(x):
@@ -373,72 +387,93 @@ def clonedict(x):
 		res[k] = x[k]
 	return res
 
-def main():
-	parser = optparse.OptionParser()
-	parser.add_option('--command', dest='command', default='caseconv_bitpacked')
-	parser.add_option('--unicode-data', dest='unicode_data')
-	parser.add_option('--special-casing', dest='special_casing')
-	parser.add_option('--out-source', dest='out_source')
-	parser.add_option('--out-header', dest='out_header')
-	parser.add_option('--table-name-lc', dest='table_name_lc', default='caseconv_lc')
-	parser.add_option('--table-name-uc', dest='table_name_uc', default='caseconv_uc')
-	parser.add_option('--table-name-re-canon-lookup', dest='table_name_re_canon_lookup', default='caseconv_re_canon_lookup')
-	(opts, args) = parser.parse_args()
+def generate_caseconv_files(db, special_casing, command, out_source, out_header,
+                            table_name_lc='caseconv_lc', table_name_uc='caseconv_uc',
+                            table_name_re_canon_lookup='caseconv_re_canon_lookup', verify=False,
+                            log=sys.stdout):
+	"Generate C source and header for 'command', debug output is written to 'log'."
 
-	unicode_data = UnicodeData(opts.unicode_data)
-	special_casing = SpecialCasing(opts.special_casing)
+	uc, lc, tc = get_base_conversion_maps(db)
+	update_special_casings(uc, lc, tc, special_casing, log=log)
 
-	uc, lc, tc = get_base_conversion_maps(unicode_data)
-	update_special_casings(uc, lc, tc, special_casing)
+	if verify:
+		for convmap in [ uc, lc ]:
+			t = clonedict(convmap)
+			remove_ascii_part(t)
+			verify_ranges(t)
+		log.write('range scan verified\n')
 
-	if opts.command == 'caseconv_bitpacked':
+	if command == 'caseconv_bitpacked':
 		# XXX: ASCII and non-BMP filtering could be an option but is now hardcoded
 
 		# ascii is handled with 'fast path' so not needed here
 		t = clonedict(uc)
 		remove_ascii_part(t)
-		uc_bytes, uc_nbits = generate_tables(t)
+		uc_bytes, uc_nbits = generate_tables(t, log=log)
 
 		t = clonedict(lc)
 		remove_ascii_part(t)
-		lc_bytes, lc_nbits = generate_tables(t)
+		lc_bytes, lc_nbits = generate_tables(t, log=log)
 
 		# Generate C source and header files
 		genc = dukutil.GenerateC()
 		genc.emitHeader('extract_caseconv.py')
-		genc.emitArray(uc_bytes, opts.table_name_uc, size=len(uc_bytes), typename='duk_uint8_t', intvalues=True, const=True)
-		genc.emitArray(lc_bytes, opts.table_name_lc, size=len(lc_bytes), typename='duk_uint8_t', intvalues=True, const=True)
-		f = open(opts.out_source, 'wb')
+		genc.emitArray(uc_bytes, table_name_uc, size=len(uc_bytes), typename='duk_uint8_t', intvalues=True, const=True)
+		genc.emitArray(lc_bytes, table_name_lc, size=len(lc_bytes), typename='duk_uint8_t', intvalues=True, const=True)
+		f = open(out_source, 'wb')
 		f.write(genc.getString())
 		f.close()
 
 		genc = dukutil.GenerateC()
 		genc.emitHeader('extract_caseconv.py')
-		genc.emitLine('extern const duk_uint8_t %s[%d];' % (opts.table_name_uc, len(uc_bytes)))
-		genc.emitLine('extern const duk_uint8_t %s[%d];' % (opts.table_name_lc, len(lc_bytes)))
-		f = open(opts.out_header, 'wb')
+		genc.emitLine('extern const duk_uint8_t %s[%d];' % (table_name_uc, len(uc_bytes)))
+		genc.emitLine('extern const duk_uint8_t %s[%d];' % (table_name_lc, len(lc_bytes)))
+		f = open(out_header, 'wb')
 		f.write(genc.getString())
 		f.close()
-	elif opts.command == 're_canon_lookup':
+	elif command == 're_canon_lookup':
 		# direct canonicalization lookup for case insensitive regexps, includes ascii part
 		t = clonedict(uc)
-		re_canon_lookup = generate_regexp_canonicalize_lookup(t)
+		re_canon_lookup = generate_regexp_canonicalize_lookup(t, log=log)
 
 		genc = dukutil.GenerateC()
 		genc.emitHeader('extract_caseconv.py')
-		genc.emitArray(re_canon_lookup, opts.table_name_re_canon_lookup, size=len(re_canon_lookup), typename='duk_uint16_t', intvalues=True, const=True)
-		f = open(opts.out_source, 'wb')
+		genc.emitArray(re_canon_lookup, table_name_re_canon_lookup, size=len(re_canon_lookup), typename='duk_uint16_t', intvalues=True, const=True)
+		f = open(out_source, 'wb')
 		f.write(genc.getString())
 		f.close()
 
 		genc = dukutil.GenerateC()
 		genc.emitHeader('extract_caseconv.py')
-		genc.emitLine('extern const duk_uint16_t %s[%d];' % (opts.table_name_re_canon_lookup, len(re_canon_lookup)))
-		f = open(opts.out_header, 'wb')
+		genc.emitLine('extern const duk_uint16_t %s[%d];' % (table_name_re_canon_lookup, len(re_canon_lookup)))
+		f = open(out_header, 'wb')
 		f.write(genc.getString())
 		f.close()
 	else:
-		raise Exception('invalid command: %r' % opts.command)
+		raise Exception('invalid command: %r' % command)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option('--command', dest='command', default='caseconv_bitpacked')
+	parser.add_option('--unicode-data', dest='unicode_data')
+	parser.add_option('--unicode-db-cache', dest='unicode_db_cache', default=None)  # optional pickle cache for parsed UnicodeData.txt
+	parser.add_option('--special-casing', dest='special_casing')
+	parser.add_option('--out-source', dest='out_source')
+	parser.add_option('--out-header', dest='out_header')
+	parser.add_option('--table-name-lc', dest='table_name_lc', default='caseconv_lc')
+	parser.add_option('--table-name-uc', dest='table_name_uc', default='caseconv_uc')
+	parser.add_option('--table-name-re-canon-lookup', dest='table_name_re_canon_lookup', default='caseconv_re_canon_lookup')
+	parser.add_option('--verify-ranges', dest='verify_ranges', action='store_true', default=False, help='Check range scan against the original (slow) implementation')
+	(opts, args) = parser.parse_args()
+
+	db = unicode_db.load_unicode_database(opts.unicode_data, opts.unicode_db_cache)
+	sys.stdout.write('read %d unicode case mapping entries\n' % len(db.case_mappings))
+	special_casing = SpecialCasing(opts.special_casing)
+
+	generate_caseconv_files(db, special_casing, opts.command, opts.out_source, opts.out_header,
+	                        table_name_lc=opts.table_name_lc, table_name_uc=opts.table_name_uc,
+	                        table_name_re_canon_lookup=opts.table_name_re_canon_lookup,
+	                        verify=opts.verify_ranges)
 
 if __name__ == '__main__':
 	main()
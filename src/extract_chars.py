@@ -14,97 +14,30 @@
 #  above U+FFFF which is useful because such codepoints don't need to be
 #  supported in standard Ecmascript.
 #
+#  The codepoint set is computed as ranges using unicode_db.py, so that
+#  ranged entries in UnicodeData.txt don't need to be expanded.  make_dist
+#  calls generate_match_table_files() directly with a shared database.
+#
 
 import os, sys, math
 import optparse
 import dukutil
+import unicode_db
 
-def read_unicode_data(unidata, catsinc, catsexc, filterfunc):
-	"Read UnicodeData.txt, including lines matching catsinc unless excluded by catsexc or filterfunc."
-	res = []
-	f = open(unidata, 'rb')
-	for line in f:
-		line = line.strip()
-		parts = line.split(';')
-		codepoint = parts[0]
-		category = parts[2]
-
-		if filterfunc is not None and not filterfunc(long(codepoint, 16)):
-			continue
-
-		excluded = False
-		for cat in catsexc:
-			if category.startswith(cat) or codepoint == cat:
-				excluded = True
-		if excluded:
-			continue
-
-		for cat in catsinc:
-			if category.startswith(cat) or codepoint == cat:
-				res.append(line)
-	f.close()
-
-	# Sort based on Unicode codepoint
-	def mycmp(a,b):
-		t1 = a.split(';')
-		t2 = b.split(';')
-		n1 = long(t1[0], 16)
-		n2 = long(t2[0], 16)
-		return cmp(n1, n2)
-
-	res.sort(cmp=mycmp)
-
-	return res
-
-def scan_ranges(lines):
-	"Scan continuous ranges from (filtered) UnicodeData.txt lines."
-	ranges = []
-	range_start = None
-	prev = None
-
-	for line in lines:
-		t = line.split(';')
-		n = long(t[0], 16)
-		if range_start is None:
-			range_start = n
-		else:
-			if n == prev + 1:
-				# continue range
-				pass
-			else:
-				ranges.append((range_start, prev))
-				range_start = n
-		prev = n
-
-	if range_start is not None:
-		ranges.append((range_start, prev))
-
-	return ranges
-
-def generate_png(lines, fname):
+def generate_png(ranges, fname):
 	"Generate an illustrative PNG of the character set."
 	from PIL import Image
 
-	m = {}
-	for line in lines:
-		t = line.split(';')
-		n = long(t[0], 16)
-		m[n] = 1
-
 	codepoints = 0x10ffff + 1
 	width = int(256)
 	height = int(math.ceil(float(codepoints) / float(width)))
-	im = Image.new('RGB', (width, height))
+	im = Image.new('RGB', (width, height), (255,255,255))
 	black = (0,0,0)
-	white = (255,255,255)
-	for cp in xrange(codepoints):
-		y = cp / width
-		x = cp % width
-
-		if m.has_key(long(cp)):
+	for rs, re in ranges:
+		for cp in xrange(rs, re + 1):
+			y = cp / width
+			x = cp % width
 			im.putpixel((x,y), black)
-		else:
-			im.putpixel((x,y), white)
 
 	im.save(fname)
 
@@ -253,101 +186,88 @@ def generate_match_table3(ranges):
 	data, nbits = be.getBytes(), be.getNumBits()
 	return data, freq
 
-def main():
-	parser = optparse.OptionParser()
-	parser.add_option('--unicode-data', dest='unicode_data')      # UnicodeData.txt
-	parser.add_option('--special-casing', dest='special_casing')  # SpecialCasing.txt
-	parser.add_option('--include-categories', dest='include_categories')
-	parser.add_option('--exclude-categories', dest='exclude_categories', default='NONE')
-	parser.add_option('--out-source', dest='out_source')
-	parser.add_option('--out-header', dest='out_header')
-	parser.add_option('--out-png', dest='out_png')
-	parser.add_option('--table-name', dest='table_name', default='match_table')
-	(opts, args) = parser.parse_args()
+def generate_match_table_files(db, catsinc, catsexc, table_name, out_source=None, out_header=None, out_png=None, log=sys.stdout):
+	"Generate match table C source and header for a codepoint set, debug output is written to 'log'."
 
-	unidata = opts.unicode_data
-	catsinc = []
-	if opts.include_categories != '':
-		catsinc = opts.include_categories.split(',')
-	catsexc = []
-	if opts.exclude_categories != 'NONE':
-		catsexc = opts.exclude_categories.split(',')
+	log.write('CATSEXC: %s\n' % repr(catsexc))
+	log.write('CATSINC: %s\n' % repr(catsinc))
 
-	print 'CATSEXC: %s' % repr(catsexc)
-	print 'CATSINC: %s' % repr(catsinc)
-
-	# pseudocategories
-	filter_ascii = ('ASCII' in catsexc)
-	filter_nonbmp = ('NONBMP' in catsexc)
-
-	# Read raw result
-	def filter1(x):
-		if filter_ascii and x <= 0x7f:
-			# exclude ascii
-			return False
-		if filter_nonbmp and x >= 0x10000:
-			# exclude non-bmp
-			return False
-		return True
-
-	res = read_unicode_data(unidata, catsinc, catsexc, filter1)
-
-	# Raw output
-	print('RAW OUTPUT:')
-	print('===========')
-	print('\n'.join(res))
-
-	# Scan ranges
-	print('')
-	print('RANGES:')
-	print('=======')
-	ranges = scan_ranges(res)
+	# Continuous ranges, joined across category boundaries
+	log.write('\n')
+	log.write('RANGES:\n')
+	log.write('=======\n')
+	ranges = db.get_codepoint_set(catsinc, catsexc)
 	for i in ranges:
 		if i[0] == i[1]:
-			print('0x%04x' % i[0])
+			log.write('0x%04x\n' % i[0])
 		else:
-			print('0x%04x ... 0x%04x' % (i[0], i[1]))
-	print('')
-	print('%d ranges total' % len(ranges))
+			log.write('0x%04x ... 0x%04x\n' % (i[0], i[1]))
+	log.write('\n')
+	log.write('%d ranges total, %d codepoints\n' % (len(ranges), unicode_db.count_ranges(ranges)))
 
 	# Generate match table
-	print('')
-	print('MATCH TABLE:')
-	print('============')
+	log.write('\n')
+	log.write('MATCH TABLE:\n')
+	log.write('============\n')
 	#matchtable1 = generate_match_table1(ranges)
 	#matchtable2 = generate_match_table2(ranges)
 	matchtable3, freq = generate_match_table3(ranges)
-	print 'match table: %s' % repr(matchtable3)
-	print 'match table length: %d bytes' % len(matchtable3)
-	print 'encoding freq:'
+	log.write('match table: %s\n' % repr(matchtable3))
+	log.write('match table length: %d bytes\n' % len(matchtable3))
+	log.write('encoding freq:\n')
 	for i in xrange(len(freq)):
 		if freq[i] == 0:
 			continue
-		print '  %6d: %d' % (i, freq[i])
+		log.write('  %6d: %d\n' % (i, freq[i]))
 
-	print('')
-	print('MATCH C TABLE -> file %s' % repr(opts.out_header))
+	log.write('\n')
+	log.write('MATCH C TABLE -> file %s\n' % repr(out_header))
 
 	# Create C source and header files
 	genc = dukutil.GenerateC()
 	genc.emitHeader('extract_chars.py')
-	genc.emitArray(matchtable3, opts.table_name, size=len(matchtable3), typename='duk_uint8_t', intvalues=True, const=True)
-	if opts.out_source is not None:
-		f = open(opts.out_source, 'wb')
+	genc.emitArray(matchtable3, table_name, size=len(matchtable3), typename='duk_uint8_t', intvalues=True, const=True)
+	if out_source is not None:
+		f = open(out_source, 'wb')
 		f.write(genc.getString())
 		f.close()
 
 	genc = dukutil.GenerateC()
 	genc.emitHeader('extract_chars.py')
-	genc.emitLine('extern const duk_uint8_t %s[%d];' % (opts.table_name, len(matchtable3)))
-	if opts.out_header is not None:
-		f = open(opts.out_header, 'wb')
+	genc.emitLine('extern const duk_uint8_t %s[%d];' % (table_name, len(matchtable3)))
+	if out_header is not None:
+		f = open(out_header, 'wb')
 		f.write(genc.getString())
 		f.close()
 
 	# Image (for illustrative purposes only)
-	if opts.out_png is not None:
-		generate_png(res, opts.out_png)
+	if out_png is not None:
+		generate_png(ranges, out_png)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option('--unicode-data', dest='unicode_data')      # UnicodeData.txt
+	parser.add_option('--unicode-db-cache', dest='unicode_db_cache', default=None)  # optional pickle cache for parsed UnicodeData.txt
+	parser.add_option('--special-casing', dest='special_casing')  # SpecialCasing.txt
+	parser.add_option('--include-categories', dest='include_categories')
+	parser.add_option('--exclude-categories', dest='exclude_categories', default='NONE')
+	parser.add_option('--out-source', dest='out_source')
+	parser.add_option('--out-header', dest='out_header')
+	parser.add_option('--out-png', dest='out_png')
+	parser.add_option('--table-name', dest='table_name', default='match_table')
+	(opts, args) = parser.parse_args()
+
+	catsinc = []
+	if opts.include_categories != '':
+		catsinc = opts.include_categories.split(',')
+	catsexc = []
+	if opts.exclude_categories != 'NONE':
+		catsexc = opts.exclude_categories.split(',')
+
+	db = unicode_db.load_unicode_database(opts.unicode_data, opts.unicode_db_cache)
+	generate_match_table_files(db, catsinc, catsexc, opts.table_name,
+	                           out_source=opts.out_source, out_header=opts.out_header,
+	                           out_png=opts.out_png)
 
 if __name__ == '__main__':
 	main()
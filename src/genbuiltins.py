@@ -27,6 +27,11 @@ import math
 import struct
 import optparse
 import copy
+import hashlib
+try:
+	import cPickle as pickle
+except ImportError:
+	import pickle
 
 import dukutil
 
@@ -134,11 +139,11 @@ def string_is_arridx(v):
 def metadata_lookup_object(meta, obj_id):
 	return meta['_objid_to_object'][obj_id]
 
-def metadata_lookup_property(obj, key):
-	for p in obj['properties']:
-		if p['key'] == key:
-			return p
-	raise Exception('cannot find property %s from object %s' % (key, obj_id))
+def metadata_lookup_property(meta, obj_id, key):
+	p = meta['_objid_to_props'][obj_id].get(key)
+	if p is None:
+		raise Exception('cannot find property %s from object %s' % (key, obj_id))
+	return p
 
 # Remove disabled objects and properties.
 def metadata_remove_disabled(meta):
@@ -187,17 +192,19 @@ def metadata_delete_dangling_references_to_object(meta, obj_id):
 
 # Merge a user YAML file into current metadata.
 def metadata_merge_user_objects(meta, user_meta):
-	# XXX: could be reused from other call sites
+	# Object ID index, kept up-to-date while merging.  List positions
+	# are only needed (and scanned for) when replacing or deleting.
+	objid_to_object = {}
+	for t in meta['objects']:
+		objid_to_object[t['id']] = t
 	def _findObject(objid):
+		targ = objid_to_object.get(objid)
+		if targ is None:
+			return None, None
 		for i,t in enumerate(meta['objects']):
-			if t['id'] == objid:
-				return t, i
-		return None, None
-	def _findProp(obj, key):
-		for i,t in enumerate(obj['properties']):
-			if t['key'] == key:
+			if t is targ:
 				return t, i
-		return None, None
+		raise Exception('internal error, object index out of sync: %s' % objid)
 
 	if user_meta.has_key('add_objects'):
 		raise Exception('"add_objects" removed, use "objects" with "add: True"')
@@ -217,6 +224,7 @@ def metadata_merge_user_objects(meta, user_meta):
 			if targ is None:
 				raise Exception('Cannot delete object %s which doesn\'t exist' % o['id'])
 			meta['objects'].pop(targ_idx)
+			del objid_to_object[targ['id']]
 			metadata_delete_dangling_references_to_object(meta, targ['id'])
 			continue
 
@@ -227,6 +235,7 @@ def metadata_merge_user_objects(meta, user_meta):
 				meta['objects'].append(o)
 			else:
 				meta['objects'][targ_idx] = o
+			objid_to_object[o['id']] = o
 			continue
 
 		if o.get('add', False) or not o.get('modify', False):  # 'add' is the default
@@ -234,6 +243,7 @@ def metadata_merge_user_objects(meta, user_meta):
 			if targ is not None:
 				raise Exception('Cannot add object %s which already exists' % o['id'])
 			meta['objects'].append(o)
+			objid_to_object[o['id']] = o
 			continue
 
 		assert(o.get('modify', False))  # modify handling
@@ -245,26 +255,35 @@ def metadata_merge_user_objects(meta, user_meta):
 			if k == 'properties':
 				continue
 			targ[k] = o[k]
+
+		# Deleted properties are first replaced with None so that the
+		# key-to-index map stays valid, and filtered out at the end.
+		props = targ['properties']
+		key_to_idx = {}
+		for i,t in enumerate(props):
+			if not key_to_idx.has_key(t['key']):
+				key_to_idx[t['key']] = i
 		for p in o.get('properties', []):
 			if p.get('disable', False):
 				print('Skip disabled property: %s' % p['key'])
 				continue
-			prop = None
-			prop_idx = None
-			prop, prop_idx = _findProp(targ, p['key'])
-			if prop is not None:
+			prop_idx = key_to_idx.get(p['key'])
+			if prop_idx is not None:
 				if p.get('delete', False):
 					print('Delete property %s of %s' % (p['key'], o['id']))
-					targ['properties'].pop(prop_idx)
+					props[prop_idx] = None
+					del key_to_idx[p['key']]
 				else:
 					print('Replace property %s of %s' % (p['key'], o['id']))
-					targ['properties'][prop_idx] = p
+					props[prop_idx] = p
 			else:
 				if p.get('delete', False):
 					print('Deleting property %s of %s: doesn\'t exist, nop' % (p['key'], o['id']))
 				else:
 					print('Add property %s of %s' % (p['key'], o['id']))
-					targ['properties'].append(p)
+					key_to_idx[p['key']] = len(props)
+					props.append(p)
+		targ['properties'] = [ t for t in props if t is not None ]
 
 # Normalize nargs for top level functions by defaulting 'nargs' from 'length'.
 def metadata_normalize_nargs_length(meta):
@@ -545,6 +564,23 @@ def metadata_normalize_rom_property_attributes(meta):
 			# objects can override parent properties.
 			p['attributes'] = p['attributes'].replace('c', '')
 
+# Array .length is virtual (duk_harray) so for ROM objects move a 'length'
+# property of Array-classed objects into the object itself.  For RAM
+# objects the property is kept and initialization code defines it like a
+# normal property, which updates the virtual length.
+def metadata_normalize_rom_array_length(meta):
+	for o in meta['objects']:
+		if o.get('class') != 'Array':
+			continue
+		props = []
+		for p in o['properties']:
+			if p['key'] == 'length':
+				assert(isinstance(p['value'], (int, long)))
+				o['array_length'] = p['value']
+			else:
+				props.append(p)
+		o['properties'] = props
+
 # Add a 'name' property for all top level functions; expected by RAM
 # initialization code.
 def metadata_normalize_ram_function_names(meta):
@@ -625,49 +661,49 @@ def metadata_normalize_missing_strings(meta, user_meta):
 # useless in RAM or ROM init data.
 def metadata_remove_orphan_objects(meta):
 	reachable = {}
+	objid_to_object = {}
+	pending = []
 
 	for o in meta['objects']:
+		objid_to_object[o['id']] = o
 		if o.get('bidx_used', False):
 			reachable[o['id']] = True
+			pending.append(o)
+	reachable_count = len(reachable.keys())
+
+	def _markId(obj_id):
+		if obj_id is None or reachable.has_key(obj_id):
+			return
+		reachable[obj_id] = True
+		if objid_to_object.has_key(obj_id):
+			pending.append(objid_to_object[obj_id])
+
+	# Each object is scanned once, when first marked reachable.
+	while len(pending) > 0:
+		o = pending.pop()
+		for p in o['properties']:
+			# Shorthand has been normalized so no need
+			# to support it here.
+			v = p['value']
+			ptype = None
+			if isinstance(v, dict):
+				ptype = p['value']['type']
+			if ptype == 'object':
+				_markId(v['id'])
+			if ptype == 'accessor':
+				_markId(v.get('getter_id'))
+				_markId(v.get('setter_id'))
 
-	while True:
-		reachable_count = len(reachable.keys())
-
-		def _markId(obj_id):
-			if obj_id is None:
-				return
-			reachable[obj_id] = True
-
-		for o in meta['objects']:
-			if not reachable.has_key(o['id']):
-				continue
-			for p in o['properties']:
-				# Shorthand has been normalized so no need
-				# to support it here.
-				v = p['value']
-				ptype = None
-				if isinstance(v, dict):
-					ptype = p['value']['type']
-				if ptype == 'object':
-					_markId(v['id'])
-				if ptype == 'accessor':
-					_markId(v.get('getter_id'))
-					_markId(v.get('setter_id'))
-
-		print('Mark reachable: reachable count initially %d, now %d' % \
-		      (reachable_count, len(reachable.keys())))
-		if reachable_count == len(reachable.keys()):
-			break
+	print('Mark reachable: reachable count initially %d, now %d' % \
+	      (reachable_count, len(reachable.keys())))
 
-	deleted = True
-	while deleted:
-		deleted = False
-		for i,o in enumerate(meta['objects']):
-			if not reachable.has_key(o['id']):
-				print('WARNING: object %s not reachable, dropping' % o['id'])
-				meta['objects'].pop(i)
-				deleted = True
-				break
+	objlist = []
+	for o in meta['objects']:
+		if reachable.has_key(o['id']):
+			objlist.append(o)
+		else:
+			print('WARNING: object %s not reachable, dropping' % o['id'])
+	meta['objects'] = objlist
 
 # Add C define names for builtin strings.  These defines are added to all
 # strings, even when they won't get a stridx because the define names are
@@ -824,9 +860,34 @@ def dump_metadata(meta, fn):
 		f.write(tmp)
 	print('Wrote metadata dump to %s' % fn)
 
-# Main metadata loading function: load metadata from multiple sources,
-# merge and normalize, prepare various indexes etc.
-def load_metadata(opts, rom=False, build_info=None):
+# Bump when the pickled base metadata format changes.  The cache key
+# also covers genbuiltins.py itself so normalization code changes are
+# picked up automatically.
+METADATA_CACHE_VERSION = 1
+
+# Pickled base metadata, memoized so that the RAM and ROM passes only
+# parse and normalize the YAML files once.  Unpickling gives each pass
+# an independent copy which it can modify freely.
+_base_metadata_pickle = None
+
+def get_base_metadata_cache_key(opts):
+	h = hashlib.sha1()
+	h.update('genbuiltins-metadata-%d\n' % METADATA_CACHE_VERSION)
+	script = os.path.abspath(__file__)
+	if script.endswith('.pyc') or script.endswith('.pyo'):
+		script = script[:-1]
+	for fn in [ script, opts.strings_metadata, opts.objects_metadata ] + opts.user_builtin_metadata:
+		with open(fn, 'rb') as f:
+			data = f.read()
+		h.update('%d\n' % len(data))
+		h.update(data)
+	return h.hexdigest()
+
+# Load built-in strings and objects and user builtin metadata files, and
+# do the normalization steps shared by RAM and ROM metadata.  Result is
+# a dict with the merged metadata ('meta') and the parsed user metadata
+# files ('user_metas').
+def load_base_metadata(opts):
 	# Load built-in strings and objects.
 	with open(opts.strings_metadata, 'rb') as f:
 		strings_metadata = recursive_strings_to_bytes(yaml.load(f))
@@ -841,11 +902,12 @@ def load_metadata(opts, rom=False, build_info=None):
 		meta[k] = strings_metadata[k]
 
 	# Add user objects.
-	user_meta = {}
+	user_metas = []
 	for fn in opts.user_builtin_metadata:
 		print('Merging user builtin metadata file %s' % fn)
 		with open(fn, 'rb') as f:
 			user_meta = recursive_strings_to_bytes(yaml.load(f))
+		user_metas.append(user_meta)
 		metadata_merge_user_objects(meta, user_meta)
 
 	# Remove disabled objects and properties.
@@ -860,6 +922,39 @@ def load_metadata(opts, rom=False, build_info=None):
 	# Normalize property shorthand into full objects.
 	metadata_normalize_shorthand(meta)
 
+	return { 'meta': meta, 'user_metas': user_metas }
+
+# Get a fresh copy of the base metadata, using the in-process memo or
+# the on-disk cache (--metadata-cache-dir) when possible.
+def get_base_metadata(opts):
+	global _base_metadata_pickle
+
+	if _base_metadata_pickle is None:
+		cache_fn = None
+		if opts.metadata_cache_dir is not None:
+			cache_fn = os.path.join(opts.metadata_cache_dir, 'metadata-%s.pickle' % get_base_metadata_cache_key(opts))
+		if cache_fn is not None and os.path.isfile(cache_fn):
+			print('Using cached base metadata %s' % cache_fn)
+			with open(cache_fn, 'rb') as f:
+				_base_metadata_pickle = f.read()
+		else:
+			_base_metadata_pickle = pickle.dumps(load_base_metadata(opts), pickle.HIGHEST_PROTOCOL)
+			if cache_fn is not None:
+				if not os.path.isdir(opts.metadata_cache_dir):
+					os.makedirs(opts.metadata_cache_dir)
+				tmp_fn = cache_fn + '.tmp%d' % os.getpid()
+				with open(tmp_fn, 'wb') as f:
+					f.write(_base_metadata_pickle)
+				os.rename(tmp_fn, cache_fn)  # atomic on POSIX
+
+	return pickle.loads(_base_metadata_pickle)
+
+# Main metadata loading function: load metadata from multiple sources,
+# merge and normalize, prepare various indexes etc.
+def load_metadata(opts, rom=False, build_info=None):
+	base = get_base_metadata(opts)
+	meta = base['meta']
+
 	# RAM top-level functions must have a 'name'.
 	if not rom:
 		metadata_normalize_ram_function_names(meta)
@@ -882,6 +977,7 @@ def load_metadata(opts, rom=False, build_info=None):
 	# For ROM objects, mark all properties non-configurable.
 	if rom:
 		metadata_normalize_rom_property_attributes(meta)
+		metadata_normalize_rom_array_length(meta)
 
 	# Create a list of objects needing a 'bidx'.  This is now just
 	# based on the 'builtins' metadata list but could be dynamically
@@ -908,11 +1004,8 @@ def load_metadata(opts, rom=False, build_info=None):
 	# into the string list (not the 'stridx' list though): all strings
 	# referenced by ROM objects must also be in ROM.
 	if rom:
-		for fn in opts.user_builtin_metadata:
-			# XXX: awkward second pass
-			with open(fn, 'rb') as f:
-				user_meta = recursive_strings_to_bytes(yaml.load(f))
-				metadata_normalize_missing_strings(meta, user_meta)
+		for user_meta in base['user_metas']:
+			metadata_normalize_missing_strings(meta, user_meta)
 		metadata_normalize_missing_strings(meta, {})  # in case no files
 
 	# Check for orphan objects and remove them.
@@ -961,6 +1054,7 @@ def load_metadata(opts, rom=False, build_info=None):
 	meta['_is_plain_reserved_word'] = {}
 	meta['_is_plain_strict_reserved_word'] = {}
 	meta['_objid_to_object'] = {}
+	meta['_objid_to_props'] = {}
 	meta['_objid_to_bidx'] = {}
 	meta['_objid_to_idx'] = {}
 	meta['_objid_to_ramidx'] = {}
@@ -991,6 +1085,11 @@ def load_metadata(opts, rom=False, build_info=None):
 		meta['_stridx_to_define'][i] = s['define']
 	for i,o in enumerate(meta['objects']):
 		meta['_objid_to_object'][o['id']] = o
+		props = {}
+		for p in o['properties']:
+			if not props.has_key(p['key']):
+				props[p['key']] = p
+		meta['_objid_to_props'][o['id']] = props
 		meta['_objid_to_idx'][o['id']] = i
 		meta['_idx_to_objid'][i] = o['id']
 		meta['_idx_to_object'][i] = o
@@ -1205,6 +1304,11 @@ NARGS_BITS = 3
 PROP_TYPE_BITS = 3
 MAGIC_BITS = 16
 
+# Raised when metadata (typically user built-ins) can't be represented in
+# the RAM init data format; such metadata is only usable with ROM objects.
+class RamInitDataLimitError(Exception):
+	pass
+
 NARGS_VARARGS_MARKER = 0x07
 NO_CLASS_MARKER = 0x00   # 0 = DUK_HOBJECT_CLASS_UNUSED
 NO_BIDX_MARKER = 0x7f
@@ -1265,7 +1369,8 @@ def gen_ramstr_initdata_bitpacked(meta):
 	#    0-25    'a' ... 'z'
 	#    26	     '_'
 	#    27      0x00 (actually decoded to 0xff, internal marker)
-	#    28	     reserved
+	#    28      back reference: copy 3-10 characters from an earlier
+	#            string (8-bit string index, 4-bit offset, 3-bit length - 3)
 	#    29      switch to uppercase for one character
 	#            (next 5-bit symbol must be in range 0-25)
 	#    30      switch to uppercase
@@ -1273,20 +1378,109 @@ def gen_ramstr_initdata_bitpacked(meta):
 	#
 	# Uppercase mode is the same except codes 29 and 30 switch to
 	# lowercase.
+	#
+	# Back references target strings already interned by the decoder, i.e.
+	# strings with a smaller string index.  They're mostly useful for
+	# repeated substrings like 'Array' and the 0xff prefixed internal keys
+	# (e.g. '\xffVarmap' and '\xffVarenv').
+	#
+	# Each string is encoded optimally (minimum number of bits) using
+	# dynamic programming over (position, case mode) states.
 
 	UNDERSCORE = 26
 	ZERO = 27
+	BACKREF = 28
 	SWITCH1 = 29
 	SWITCH = 30
 	SEVENBIT = 31
 
+	BACKREF_INDEX_BITS = 8
+	BACKREF_OFFSET_BITS = 4
+	BACKREF_LENGTH_BITS = 3
+	BACKREF_MINLEN = 3
+	BACKREF_MAXLEN = BACKREF_MINLEN + (1 << BACKREF_LENGTH_BITS) - 1
+
+	LOWERCASE = 0
+	UPPERCASE = 1
+
+	def find_backref(strs, s_idx, sub):
+		# First (lowest index, lowest offset) earlier string containing 'sub'
+		# at an encodable offset.
+		for ref_idx in xrange(min(s_idx, 1 << BACKREF_INDEX_BITS)):
+			ref = strs[ref_idx]['str']
+			off = ref.find(sub)
+			if off >= 0 and off < (1 << BACKREF_OFFSET_BITS):
+				return ref_idx, off
+		return None
+
+	def encode_string(strs, s_idx):
+		# Returns a list of (symbols, kind) tuples for an optimal encoding,
+		# where 'symbols' is a list of (value, nbits) tuples.
+		s = strs[s_idx]['str']
+		n = len(s)
+
+		# best[pos][mode] = (cost, prev_pos, prev_mode, symbols, kind)
+		best = [ [ None, None ] for i in xrange(n + 1) ]
+		best[0][LOWERCASE] = (0, None, None, None, None)
+
+		for pos in xrange(n):
+			c = s[pos]
+			islower = (ord(c) >= ord('a') and ord(c) <= ord('z'))
+			isupper = (ord(c) >= ord('A') and ord(c) <= ord('Z'))
+
+			for mode in [ LOWERCASE, UPPERCASE ]:
+				if best[pos][mode] is None:
+					continue
+				cost = best[pos][mode][0]
+
+				def update(new_pos, new_mode, symbols, kind):
+					new_cost = cost + sum([ t[1] for t in symbols ])
+					if best[new_pos][new_mode] is None or new_cost < best[new_pos][new_mode][0]:
+						best[new_pos][new_mode] = (new_cost, pos, mode, symbols, kind)
+
+				if c == '_':
+					update(pos + 1, mode, [ (UNDERSCORE, 5) ], 'optimal')
+				elif c == '\xff':
+					# A 0xff prefix (never part of valid UTF-8) is used for internal properties.
+					# It is encoded as 0x00 in generated init data for technical reasons: it
+					# keeps lookup table elements 7 bits instead of 8 bits.
+					update(pos + 1, mode, [ (ZERO, 5) ], 'optimal')
+				elif (islower and mode == LOWERCASE) or (isupper and mode == UPPERCASE):
+					update(pos + 1, mode, [ (ord(c.lower()) - ord('a'), 5) ], 'optimal')
+				elif islower or isupper:
+					update(pos + 1, mode, [ (SWITCH1, 5), (ord(c.lower()) - ord('a'), 5) ], 'switch1')
+					update(pos + 1, 1 - mode, [ (SWITCH, 5), (ord(c.lower()) - ord('a'), 5) ], 'switch')
+				else:
+					assert(ord(c) >= 0 and ord(c) <= 127)
+					update(pos + 1, mode, [ (SEVENBIT, 5), (ord(c), 7) ], 'sevenbit')
+
+				for length in xrange(BACKREF_MINLEN, min(BACKREF_MAXLEN, n - pos) + 1):
+					ref = find_backref(strs, s_idx, s[pos:pos + length])
+					if ref is None:
+						break  # no longer substring can match either
+					update(pos + length, mode, [ (BACKREF, 5),
+					                             (ref[0], BACKREF_INDEX_BITS),
+					                             (ref[1], BACKREF_OFFSET_BITS),
+					                             (length - BACKREF_MINLEN, BACKREF_LENGTH_BITS) ], 'backref')
+
+		# Prefer ending in lowercase mode on ties, backtrack the chosen path.
+		pos = n
+		mode = LOWERCASE
+		if best[n][LOWERCASE] is None or (best[n][UPPERCASE] is not None and best[n][UPPERCASE][0] < best[n][LOWERCASE][0]):
+			mode = UPPERCASE
+		res = []
+		while pos > 0:
+			cost, prev_pos, prev_mode, symbols, kind = best[pos][mode]
+			res.append((symbols, kind))
+			pos, mode = prev_pos, prev_mode
+		res.reverse()
+		return res
+
 	maxlen = 0
-	n_optimal = 0
-	n_switch1 = 0
-	n_switch = 0
-	n_sevenbit = 0
+	counts = { 'optimal': 0, 'switch1': 0, 'switch': 0, 'sevenbit': 0, 'backref': 0 }
 
-	for s_obj in meta['strings_stridx']:
+	strs = meta['strings_stridx']
+	for s_idx, s_obj in enumerate(strs):
 		s = s_obj['str']
 
 		be.bits(len(s), 5)
@@ -1294,72 +1488,19 @@ def gen_ramstr_initdata_bitpacked(meta):
 		if len(s) > maxlen:
 			maxlen = len(s)
 
-		# 5-bit character, mode specific
-		mode = 'lowercase'
-
-		for idx, c in enumerate(s):
-			# This encoder is not that optimal, but good enough for now.
-
-			islower = (ord(c) >= ord('a') and ord(c) <= ord('z'))
-			isupper = (ord(c) >= ord('A') and ord(c) <= ord('Z'))
-			islast = (idx == len(s) - 1)
-			isnextlower = False
-			isnextupper = False
-			if not islast:
-				c2 = s[idx+1]
-				isnextlower = (ord(c2) >= ord('a') and ord(c2) <= ord('z'))
-				isnextupper = (ord(c2) >= ord('A') and ord(c2) <= ord('Z'))
-
-			if c == '_':
-				be.bits(UNDERSCORE, 5)
-				n_optimal += 1
-			elif c == '\xff':
-				# A 0xff prefix (never part of valid UTF-8) is used for internal properties.
-				# It is encoded as 0x00 in generated init data for technical reasons: it
-				# keeps lookup table elements 7 bits instead of 8 bits.
-				be.bits(ZERO, 5)
-				n_optimal += 1
-			elif islower and mode == 'lowercase':
-				be.bits(ord(c) - ord('a'), 5)
-				n_optimal += 1
-			elif isupper and mode == 'uppercase':
-				be.bits(ord(c) - ord('A'), 5)
-				n_optimal += 1
-			elif islower and mode == 'uppercase':
-				if isnextlower:
-					be.bits(SWITCH, 5)
-					be.bits(ord(c) - ord('a'), 5)
-					mode = 'lowercase'
-					n_switch += 1
-				else:
-					be.bits(SWITCH1, 5)
-					be.bits(ord(c) - ord('a'), 5)
-					n_switch1 += 1
-			elif isupper and mode == 'lowercase':
-				if isnextupper:
-					be.bits(SWITCH, 5)
-					be.bits(ord(c) - ord('A'), 5)
-					mode = 'uppercase'
-					n_switch += 1
-				else:
-					be.bits(SWITCH1, 5)
-					be.bits(ord(c) - ord('A'), 5)
-					n_switch1 += 1
-			else:
-				assert(ord(c) >= 0 and ord(c) <= 127)
-				be.bits(SEVENBIT, 5)
-				be.bits(ord(c), 7)
-				n_sevenbit += 1
-				#print('sevenbit for: %r' % c)
+		for symbols, kind in encode_string(strs, s_idx):
+			for value, nbits in symbols:
+				be.bits(value, nbits)
+			counts[kind] += 1
 
 	# end marker not necessary, C code knows length from define
 
 	res = be.getByteString()
 
 	print('%d ram strings, %d bytes of string init data, %d maximum string length, ' + \
-	      'encoding: optimal=%d,switch1=%d,switch=%d,sevenbit=%d') % \
+	      'encoding: optimal=%d,switch1=%d,switch=%d,sevenbit=%d,backref=%d') % \
 	      (len(meta['strings_stridx']), len(res), maxlen, \
-	      n_optimal, n_switch1, n_switch, n_sevenbit)
+	      counts['optimal'], counts['switch1'], counts['switch'], counts['sevenbit'], counts['backref'])
 
 	return res, maxlen
 
@@ -1458,7 +1599,9 @@ def gen_ramobj_initdata_for_object(meta, be, bi, string_to_stridx, natfunc_name_
 	prop_proto = steal_prop(props, 'prototype')
 	prop_constr = steal_prop(props, 'constructor')
 	prop_name = steal_prop(props, 'name')
-	prop_length = steal_prop(props, 'length')
+	prop_length = None
+	if bi['class'] != 'Array':  # Array .length is virtual, initialized like a normal property
+		prop_length = steal_prop(props, 'length')
 
 	length = -1  # default value -1 signifies varargs
 	if prop_length is not None:
@@ -1525,8 +1668,57 @@ def gen_ramobj_initdata_for_object(meta, be, bi, string_to_stridx, natfunc_name_
 		else:
 			be.bits(0, 1)
 
-# Generate RAM object initdata for an object's properties.
-def gen_ramobj_initdata_for_props(meta, be, bi, string_to_stridx, natfunc_name_to_natidx, objid_to_bidx, double_byte_order):
+# Double constant byte orders supported by the RAM init data, indexed by
+# target byte order; source is the big endian IEEE representation.
+DOUBLE_BYTE_ORDERS = {
+	'big':    [ 0, 1, 2, 3, 4, 5, 6, 7 ],
+	'little': [ 7, 6, 5, 4, 3, 2, 1, 0 ],
+	'mixed':  [ 3, 2, 1, 0, 7, 6, 5, 4 ]    # some arm platforms
+}
+
+# Check whether a RAM object can be materialized lazily, i.e. whether its
+# properties can be decoded on first access instead of at heap creation.
+# Only objects in thr->builtins[] can be found at that point, so the object
+# itself and all objects referenced by its property values must have a
+# 'bidx'.  Inline native functions and accessors are not referenced by
+# index so they don't matter.
+#
+# duk_set_global_object() on the heap's initial context replaces the
+# global object and environment in heap_thread->builtins[], so those
+# objects aren't lazy and lazy objects can't refer to them.
+RAMOBJ_REPLACEABLE_BUILTINS = [ 'bi_global', 'bi_global_env' ]
+
+def ramobj_is_lazy_eligible(meta, bi, objid_to_bidx):
+	num_bidx = len(meta['objects_bidx'])
+	if objid_to_bidx[bi['id']] >= num_bidx:
+		return False
+	if bi['id'] in RAMOBJ_REPLACEABLE_BUILTINS:
+		return False
+	for prop in bi['properties']:
+		val = prop['value']
+		if isinstance(val, dict) and val['type'] == 'object':
+			if val['id'] in RAMOBJ_REPLACEABLE_BUILTINS:
+				return False
+			idx = objid_to_bidx.get(val['id'])
+			if idx is not None and idx >= num_bidx:
+				return False
+	return True
+
+# Generate RAM object initdata for an object's properties.  Double values
+# are written in big endian order and their bit offsets are recorded into
+# 'double_patches' so that other byte orders can be patched in afterwards.
+#
+# The 'section' argument selects what to emit:
+#
+#   - 'all': the complete property data of an eagerly initialized object.
+#
+#   - 'initial': the part of a lazily initialized object decoded at heap
+#     creation: internal prototype and internal properties (such as
+#     \xffValue) which are looked up without side effects, e.g. by GC.
+#
+#   - 'deferred': the rest of a lazily initialized object, decoded on first
+#     access using the bit offset in duk_builtins_lazy_offsets[].
+def gen_ramobj_initdata_for_props(meta, be, bi, string_to_stridx, natfunc_name_to_natidx, objid_to_bidx, double_patches, section='all'):
 	count_normal_props = 0
 	count_function_props = 0
 
@@ -1552,32 +1744,147 @@ def gen_ramobj_initdata_for_props(meta, be, bi, string_to_stridx, natfunc_name_t
 	def _natidx(native_name):
 		natidx = natfunc_name_to_natidx[native_name]
 		be.bits(natidx, NATIDX_BITS)
+	def _emit_values(values):
+		for valspec in values:
+			val = valspec['value']
+
+			_stridx_or_string(valspec['key'])
+
+			# Attribute check doesn't check for accessor flag; that is now
+			# automatically set by C code when value is an accessor type.
+			# Accessors must not have 'writable', so they'll always have
+			# non-default attributes (less footprint than adding a different
+			# default).
+			default_attrs = DEFAULT_DATA_PROPERTY_ATTRIBUTES
+
+			attrs = valspec.get('attributes', default_attrs)
+			attrs = attrs.replace('a', '')  # ram bitstream doesn't encode 'accessor' attribute
+			if attrs != default_attrs:
+				#print('non-default attributes: %s -> %r (default %r)' % (valspec['key'], attrs, default_attrs))
+				be.bits(1, 1)  # flag: have custom attributes
+				be.bits(encode_property_flags(attrs), PROP_FLAGS_BITS)
+			else:
+				be.bits(0, 1)  # flag: no custom attributes
 
-	props = [x for x in bi['properties']]  # clone
+			if val is None:
+				print('WARNING: RAM init data format doesn\'t support "null" now, value replaced with "undefined": %r' % valspec)
+				#raise Exception('RAM init format doesn\'t support a "null" value now')
+				be.bits(PROP_TYPE_UNDEFINED, PROP_TYPE_BITS)
+			elif isinstance(val, bool):
+				if val == True:
+					be.bits(PROP_TYPE_BOOLEAN_TRUE, PROP_TYPE_BITS)
+				else:
+					be.bits(PROP_TYPE_BOOLEAN_FALSE, PROP_TYPE_BITS)
+			elif isinstance(val, (float, int)) or isinstance(val, dict) and val['type'] == 'double':
+				# Avoid converting a manually specified NaN temporarily into
+				# a float to avoid risk of e.g. NaN being replaced by another.
+				if isinstance(val, dict):
+					val = val['bytes'].decode('hex')
+					assert(len(val) == 8)
+				else:
+					val = struct.pack('>d', float(val))
+
+				be.bits(PROP_TYPE_DOUBLE, PROP_TYPE_BITS)
+
+				# encoding of double must match target architecture byte
+				# order, which is handled by patching
+				#print('DOUBLE: %s' % val.encode('hex'))
+
+				if len(val) != 8:
+					raise Exception('internal error')
+				double_patches.append((be.getNumBits(), val))
+				be.string(val)
+			elif isinstance(val, str) or isinstance(val, unicode):
+				if isinstance(val, unicode):
+					# Note: non-ASCII characters will not currently work,
+					# because bits/char is too low.
+					val = val.encode('utf-8')
+
+				if string_to_stridx.has_key(val):
+					# String value is in built-in string table -> encode
+					# using a string index.  This saves some space,
+					# especially for the 'name' property of errors
+					# ('EvalError' etc).
+
+					be.bits(PROP_TYPE_STRIDX, PROP_TYPE_BITS)
+					_stridx(val)
+				else:
+					# Not in string table -> encode as raw 7-bit value
+
+					if len(val) >= (1 << STRING_LENGTH_BITS) or \
+					   max([ ord(c) for c in val ] + [ 0 ]) >= (1 << STRING_CHAR_BITS):
+						raise RamInitDataLimitError('RAM init data only supports ASCII string values up to %d bytes: %r' % \
+						                ((1 << STRING_LENGTH_BITS) - 1, val))
+					be.bits(PROP_TYPE_STRING, PROP_TYPE_BITS)
+					be.bits(len(val), STRING_LENGTH_BITS)
+					for i in xrange(len(val)):
+						be.bits(ord(val[i]), STRING_CHAR_BITS)
+			elif isinstance(val, dict):
+				if val['type'] == 'object':
+					be.bits(PROP_TYPE_BUILTIN, PROP_TYPE_BITS)
+					_bidx(val['id'])
+				elif val['type'] == 'undefined':
+					be.bits(PROP_TYPE_UNDEFINED, PROP_TYPE_BITS)
+				elif val['type'] == 'accessor':
+					be.bits(PROP_TYPE_ACCESSOR, PROP_TYPE_BITS)
+					getter_fn = metadata_lookup_object(meta, val['getter_id'])
+					setter_fn = metadata_lookup_object(meta, val['setter_id'])
+					_natidx(getter_fn['native'])
+					_natidx(setter_fn['native'])
+					assert(getter_fn['nargs'] == 0)
+					assert(setter_fn['nargs'] == 1)
+					assert(getter_fn['magic'] == 0)
+					assert(setter_fn['magic'] == 0)
+				else:
+					raise Exception('unsupported value: %s' % repr(val))
+			else:
+				raise Exception('unsupported value: %s' % repr(val))
+		return len(values)
+	def _emit_functions(functions):
+		for funprop in functions:
+			funobj = metadata_lookup_object(meta, funprop['value']['id'])
+			prop_len = metadata_lookup_property(meta, funobj['id'], 'length')
+			assert(prop_len is not None)
+			assert(isinstance(prop_len['value'], (int)))
+			length = prop_len['value']
+
+			_stridx_or_string(funprop['key'])
+			_natidx(funobj['native'])
+			be.bits(length, LENGTH_PROP_BITS)
+
+			if funobj.get('varargs', False):
+				be.bits(1, 1)  # flag: non-default nargs
+				be.bits(NARGS_VARARGS_MARKER, NARGS_BITS)
+			elif funobj.has_key('nargs') and funobj['nargs'] != length:
+				be.bits(1, 1)  # flag: non-default nargs
+				be.bits(funobj['nargs'], NARGS_BITS)
+			else:
+				be.bits(0, 1)  # flag: default nargs OK
+
+			# XXX: make this check conditional to minimize bit count
+			# (there are quite a lot of function properties)
+			magic = resolve_magic(funobj.get('magic'), objid_to_bidx)
+			if magic != 0:
+				assert(magic >= 0)
+				assert(magic < (1 << MAGIC_BITS))
+				be.bits(1, 1)
+				be.bits(magic, MAGIC_BITS)
+			else:
+				be.bits(0, 1)
+		return len(functions)
 
-	# internal prototype: not an actual property so not in property list
-	if bi.has_key('internal_prototype'):
-		_bidx(bi['internal_prototype'])
-	else:
-		_bidx(None)
+	props = [x for x in bi['properties']]  # clone
 
-	# external prototype: encoded specially, steal from property list
+	# external prototype and constructor: encoded specially, steal from
+	# property list
 	prop_proto = steal_prop(props, 'prototype')
 	if prop_proto is not None:
 		assert(prop_proto['value']['type'] == 'object')
 		assert(prop_proto['attributes'] == '')
-		_bidx(prop_proto['value']['id'])
-	else:
-		_bidx(None)
-
-	# external constructor: encoded specially, steal from property list
 	prop_constr = steal_prop(props, 'constructor')
 	if prop_constr is not None:
 		assert(prop_constr['value']['type'] == 'object')
 		assert(prop_constr['attributes'] == 'wc')
-		_bidx(prop_constr['value']['id'])
-	else:
-		_bidx(None)
 
 	# name: encoded specially for function objects, so steal and ignore here
 	if bi['class'] == 'Function':
@@ -1588,8 +1895,10 @@ def gen_ramobj_initdata_for_props(meta, be, bi, string_to_stridx, natfunc_name_t
 		assert((bi['id'] != 'bi_function_prototype' and prop_name['attributes'] == '') or \
 		       (bi['id'] == 'bi_function_prototype' and prop_name['attributes'] == 'w'))
 
-	# length: encoded specially, so steal and ignore
-	prop_proto = steal_prop(props, 'length')
+	# length: encoded specially, so steal and ignore (except Array .length
+	# which is virtual and initialized like a normal property)
+	if bi['class'] != 'Array':
+		prop_length = steal_prop(props, 'length')
 
 	# Date.prototype.toGMTString needs special handling and is handled
 	# directly in duk_hthread_builtins.c; so steal and ignore here.
@@ -1612,141 +1921,43 @@ def gen_ramobj_initdata_for_props(meta, be, bi, string_to_stridx, natfunc_name_t
 		else:
 			values.append(prop)
 
-	be.bits(len(values), NUM_NORMAL_PROPS_BITS)
-
-	for valspec in values:
-		count_normal_props += 1
-
-		val = valspec['value']
-
-		_stridx_or_string(valspec['key'])
-
-		# Attribute check doesn't check for accessor flag; that is now
-		# automatically set by C code when value is an accessor type.
-		# Accessors must not have 'writable', so they'll always have
-		# non-default attributes (less footprint than adding a different
-		# default).
-		default_attrs = DEFAULT_DATA_PROPERTY_ATTRIBUTES
+	if section in [ 'all', 'initial' ]:
+		be.bits(1 if section == 'initial' else 0, 1)  # flag: lazy
 
-		attrs = valspec.get('attributes', default_attrs)
-		attrs = attrs.replace('a', '')  # ram bitstream doesn't encode 'accessor' attribute
-		if attrs != default_attrs:
-			#print('non-default attributes: %s -> %r (default %r)' % (valspec['key'], attrs, default_attrs))
-			be.bits(1, 1)  # flag: have custom attributes
-			be.bits(encode_property_flags(attrs), PROP_FLAGS_BITS)
+		# internal prototype: not an actual property so not in property list
+		if bi.has_key('internal_prototype'):
+			_bidx(bi['internal_prototype'])
 		else:
-			be.bits(0, 1)  # flag: no custom attributes
-
-		if val is None:
-			print('WARNING: RAM init data format doesn\'t support "null" now, value replaced with "undefined": %r' % valspec)
-			#raise Exception('RAM init format doesn\'t support a "null" value now')
-			be.bits(PROP_TYPE_UNDEFINED, PROP_TYPE_BITS)
-		elif isinstance(val, bool):
-			if val == True:
-				be.bits(PROP_TYPE_BOOLEAN_TRUE, PROP_TYPE_BITS)
-			else:
-				be.bits(PROP_TYPE_BOOLEAN_FALSE, PROP_TYPE_BITS)
-		elif isinstance(val, (float, int)) or isinstance(val, dict) and val['type'] == 'double':
-			# Avoid converting a manually specified NaN temporarily into
-			# a float to avoid risk of e.g. NaN being replaced by another.
-			if isinstance(val, dict):
-				val = val['bytes'].decode('hex')
-				assert(len(val) == 8)
-			else:
-				val = struct.pack('>d', float(val))
-
-			be.bits(PROP_TYPE_DOUBLE, PROP_TYPE_BITS)
-
-			# encoding of double must match target architecture byte order
-			indexlist = {
-				'big':    [ 0, 1, 2, 3, 4, 5, 6, 7 ],
-				'little': [ 7, 6, 5, 4, 3, 2, 1, 0 ],
-				'mixed':  [ 3, 2, 1, 0, 7, 6, 5, 4 ]    # some arm platforms
-			}[double_byte_order]
-
-			data = ''.join([ val[indexlist[idx]] for idx in xrange(8) ])
-
-			#print('DOUBLE: %s -> %s' % (val.encode('hex'), data.encode('hex')))
-
-			if len(data) != 8:
-				raise Exception('internal error')
-			be.string(data)
-		elif isinstance(val, str) or isinstance(val, unicode):
-			if isinstance(val, unicode):
-				# Note: non-ASCII characters will not currently work,
-				# because bits/char is too low.
-				val = val.encode('utf-8')
-
-			if string_to_stridx.has_key(val):
-				# String value is in built-in string table -> encode
-				# using a string index.  This saves some space,
-				# especially for the 'name' property of errors
-				# ('EvalError' etc).
-
-				be.bits(PROP_TYPE_STRIDX, PROP_TYPE_BITS)
-				_stridx(val)
-			else:
-				# Not in string table -> encode as raw 7-bit value
-
-				be.bits(PROP_TYPE_STRING, PROP_TYPE_BITS)
-				be.bits(len(val), STRING_LENGTH_BITS)
-				for i in xrange(len(val)):
-					be.bits(ord(val[i]), STRING_CHAR_BITS)
-		elif isinstance(val, dict):
-			if val['type'] == 'object':
-				be.bits(PROP_TYPE_BUILTIN, PROP_TYPE_BITS)
-				_bidx(val['id'])
-			elif val['type'] == 'undefined':
-				be.bits(PROP_TYPE_UNDEFINED, PROP_TYPE_BITS)
-			elif val['type'] == 'accessor':
-				be.bits(PROP_TYPE_ACCESSOR, PROP_TYPE_BITS)
-				getter_fn = metadata_lookup_object(meta, val['getter_id'])
-				setter_fn = metadata_lookup_object(meta, val['setter_id'])
-				_natidx(getter_fn['native'])
-				_natidx(setter_fn['native'])
-				assert(getter_fn['nargs'] == 0)
-				assert(setter_fn['nargs'] == 1)
-				assert(getter_fn['magic'] == 0)
-				assert(setter_fn['magic'] == 0)
-			else:
-				raise Exception('unsupported value: %s' % repr(val))
-		else:
-			raise Exception('unsupported value: %s' % repr(val))
-
-	be.bits(len(functions), NUM_FUNC_PROPS_BITS)
-
-	for funprop in functions:
-		count_function_props += 1
+			_bidx(None)
 
-		funobj = metadata_lookup_object(meta, funprop['value']['id'])
-		prop_len = metadata_lookup_property(funobj, 'length')
-		assert(prop_len is not None)
-		assert(isinstance(prop_len['value'], (int)))
-		length = prop_len['value']
+	if section == 'initial':
+		initial_values = [ x for x in values if x['key'][0:1] == '\xff' ]
+		if len(initial_values) > 0:
+			be.bits(1, 1)  # flag: have internal properties
+			be.bits(len(initial_values), NUM_NORMAL_PROPS_BITS)
+		else:
+			be.bits(0, 1)  # flag: no internal properties
+		count_normal_props += _emit_values(initial_values)
+		return count_normal_props, count_function_props
+	if section == 'deferred':
+		values = [ x for x in values if x['key'][0:1] != '\xff' ]
 
-		_stridx_or_string(funprop['key'])
-		_natidx(funobj['native'])
-		be.bits(length, LENGTH_PROP_BITS)
+	if prop_proto is not None:
+		_bidx(prop_proto['value']['id'])
+	else:
+		_bidx(None)
+	if prop_constr is not None:
+		_bidx(prop_constr['value']['id'])
+	else:
+		_bidx(None)
 
-		if funobj.get('varargs', False):
-			be.bits(1, 1)  # flag: non-default nargs
-			be.bits(NARGS_VARARGS_MARKER, NARGS_BITS)
-		elif funobj.has_key('nargs') and funobj['nargs'] != length:
-			be.bits(1, 1)  # flag: non-default nargs
-			be.bits(funobj['nargs'], NARGS_BITS)
-		else:
-			be.bits(0, 1)  # flag: default nargs OK
+	if len(values) >= (1 << NUM_NORMAL_PROPS_BITS) or len(functions) >= (1 << NUM_FUNC_PROPS_BITS):
+		raise RamInitDataLimitError('too many properties for RAM init data in object %s' % bi['id'])
+	be.bits(len(values), NUM_NORMAL_PROPS_BITS)
+	count_normal_props += _emit_values(values)
 
-		# XXX: make this check conditional to minimize bit count
-		# (there are quite a lot of function properties)
-		magic = resolve_magic(funobj.get('magic'), objid_to_bidx)
-		if magic != 0:
-			assert(magic >= 0)
-			assert(magic < (1 << MAGIC_BITS))
-			be.bits(1, 1)
-			be.bits(magic, MAGIC_BITS)
-		else:
-			be.bits(0, 1)
+	be.bits(len(functions), NUM_FUNC_PROPS_BITS)
+	count_function_props += _emit_functions(functions)
 
 	return count_normal_props, count_function_props
 
@@ -1778,8 +1989,27 @@ def get_ramobj_native_func_maps(meta):
 
 	return native_funcs, natfunc_name_to_natidx
 
-# Generate bit-packed RAM object init data.
-def gen_ramobj_initdata_bitpacked(meta, native_funcs, natfunc_name_to_natidx, double_byte_order):
+# Replace byte strings at given bit offsets of a bitstream, used to create
+# the byte order variants of the RAM object init data.
+def patch_bitstream(data, patches):
+	nbits = len(data) * 8
+	val = long(data.encode('hex') or '0', 16)
+	for bitoff, patch in patches:
+		patchbits = len(patch) * 8
+		shift = nbits - bitoff - patchbits
+		assert(shift >= 0)
+		mask = ((1L << patchbits) - 1) << shift
+		val = (val & ~mask) | (long(patch.encode('hex'), 16) << shift)
+	return ('%0*x' % (len(data) * 2, val)).decode('hex')
+
+# Generate bit-packed RAM object init data for all double byte orders.
+# The object metadata is walked once; the variants only differ in the
+# byte order of double constants which are patched into a shared stream.
+# Returns a dict mapping byte order ('little', 'big', 'mixed') to data,
+# and a list of deferred property section bit offsets indexed by bidx
+# (0 if the object is not lazy).  Bit offsets are the same for all byte
+# order variants.
+def gen_ramobj_initdata_bitpacked(meta, native_funcs, natfunc_name_to_natidx):
 	# RAM initialization is based on a specially filtered list of top
 	# level objects which includes objects with 'bidx' and objects
 	# which aren't handled as inline values in the init bitstream.
@@ -1791,13 +2021,35 @@ def gen_ramobj_initdata_bitpacked(meta, native_funcs, natfunc_name_to_natidx, do
 	# Generate bitstream
 	be = dukutil.BitEncoder()
 	count_builtins = 0
+	count_lazy = 0
 	count_normal_props = 0
 	count_function_props = 0
+	double_patches = []
+	lazy_offsets = [ 0 ] * len(meta['objects_bidx'])
+	if len(objlist) >= NO_BIDX_MARKER:
+		raise RamInitDataLimitError('too many objects for RAM init data: %d' % len(objlist))
 	for o in objlist:
 		count_builtins += 1
 		gen_ramobj_initdata_for_object(meta, be, o, string_index, natfunc_name_to_natidx, objid_to_idx)
 	for o in objlist:
-		count_obj_normal, count_obj_func = gen_ramobj_initdata_for_props(meta, be, o, string_index, natfunc_name_to_natidx, objid_to_idx, double_byte_order)
+		if ramobj_is_lazy_eligible(meta, o, objid_to_idx):
+			section = 'initial'
+		else:
+			section = 'all'
+		count_obj_normal, count_obj_func = gen_ramobj_initdata_for_props(meta, be, o, string_index, natfunc_name_to_natidx, objid_to_idx, double_patches, section=section)
+		count_normal_props += count_obj_normal
+		count_function_props += count_obj_func
+
+	# Deferred property sections for lazy objects follow the per-object
+	# data so that eager initialization can decode the whole stream
+	# sequentially.  The offsets are only needed (and only emitted) for
+	# DUK_USE_LAZY_BUILTINS.
+	for o in objlist:
+		if not ramobj_is_lazy_eligible(meta, o, objid_to_idx):
+			continue
+		count_lazy += 1
+		lazy_offsets[objid_to_idx[o['id']]] = be.getNumBits()
+		count_obj_normal, count_obj_func = gen_ramobj_initdata_for_props(meta, be, o, string_index, natfunc_name_to_natidx, objid_to_idx, double_patches, section='deferred')
 		count_normal_props += count_obj_normal
 		count_function_props += count_obj_func
 
@@ -1805,10 +2057,16 @@ def gen_ramobj_initdata_bitpacked(meta, native_funcs, natfunc_name_to_natidx, do
 	#print(repr(romobj_init_data))
 	#print(len(romobj_init_data))
 
-	print('%d ram builtins, %d normal properties, %d function properties, %d bytes of object init data' % \
-	      (count_builtins, count_normal_props, count_function_props, len(romobj_init_data)))
+	res = {}
+	for double_byte_order, indexlist in DOUBLE_BYTE_ORDERS.iteritems():
+		res[double_byte_order] = patch_bitstream(romobj_init_data, [
+			(bitoff, ''.join([ val[indexlist[idx]] for idx in xrange(8) ])) for bitoff, val in double_patches
+		])
+
+	print('%d ram builtins (%d lazy), %d normal properties, %d function properties, %d double constants, %d bytes of object init data' % \
+	      (count_builtins, count_lazy, count_normal_props, count_function_props, len(double_patches), len(romobj_init_data)))
 
-	return romobj_init_data
+	return res, lazy_offsets
 
 # Functions to emit object-related source/header parts.
 
@@ -1822,9 +2080,19 @@ def emit_ramobj_source_nativefunc_array(genc, native_func_list):
 		genc.emitLine('\t%s,' % i)
 	genc.emitLine('};')
 
+def ramobj_lazy_offsets_type(lazy_offsets):
+	if max(lazy_offsets + [ 0 ]) <= 0xffff:
+		return 'duk_uint16_t'
+	return 'duk_uint32_t'
+
 def emit_ramobj_source_objinit_data(genc, init_data):
 	genc.emitArray(init_data, 'duk_builtins_data', visibility='DUK_INTERNAL', typename='duk_uint8_t', intvalues=True, const=True, size=len(init_data))
 
+def emit_ramobj_source_lazy_offsets(genc, lazy_offsets):
+	genc.emitLine('#if defined(DUK_USE_LAZY_BUILTINS)')
+	genc.emitArray(lazy_offsets, 'duk_builtins_lazy_offsets', visibility='DUK_INTERNAL', typename=ramobj_lazy_offsets_type(lazy_offsets), intvalues=True, const=True, size=len(lazy_offsets))
+	genc.emitLine('#endif  /* DUK_USE_LAZY_BUILTINS */')
+
 def emit_initjs_source(genc, initjs_data):
 	genc.emitLine('#if defined(DUK_USE_BUILTIN_INITJS)')
 	genc.emitArray(initjs_data, 'duk_initjs_data', visibility='DUK_INTERNAL', typename='duk_uint8_t', intvalues=True, const=True, size=len(initjs_data))
@@ -1858,6 +2126,13 @@ def emit_ramobj_header_initdata(genc, init_data):
 	genc.emitLine('#endif  /* !DUK_SINGLE_FILE */')
 	genc.emitDefine('DUK_BUILTINS_DATA_LENGTH', len(init_data))
 
+def emit_ramobj_header_lazy_offsets(genc, lazy_offsets):
+	genc.emitLine('#if defined(DUK_USE_LAZY_BUILTINS)')
+	genc.emitLine('#if !defined(DUK_SINGLE_FILE)')
+	genc.emitLine('DUK_INTERNAL_DECL const %s duk_builtins_lazy_offsets[%d];' % (ramobj_lazy_offsets_type(lazy_offsets), len(lazy_offsets)))
+	genc.emitLine('#endif  /* !DUK_SINGLE_FILE */')
+	genc.emitLine('#endif  /* DUK_USE_LAZY_BUILTINS */')
+
 #
 #  ROM init data
 #
@@ -2074,34 +2349,36 @@ def rom_emit_strings_source(genc, meta):
 		tmp += '};'
 		genc.emitLine(tmp)
 
-	# Emit an array of ROM strings, used for string interning.
-	#
-	# XXX: String interning now simply walks through the list checking if
-	# an incoming string is present in ROM.  It would be better to use
-	# binary search (or perhaps even a perfect hash) for this lookup.
-	# To support binary search we could emit the list in string hash
-	# order, but because there are multiple different hash variants
-	# there would need to be multiple lists.  We could also order the
-	# strings based on the string data which is independent of the string
-	# hash and still possible to binary search relatively efficiently.
+	# Emit an array of ROM strings and a hash bucket index, used for
+	# string interning: the low bits of the computed string hash select
+	# a bucket whose strings are stored consecutively in duk_rom_strings[],
+	# and duk_rom_strings_lookup[] gives the start index of each bucket
+	# (with an end marker).  The low hash bits are the same for 16-bit
+	# and 32-bit hashes but differ between dense/sparse hashing and byte
+	# order, so one variant is emitted per hash algorithm.  The variant
+	# selection must match the DUK__STRHASH16/32 macros above.
 	#
 	# cdecl> explain const int * const foo;
 	# declare foo as const pointer to const int
+	lookup_bits = rom_get_strings_lookup_bits(strs)
+	lookup_variants = [
+		('defined(DUK_USE_STRHASH_DENSE) && defined(DUK_USE_HASHBYTES_UNALIGNED_U32_ACCESS) && defined(DUK_USE_INTEGER_BE)',
+		 lambda x: dukutil.duk_heap_hashstring_dense(x, DUK__FIXED_HASH_SEED, big_endian=True)),
+		('defined(DUK_USE_STRHASH_DENSE)',
+		 lambda x: dukutil.duk_heap_hashstring_dense(x, DUK__FIXED_HASH_SEED, big_endian=False)),
+		(None,
+		 lambda x: dukutil.duk_heap_hashstring_sparse(x, DUK__FIXED_HASH_SEED))
+	]
 	genc.emitLine('')
-	genc.emitLine('DUK_INTERNAL const duk_hstring * const duk_rom_strings[%d] = {'% len(strs))
-	tmp = []
-	linecount = 0
-	for str_index,v in enumerate(strs):
-		if str_index > 0:
-			tmp.append(', ')
-		if linecount >= 6:
-			linecount = 0
-			tmp.append('\n')
-		tmp.append('(const duk_hstring *) &duk_str_%d' % str_index)
-		linecount += 1
-	for line in ''.join(tmp).split('\n'):
-		genc.emitLine(line)
-	genc.emitLine('};')
+	for idx, (cond, hashfunc) in enumerate(lookup_variants):
+		if idx == 0:
+			genc.emitLine('#if %s' % cond)
+		elif cond is not None:
+			genc.emitLine('#elif %s' % cond)
+		else:
+			genc.emitLine('#else')
+		rom_emit_strings_lookup(genc, strs, hashfunc, lookup_bits)
+	genc.emitLine('#endif')
 
 	# Emit an array of duk_hstring pointers indexed using DUK_STRIDX_xxx.
 	# This will back e.g. DUK_HTHREAD_STRING_XYZ(thr) directly, without
@@ -2117,12 +2394,57 @@ def rom_emit_strings_source(genc, meta):
 
 	return bi_str_map
 
+# Number of hash bits used for the ROM string lookup buckets: aim for an
+# average of one to two strings per bucket.  Must be at most 16 so that
+# the bucket is the same for 16-bit and 32-bit string hashes.
+def rom_get_strings_lookup_bits(strs):
+	bits = 0
+	while (1 << (bits + 1)) <= len(strs):
+		bits += 1
+	assert(bits <= 16)
+	return bits
+
+# Emit duk_rom_strings[] in hash bucket order and the bucket index
+# duk_rom_strings_lookup[] for one string hash variant.
+def rom_emit_strings_lookup(genc, strs, hashfunc, lookup_bits):
+	nbuckets = 1 << lookup_bits
+	buckets = [ [] for i in xrange(nbuckets) ]
+	for str_index,v in enumerate(strs):
+		buckets[hashfunc(v) & (nbuckets - 1)].append(str_index)
+
+	genc.emitLine('DUK_INTERNAL const duk_hstring * const duk_rom_strings[%d] = {'% len(strs))
+	tmp = []
+	linecount = 0
+	for str_index in [ i for b in buckets for i in b ]:
+		if len(tmp) > 0:
+			tmp.append(', ')
+		if linecount >= 6:
+			linecount = 0
+			tmp.append('\n')
+		tmp.append('(const duk_hstring *) &duk_str_%d' % str_index)
+		linecount += 1
+	for line in ''.join(tmp).split('\n'):
+		genc.emitLine(line)
+	genc.emitLine('};')
+
+	offsets = [ 0 ]
+	for b in buckets:
+		offsets.append(offsets[-1] + len(b))
+	assert(offsets[-1] == len(strs) and offsets[-1] <= 0xffff)
+	genc.emitArray(offsets, 'duk_rom_strings_lookup', visibility='DUK_INTERNAL', typename='duk_uint16_t', intvalues=True, const=True, size=len(offsets))
+
+	print('%d rom strings in %d lookup buckets, longest bucket %d' % \
+	      (len(strs), nbuckets, max([ len(b) for b in buckets ])))
+
 # Emit ROM strings header.
 def rom_emit_strings_header(genc, meta):
+	lookup_bits = rom_get_strings_lookup_bits(meta['strings'])
 	genc.emitLine('#if !defined(DUK_SINGLE_FILE)')  # C++ static const workaround
 	genc.emitLine('DUK_INTERNAL_DECL const duk_hstring * const duk_rom_strings[%d];'% len(meta['strings']))
+	genc.emitLine('DUK_INTERNAL_DECL const duk_uint16_t duk_rom_strings_lookup[%d];' % ((1 << lookup_bits) + 1))
 	genc.emitLine('DUK_INTERNAL_DECL const duk_hstring * const duk_rom_strings_stridx[%d];' % len(meta['strings_stridx']))
 	genc.emitLine('#endif')
+	genc.emitDefine('DUK_ROM_STRINGS_LOOKUP_MASK', '0x%04xUL' % ((1 << lookup_bits) - 1))
 
 # Emit ROM objects initialized types and macros.
 def rom_emit_object_initializer_types_and_macros(genc):
@@ -2497,7 +2819,7 @@ def rom_emit_objects(genc, meta, bi_str_map):
 				 iproto, iproto_enc16, e_size, e_next, a_size, h_size, \
 				 nativefunc, nargs, magic)
 		elif obj.get('class') == 'Array':
-			arrlen = 0
+			arrlen = obj.get('array_length', 0)
 			tmp += 'DUK__ROMARR_INIT(%s,%d,%s,%d,%s,%d,%d,%d,%d,%d,%d);' % \
 				('|'.join(flags), refcount, props, props_enc16, \
 				 iproto, iproto_enc16, e_size, e_next, a_size, h_size, arrlen)
@@ -2672,6 +2994,7 @@ def main():
 	parser.add_option('--out-header', dest='out_header', help='Output header file')
 	parser.add_option('--out-source', dest='out_source', help='Output source file')
 	parser.add_option('--out-metadata-json', dest='out_metadata_json', help='Output metadata file')
+	parser.add_option('--metadata-cache-dir', dest='metadata_cache_dir', default=None, help='Directory for caching parsed and normalized metadata between runs (optional)')
 	parser.add_option('--dev-dump-final-ram-metadata', dest='dev_dump_final_ram_metadata', help='Development option')
 	parser.add_option('--dev-dump-final-rom-metadata', dest='dev_dump_final_rom_metadata', help='Development option')
 	(opts, args) = parser.parse_args()
@@ -2707,9 +3030,15 @@ def main():
 	ramstr_data, ramstr_maxlen = gen_ramstr_initdata_bitpacked(ram_meta)
 	ram_native_funcs, ram_natfunc_name_to_natidx = get_ramobj_native_func_maps(ram_meta)
 
-	ramobj_data_le = gen_ramobj_initdata_bitpacked(ram_meta, ram_native_funcs, ram_natfunc_name_to_natidx, 'little')
-	ramobj_data_be = gen_ramobj_initdata_bitpacked(ram_meta, ram_native_funcs, ram_natfunc_name_to_natidx, 'big')
-	ramobj_data_me = gen_ramobj_initdata_bitpacked(ram_meta, ram_native_funcs, ram_natfunc_name_to_natidx, 'mixed')
+	ramobj_error = None
+	try:
+		ramobj_data, ramobj_lazy_offsets = gen_ramobj_initdata_bitpacked(ram_meta, ram_native_funcs, ram_natfunc_name_to_natidx)
+	except RamInitDataLimitError, e:
+		if not opts.rom_support:
+			raise
+		# ROM objects are still usable, fail RAM object builds at compile time.
+		print('WARNING: RAM built-in objects not supported: %s' % e)
+		ramobj_error = '#error RAM built-in objects not supported for this metadata (see genbuiltins.py output), use DUK_USE_ROM_OBJECTS'
 
 	# Write source and header files.
 
@@ -2736,17 +3065,21 @@ def main():
 	else:
 		gc_src.emitLine('#error ROM support not enabled, rerun make_dist.py with --rom-support')
 	gc_src.emitLine('#else  /* DUK_USE_ROM_OBJECTS */')
-	emit_ramobj_source_nativefunc_array(gc_src, ram_native_funcs)  # endian independent
-	emit_initjs_source(gc_src, initjs_data)  # InitJS is now only active with RAM objects
-	gc_src.emitLine('#if defined(DUK_USE_DOUBLE_LE)')
-	emit_ramobj_source_objinit_data(gc_src, ramobj_data_le)
-	gc_src.emitLine('#elif defined(DUK_USE_DOUBLE_BE)')
-	emit_ramobj_source_objinit_data(gc_src, ramobj_data_be)
-	gc_src.emitLine('#elif defined(DUK_USE_DOUBLE_ME)')
-	emit_ramobj_source_objinit_data(gc_src, ramobj_data_me)
-	gc_src.emitLine('#else')
-	gc_src.emitLine('#error invalid endianness defines')
-	gc_src.emitLine('#endif')
+	if ramobj_error is not None:
+		gc_src.emitLine(ramobj_error)
+	else:
+		emit_ramobj_source_nativefunc_array(gc_src, ram_native_funcs)  # endian independent
+		emit_initjs_source(gc_src, initjs_data)  # InitJS is now only active with RAM objects
+		emit_ramobj_source_lazy_offsets(gc_src, ramobj_lazy_offsets)  # endian independent
+		gc_src.emitLine('#if defined(DUK_USE_DOUBLE_LE)')
+		emit_ramobj_source_objinit_data(gc_src, ramobj_data['little'])
+		gc_src.emitLine('#elif defined(DUK_USE_DOUBLE_BE)')
+		emit_ramobj_source_objinit_data(gc_src, ramobj_data['big'])
+		gc_src.emitLine('#elif defined(DUK_USE_DOUBLE_ME)')
+		emit_ramobj_source_objinit_data(gc_src, ramobj_data['mixed'])
+		gc_src.emitLine('#else')
+		gc_src.emitLine('#error invalid endianness defines')
+		gc_src.emitLine('#endif')
 	gc_src.emitLine('#endif  /* DUK_USE_ROM_OBJECTS */')
 
 	gc_hdr = dukutil.GenerateC()
@@ -2781,19 +3114,23 @@ def main():
 	else:
 		gc_hdr.emitLine('#error ROM support not enabled, rerun make_dist.py with --rom-support')
 	gc_hdr.emitLine('#else')
-	emit_header_native_function_declarations(gc_hdr, rom_meta)
-	emit_ramobj_header_nativefunc_array(gc_hdr, ram_native_funcs)
-	emit_ramobj_header_initjs(gc_hdr, initjs_data)
-	emit_ramobj_header_objects(gc_hdr, ram_meta)
-	gc_hdr.emitLine('#if defined(DUK_USE_DOUBLE_LE)')
-	emit_ramobj_header_initdata(gc_hdr, ramobj_data_le)
-	gc_hdr.emitLine('#elif defined(DUK_USE_DOUBLE_BE)')
-	emit_ramobj_header_initdata(gc_hdr, ramobj_data_be)
-	gc_hdr.emitLine('#elif defined(DUK_USE_DOUBLE_ME)')
-	emit_ramobj_header_initdata(gc_hdr, ramobj_data_me)
-	gc_hdr.emitLine('#else')
-	gc_hdr.emitLine('#error invalid endianness defines')
-	gc_hdr.emitLine('#endif')
+	if ramobj_error is not None:
+		gc_hdr.emitLine(ramobj_error)
+	else:
+		emit_header_native_function_declarations(gc_hdr, rom_meta)
+		emit_ramobj_header_nativefunc_array(gc_hdr, ram_native_funcs)
+		emit_ramobj_header_initjs(gc_hdr, initjs_data)
+		emit_ramobj_header_objects(gc_hdr, ram_meta)
+		emit_ramobj_header_lazy_offsets(gc_hdr, ramobj_lazy_offsets)
+		gc_hdr.emitLine('#if defined(DUK_USE_DOUBLE_LE)')
+		emit_ramobj_header_initdata(gc_hdr, ramobj_data['little'])
+		gc_hdr.emitLine('#elif defined(DUK_USE_DOUBLE_BE)')
+		emit_ramobj_header_initdata(gc_hdr, ramobj_data['big'])
+		gc_hdr.emitLine('#elif defined(DUK_USE_DOUBLE_ME)')
+		emit_ramobj_header_initdata(gc_hdr, ramobj_data['mixed'])
+		gc_hdr.emitLine('#else')
+		gc_hdr.emitLine('#error invalid endianness defines')
+		gc_hdr.emitLine('#endif')
 	gc_hdr.emitLine('#endif  /* DUK_USE_ROM_OBJECTS */')
 	gc_hdr.emitLine('#endif  /* DUK_BUILTINS_H_INCLUDED */')
 
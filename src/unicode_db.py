@@ -0,0 +1,206 @@
+#!/usr/bin/env python2
+#
+#  Unicode character database shared by the Unicode table generators
+#  (extract_chars.py, extract_caseconv.py).
+#
+#  UnicodeData.txt lists most codepoints individually, but large blocks
+#  (CJK ideographs, Hangul syllables, private use planes) are listed as
+#  "<..., First>" / "<..., Last>" line pairs.  The database keeps such
+#  blocks as ranges: each general category maps to a sorted list of
+#  disjoint, non-adjacent [start, end] intervals, and codepoint sets are
+#  computed with interval arithmetic instead of per-codepoint filtering.
+#  Only codepoints with case mappings are stored individually.
+#
+#  The parsed database can be cached on disk using Python pickle; the
+#  cache is keyed by a hash of UnicodeData.txt so it's automatically
+#  ignored if the source changes.
+#
+#  Both the original UnicodeData.txt and an expanded one (ranges unpacked
+#  into individual lines) are accepted.
+#
+
+import os
+import re
+import hashlib
+import cPickle
+
+UNICODE_DB_CACHE_VERSION = 1
+
+MAX_CODEPOINT = 0x10ffff
+
+re_codepoint_spec = re.compile(r'^[0-9A-F]{4,6}$')
+
+#
+#  Interval helpers, ranges are lists of (start, end) tuples (inclusive).
+#
+
+def normalize_ranges(ranges):
+	"Sort ranges and merge overlapping and adjacent ones."
+	res = []
+	for start, end in sorted(ranges):
+		if len(res) > 0 and start <= res[-1][1] + 1:
+			if end > res[-1][1]:
+				res[-1] = (res[-1][0], end)
+		else:
+			res.append((start, end))
+	return res
+
+def union_ranges(a, b):
+	return normalize_ranges(a + b)
+
+def subtract_ranges(a, b):
+	"Ranges in 'a' but not in 'b', both must be normalized."
+	res = []
+	j = 0
+	for start, end in a:
+		while j < len(b) and b[j][1] < start:
+			j += 1
+		k = j
+		curr = start
+		while k < len(b) and b[k][0] <= end:
+			if b[k][0] > curr:
+				res.append((curr, b[k][0] - 1))
+			curr = max(curr, b[k][1] + 1)
+			k += 1
+		if curr <= end:
+			res.append((curr, end))
+	return res
+
+def intersect_ranges(a, b):
+	"Ranges in both 'a' and 'b', both must be normalized."
+	res = []
+	i = 0
+	j = 0
+	while i < len(a) and j < len(b):
+		start = max(a[i][0], b[j][0])
+		end = min(a[i][1], b[j][1])
+		if start <= end:
+			res.append((start, end))
+		if a[i][1] < b[j][1]:
+			i += 1
+		else:
+			j += 1
+	return res
+
+def count_ranges(ranges):
+	return sum([ end - start + 1 for start, end in ranges ])
+
+class UnicodeDatabase:
+	"Range compressed representation of UnicodeData.txt."
+
+	def __init__(self):
+		self.categories = {}     # general category (e.g. 'Lu') -> ranges
+		self.assigned = []       # all codepoints listed in UnicodeData.txt
+		self.case_mappings = []  # (codepoint, uc, lc, tc), fields as in UnicodeData.txt, sorted
+
+	def parse(self, filename):
+		cat_ranges = {}
+		case_mappings = []
+
+		def add_range(start, end, parts):
+			cat_ranges.setdefault(parts[2], []).append((start, end))
+			if parts[12] != '' or parts[13] != '' or parts[14] != '':
+				for i in xrange(start, end + 1):
+					case_mappings.append((long(i), parts[12], parts[13], parts[14]))
+
+		# A "First>" line is held back until the next line shows whether it
+		# starts a range.  Expanded files repeat the "First>" name on every
+		# line, so an unpaired one is just a single codepoint.
+		pending = None
+
+		f = open(filename, 'rb')
+		for line in f:
+			if line.startswith('#'):
+				continue
+			line = line.strip()
+			if line == '':
+				continue
+			parts = line.split(';')
+			if len(parts) != 15:
+				raise Exception('invalid unicode data line')
+			cp = long(parts[0], 16)
+
+			if parts[1].endswith('Last>'):
+				if pending is None:
+					raise Exception('cannot parse range')
+				add_range(pending[0], cp, pending[1])
+				pending = None
+				continue
+			if pending is not None:
+				add_range(pending[0], pending[0], pending[1])
+				pending = None
+			if parts[1].endswith('First>'):
+				pending = (cp, parts)
+			else:
+				add_range(cp, cp, parts)
+		if pending is not None:
+			add_range(pending[0], pending[0], pending[1])
+		f.close()
+
+		self.categories = {}
+		for cat in cat_ranges.keys():
+			self.categories[cat] = normalize_ranges(cat_ranges[cat])
+		self.assigned = normalize_ranges(sum(self.categories.values(), []))
+		case_mappings.sort()
+		self.case_mappings = case_mappings
+
+	def get_category_ranges(self, spec):
+		"""Ranges for a category spec: a category or category prefix (e.g.
+		'Lu' or 'L'), or a single codepoint as 4-6 uppercase hex digits
+		(e.g. '0024'), matching only if listed in UnicodeData.txt."""
+
+		if re_codepoint_spec.match(spec):
+			cp = long(spec, 16)
+			return intersect_ranges(self.assigned, [ (cp, cp) ])
+		res = []
+		for cat in self.categories.keys():
+			if cat.startswith(spec):
+				res += self.categories[cat]
+		return normalize_ranges(res)
+
+	def get_codepoint_set(self, catsinc, catsexc):
+		"""Ranges for codepoints matching any of the 'catsinc' specs but none of
+		the 'catsexc' specs.  Pseudo-categories ASCII and NONBMP can be used
+		for exclusion."""
+
+		inc = []
+		for spec in catsinc:
+			inc += self.get_category_ranges(spec)
+		exc = []
+		for spec in catsexc:
+			if spec == 'ASCII':
+				exc.append((0, 0x7f))
+			elif spec == 'NONBMP':
+				exc.append((0x10000, MAX_CODEPOINT))
+			else:
+				exc += self.get_category_ranges(spec)
+		return subtract_ranges(normalize_ranges(inc), normalize_ranges(exc))
+
+def load_unicode_database(filename, cache_filename=None):
+	"Load UnicodeData.txt, using and updating a pickle cache if given."
+
+	h = hashlib.sha1()
+	with open(filename, 'rb') as f:
+		h.update(f.read())
+	key = '%d:%s' % (UNICODE_DB_CACHE_VERSION, h.hexdigest())
+
+	if cache_filename is not None and os.path.isfile(cache_filename):
+		try:
+			with open(cache_filename, 'rb') as f:
+				cached_key, db = cPickle.load(f)
+			if cached_key == key:
+				return db
+		except Exception:
+			pass  # corrupt or incompatible cache, reparse
+
+	db = UnicodeDatabase()
+	db.parse(filename)
+
+	if cache_filename is not None:
+		# Write and rename so that concurrent readers never see a partial file.
+		tmp = '%s.tmp%d' % (cache_filename, os.getpid())
+		with open(tmp, 'wb') as f:
+			cPickle.dump((key, db), f, cPickle.HIGHEST_PROTOCOL)
+		os.rename(tmp, cache_filename)
+
+	return db
@@ -247,6 +247,47 @@ def context_linux_x64_v8_bench_pass():
 	execute([ os.path.join(cwd, 'duk'), os.path.join('tests', 'google-v8-benchmark-v7', 'combined.js') ])
 	return True
 
+def context_linux_x64_perf_diff():
+	cwd = os.getcwd()
+
+	print('NOTE: Performance comparison against master; results are')
+	print('only meaningful on dedicated hardware.')
+	print('')
+
+	def build(out_fn):
+		execute([ 'make', 'clean' ])
+		execute([ 'make', 'duk.O2' ])
+		execute([ 'cp', os.path.join(cwd, 'duk.O2'), out_fn ])
+
+	new_duk = os.path.join(temp_dir, 'duk.O2.new')
+	old_duk = os.path.join(temp_dir, 'duk.O2.master')
+	build(new_duk)
+	execute([ 'git', 'clean', '-f' ])
+	execute([ 'git', 'reset', '--hard' ])
+	execute([ 'git', 'checkout', 'master' ])
+	build(old_duk)
+	execute([ 'git', 'clean', '-f' ])
+	execute([ 'git', 'reset', '--hard' ])
+	execute([ 'git', 'checkout', commit_name ])
+
+	# Same engine name for both runs so that results are compared pairwise.
+	for duk, out_fn in [ (old_duk, 'perf-master.json'), (new_duk, 'perf-new.json') ]:
+		execute([
+			'python2', os.path.join(cwd, 'util', 'perftest.py'),
+			'--engine', 'duk.O2=' + duk,
+			'--count', '5', '--max-count', '15', '--warmup', '1',
+			'--output', os.path.join(temp_dir, out_fn)
+		])
+
+	res = execute([
+		'python2', os.path.join(cwd, 'util', 'perf_history.py'),
+		'--only-flagged', 'compare',
+		os.path.join(temp_dir, 'perf-master.json'),
+		os.path.join(temp_dir, 'perf-new.json')
+	], catch=True)
+	set_output_description(res['stdout'].strip().split('\n')[-1])
+	return res['success']
+
 def context_linux_x64_duk_clang():
 	cwd = os.getcwd()
 	execute([ 'make', 'duk-clang' ])
@@ -883,6 +924,7 @@ context_handlers = {
 	'linux-x86-ajduk-rombuild': context_linux_x86_ajduk_rombuild,
 
 	'linux-x64-v8-bench-pass': context_linux_x64_v8_bench_pass,
+	'linux-x64-perf-diff': context_linux_x64_perf_diff,
 
 	'linux-x64-duk-dddprint': context_linux_x64_duk_dddprint,
 	'linux-x64-duk-separate-src': context_linux_x64_duk_separate_src,
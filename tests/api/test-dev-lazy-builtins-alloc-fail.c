@@ -0,0 +1,132 @@
+/*
+ *  Allocation failures while a built-in is first accessed.  With
+ *  DUK_USE_LAZY_BUILTINS the first access creates the built-in's
+ *  properties; if that fails the access must throw and a later access
+ *  must see the complete built-in, like without lazy built-ins.
+ *
+ *  Every allocation after the first 'n' ones fails until failures are
+ *  disabled again, for increasing 'n' until the access succeeds.
+ */
+
+/*===
+Object.getOwnPropertyNames: ok
+Math.max: ok
+JSON.stringify: ok
+Date.prototype.toGMTString: ok
+Object.prototype.__proto__: ok
+Error.prototype.stack: ok
+done
+===*/
+
+static long alloc_countdown = -1;  /* < 0: never fail */
+
+static int alloc_should_fail(void) {
+	if (alloc_countdown < 0) {
+		return 0;
+	}
+	if (alloc_countdown == 0) {
+		return 1;
+	}
+	alloc_countdown--;
+	return 0;
+}
+
+static void *my_alloc(void *udata, size_t size) {
+	(void) udata;
+	if (alloc_should_fail()) {
+		return NULL;
+	}
+	return malloc(size);
+}
+
+static void *my_realloc(void *udata, void *ptr, size_t size) {
+	(void) udata;
+	if (size > 0 && alloc_should_fail()) {
+		return NULL;
+	}
+	return realloc(ptr, size);
+}
+
+static void my_free(void *udata, void *ptr) {
+	(void) udata;
+	free(ptr);
+}
+
+static duk_ret_t access_key(duk_context *ctx, void *udata) {
+	/* Lookup only: accessors on prototypes would throw when called. */
+	duk_push_boolean(ctx, duk_has_prop_string(ctx, -1, (const char *) udata));
+	return 1;
+}
+
+/* Describe the own properties of the object at stack top as a string. */
+static const char *describe(duk_context *ctx) {
+	duk_eval_string(ctx,
+		"(function (o) {\n"
+		"    return Object.getOwnPropertyNames(o).sort().map(function (k) {\n"
+		"        var d = Object.getOwnPropertyDescriptor(o, k);\n"
+		"        return k + ':' + ('get' in d ? 'accessor' : typeof d.value) + ':' +\n"
+		"               d.writable + d.enumerable + d.configurable;\n"
+		"    }).join(',');\n"
+		"})");
+	duk_dup(ctx, -2);
+	duk_call(ctx, 1);
+	return duk_get_string(ctx, -1);
+}
+
+static void test_target(const char *path, const char *key) {
+	duk_context *ctx;
+	char *expect;
+	long n;
+	int failed = 0;
+	duk_int_t rc;
+
+	ctx = duk_create_heap(my_alloc, my_realloc, my_free, NULL, NULL);
+	duk_eval_string(ctx, path);
+	describe(ctx);
+	expect = (char *) malloc(duk_get_length(ctx, -1) + 1);
+	strcpy(expect, duk_get_string(ctx, -1));
+	duk_destroy_heap(ctx);
+
+	for (n = 0; n < 100000; n++) {
+		ctx = duk_create_heap(my_alloc, my_realloc, my_free, NULL, NULL);
+		duk_eval_string(ctx, path);
+
+		alloc_countdown = n;
+		rc = duk_safe_call(ctx, access_key, (void *) key, 0 /*nargs*/, 1 /*nrets*/);
+		alloc_countdown = -1;
+		duk_pop(ctx);
+
+		/* Whether or not the first access failed, the object must now
+		 * be complete and the property must work.
+		 */
+		if (strcmp(describe(ctx), expect) != 0) {
+			printf("%s, n=%ld: mismatch: %s\n", path, n, duk_get_string(ctx, -1));
+			failed = 1;
+		}
+		duk_pop(ctx);
+		if (!duk_has_prop_string(ctx, -1, key)) {
+			printf("%s, n=%ld: %s is missing\n", path, n, key);
+			failed = 1;
+		}
+		duk_destroy_heap(ctx);
+
+		if (rc == DUK_EXEC_SUCCESS || failed) {
+			break;
+		}
+	}
+
+	printf("%s.%s: %s\n", path, key, failed ? "FAILED" : "ok");
+	free(expect);
+}
+
+void test(duk_context *ctx) {
+	(void) ctx;
+
+	test_target("Object", "getOwnPropertyNames");
+	test_target("Math", "max");
+	test_target("JSON", "stringify");
+	test_target("Date.prototype", "toGMTString");
+	test_target("Object.prototype", "__proto__");
+	test_target("Error.prototype", "stack");
+	printf("done\n");
+}
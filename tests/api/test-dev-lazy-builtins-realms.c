@@ -0,0 +1,132 @@
+/*
+ *  Built-in objects accessed from other realms and from threads with a
+ *  replaced global object.  With DUK_USE_LAZY_BUILTINS the properties of
+ *  the initial realm's built-ins are created on first access, and must be
+ *  resolved against the realm owning the built-in rather than the realm of
+ *  the accessing thread.  The built-ins used here are not touched before
+ *  the actual test.  The last test replaces the global object of the heap's
+ *  initial context, whose built-ins are the lazy ones.
+ */
+
+/*===
+*** test_cross_realm (duk_safe_call)
+new realm top: 1
+max: 5
+same Function.prototype as initial realm: true
+different Math from new realm: true
+final top: 0
+==> rc=0, result='undefined'
+*** test_replaced_global (duk_safe_call)
+stringify: [1,2]
+JSON visible: false
+final top: 0
+==> rc=0, result='undefined'
+*** test_replaced_heap_global (duk_safe_call)
+fromCharCode: hi
+String visible: false
+isArray: true
+final top: 0
+==> rc=0, result='undefined'
+===*/
+
+static duk_ret_t test_cross_realm(duk_context *ctx, void *udata) {
+	duk_context *new_ctx;
+
+	(void) udata;
+
+	duk_push_thread_new_globalenv(ctx);
+	new_ctx = duk_get_context(ctx, -1);
+	printf("new realm top: %ld\n", (long) duk_get_top(ctx));
+
+	/* Initial realm Math, accessed for the first time from the new realm. */
+	duk_get_global_string(ctx, "Math");
+	duk_xmove_top(new_ctx, ctx, 1);
+	duk_get_prop_string(new_ctx, -1, "max");
+	duk_push_int(new_ctx, 1);
+	duk_push_int(new_ctx, 5);
+	duk_call(new_ctx, 2);
+	printf("max: %s\n", duk_to_string(new_ctx, -1));
+	duk_pop(new_ctx);
+
+	/* Function properties must inherit from the owning realm. */
+	duk_get_prop_string(new_ctx, -1, "min");
+	duk_xmove_top(ctx, new_ctx, 1);
+	duk_eval_string(ctx, "(function (f) { return Object.getPrototypeOf(f) === Function.prototype; })");
+	duk_dup(ctx, -2);
+	duk_call(ctx, 1);
+	printf("same Function.prototype as initial realm: %s\n", duk_to_boolean(ctx, -1) ? "true" : "false");
+	duk_pop_2(ctx);
+
+	duk_get_global_string(new_ctx, "Math");
+	printf("different Math from new realm: %s\n", duk_strict_equals(new_ctx, -1, -2) ? "false" : "true");
+	duk_pop_2(new_ctx);
+
+	duk_pop(ctx);
+	printf("final top: %ld\n", (long) duk_get_top(ctx));
+	return 0;
+}
+
+static duk_ret_t test_replaced_global(duk_context *ctx, void *udata) {
+	duk_context *thr_ctx;
+
+	(void) udata;
+
+	duk_push_thread(ctx);
+	thr_ctx = duk_get_context(ctx, -1);
+
+	duk_get_global_string(thr_ctx, "JSON");
+	duk_push_object(thr_ctx);
+	duk_set_global_object(thr_ctx);
+
+	/* JSON is first accessed after the thread's global was replaced. */
+	duk_get_prop_string(thr_ctx, -1, "stringify");
+	duk_eval_string(thr_ctx, "[1,2]");
+	duk_call(thr_ctx, 1);
+	printf("stringify: %s\n", duk_to_string(thr_ctx, -1));
+	duk_pop(thr_ctx);
+
+	duk_eval_string(thr_ctx, "typeof JSON !== 'undefined'");
+	printf("JSON visible: %s\n", duk_to_boolean(thr_ctx, -1) ? "true" : "false");
+	duk_pop_2(thr_ctx);
+
+	duk_pop(ctx);
+	printf("final top: %ld\n", (long) duk_get_top(ctx));
+	return 0;
+}
+
+/* Replaces the global object of the heap's initial context, run last. */
+static duk_ret_t test_replaced_heap_global(duk_context *ctx, void *udata) {
+	(void) udata;
+
+	duk_get_global_string(ctx, "String");
+	duk_get_global_string(ctx, "Array");
+	duk_push_object(ctx);
+	duk_set_global_object(ctx);
+
+	/* String and Array are first accessed after the global was replaced. */
+	duk_get_prop_string(ctx, -2, "fromCharCode");
+	duk_push_int(ctx, 104);
+	duk_push_int(ctx, 105);
+	duk_call(ctx, 2);
+	printf("fromCharCode: %s\n", duk_to_string(ctx, -1));
+	duk_pop(ctx);
+
+	duk_eval_string(ctx, "typeof String !== 'undefined'");
+	printf("String visible: %s\n", duk_to_boolean(ctx, -1) ? "true" : "false");
+	duk_pop(ctx);
+
+	duk_get_prop_string(ctx, -1, "isArray");
+	duk_eval_string(ctx, "[ 1, 2 ]");
+	duk_call(ctx, 1);
+	printf("isArray: %s\n", duk_to_boolean(ctx, -1) ? "true" : "false");
+	duk_pop_3(ctx);
+
+	printf("final top: %ld\n", (long) duk_get_top(ctx));
+	return 0;
+}
+
+void test(duk_context *ctx) {
+	TEST_SAFE_CALL(test_cross_realm);
+	TEST_SAFE_CALL(test_replaced_global);
+	TEST_SAFE_CALL(test_replaced_heap_global);
+}
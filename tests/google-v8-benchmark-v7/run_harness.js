@@ -4,7 +4,11 @@ if (typeof globalObject.print !== 'function') {
   globalObject.print = globalObject.console.log;
 }
 
+// Time since previous result, i.e. time taken by a suite (including setup).
+var lastResultTime;
+
 function Run() {
+  lastResultTime = Date.now();
   BenchmarkSuite.RunSuites({ NotifyStep: ShowProgress,
                              NotifyError: AddError,
                              NotifyResult: AddResult,
@@ -21,10 +25,14 @@ function AddError(name, error) {
   print('ERROR', name, error);
   print(error.stack);
   harnessErrorCount++;
+  lastResultTime = Date.now();
 }
 
 function AddResult(name, result) {
+  var now = Date.now();
   print('RESULT', name, result);
+  print('TIME', name, now - lastResultTime);
+  lastResultTime = now;
 }
 
 function AddScore(score) {
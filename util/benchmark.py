@@ -0,0 +1,318 @@
+#!/usr/bin/env python2
+#
+#  Benchmark driver for the Kraken and Google V8 (v7) benchmark suites.
+#
+#  Runs the suites against one or more engines, repeating each run to get
+#  stable results, and parses per-subtest timings and scores:
+#
+#    - Kraken: each subtest is run in a separate process from a combined
+#      source file (<test>-data.js followed by <test>.js) with the test part
+#      timed using Date.now(), like the sunspider runner does.  Needs a Kraken
+#      snapshot, see tests/kraken-benchmark/README.rst.
+#
+#    - V8: tests/google-v8-benchmark-v7/combined.js (created using 'make')
+#      is run as a whole; per-suite scores and times are parsed from the
+#      RESULT/TIME lines printed by run_harness.js.
+#
+#  Runs are distributed over CPUs and pinned like in perftest.py.  Results
+#  use the same JSON format as perftest.py (suite names 'kraken' and 'v8'),
+#  so they can be recorded and compared using perf_history.py.
+#
+#  Example:
+#
+#  $ python util/benchmark.py --engine duk.O2=./duk.O2 --engine duk.O2.130=./duk.O2.130 \
+#        --kraken-dir /tmp/kraken-e119421cb325 --runs 5 --output /tmp/bench.json
+#
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+import Queue
+import optparse
+import subprocess
+import multiprocessing
+
+import time_multi
+import perftest
+
+re_v8_result = re.compile(r'^RESULT\s+(\S+)\s+(\S+)\s*$')
+re_v8_time = re.compile(r'^TIME\s+(\S+)\s+(\S+)\s*$')
+re_v8_score = re.compile(r'^SCORE\s+(\S+)\s*$')
+re_kraken_time = re.compile(r'^KRAKEN-TIME\s+(\S+)\s*$')
+
+class RunFailed(Exception):
+	pass
+
+# Run command once, return (stdout, rusage).  Stderr is merged into stdout
+# so that error messages end up in results.
+def runCapture(args):
+	p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	out = p.stdout.read()
+	p.stdout.close()
+	pid, status, rusage = os.wait4(p.pid, 0)
+	p.returncode = os.WEXITSTATUS(status)  # already reaped, avoid waiting again
+
+	if os.WIFSIGNALED(status):
+		raise RunFailed('segv' if os.WTERMSIG(status) == 11 else 'n/a')
+	if os.WEXITSTATUS(status) != 0:
+		raise RunFailed('n/a')
+	return out, rusage
+
+def findKrakenTests(kraken_dir):
+	for d in [ kraken_dir, os.path.join(kraken_dir, 'tests', 'kraken-1.0') ]:
+		list_fn = os.path.join(d, 'LIST')
+		if os.path.isfile(list_fn):
+			with open(list_fn, 'rb') as f:
+				names = [ x.strip() for x in f.read().split('\n') if x.strip() != '' ]
+			return d, names
+	raise Exception('cannot find Kraken test LIST in %r' % kraken_dir)
+
+# Create a combined source file for a Kraken subtest.  The data part is
+# not included in the timing, neither is parsing (the whole file is
+# compiled before it runs).
+def makeKrakenSource(test_dir, name, out_dir):
+	parts = []
+	data_fn = os.path.join(test_dir, name + '-data.js')
+	if os.path.isfile(data_fn):
+		with open(data_fn, 'rb') as f:
+			parts.append(f.read())
+	parts.append('\n;\nvar __krakenStart = Date.now();\n')
+	with open(os.path.join(test_dir, name + '.js'), 'rb') as f:
+		parts.append(f.read())
+	parts.append('\n;\nprint("KRAKEN-TIME " + (Date.now() - __krakenStart));\n')
+
+	out_fn = os.path.join(out_dir, name + '.js')
+	with open(out_fn, 'wb') as f:
+		f.write(''.join(parts))
+	return out_fn
+
+def parseKrakenOutput(out):
+	for line in out.split('\n'):
+		m = re_kraken_time.match(line.strip())
+		if m is not None:
+			return { 'time_ms': float(m.group(1)) }
+	raise RunFailed('no result')
+
+# Parse V8 harness output into { suite: { 'score': x, 'time_ms': y } },
+# the total score is reported as suite 'Score'.
+def parseV8Output(out):
+	res = {}
+	for line in out.split('\n'):
+		line = line.strip()
+		m = re_v8_result.match(line)
+		if m is not None:
+			res.setdefault(m.group(1), {})['score'] = float(m.group(2))
+			continue
+		m = re_v8_time.match(line)
+		if m is not None:
+			res.setdefault(m.group(1), {})['time_ms'] = float(m.group(2))
+			continue
+		m = re_v8_score.match(line)
+		if m is not None:
+			res.setdefault('Score', {})['score'] = float(m.group(1))
+	if not res.has_key('Score'):
+		raise RunFailed('no result')
+	return res
+
+class Worker(threading.Thread):
+	def __init__(self, cpu, jobs, samples, errors, opts, pin, lock):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.cpu = cpu
+		self.jobs = jobs
+		self.samples = samples
+		self.errors = errors
+		self.opts = opts
+		self.pin = pin
+		self.lock = lock
+
+	def run(self):
+		while True:
+			try:
+				job = self.jobs.get_nowait()
+			except Queue.Empty:
+				return
+			self.runJob(job)
+
+	def runJob(self, job):
+		args = job['args']
+		if self.pin:
+			args = [ 'taskset', '-c', str(self.cpu) ] + args
+
+		try:
+			out, rusage = runCapture(args)
+			if job['suite'] == 'kraken':
+				parsed = { job['test']: parseKrakenOutput(out) }
+			else:
+				parsed = parseV8Output(out)
+		except (RunFailed, OSError) as e:
+			with self.lock:
+				self.errors[(job['suite'], job['test'], job['engine'])] = str(e)
+			if self.opts.verbose:
+				sys.stderr.write('%s %s %s: failed: %s\n' % (job['suite'], job['engine'], job['test'], e))
+			return
+
+		with self.lock:
+			for test in parsed.keys():
+				ent = self.samples.setdefault((job['suite'], test, job['engine']), {})
+				for k in parsed[test].keys():
+					ent.setdefault(k, []).append(parsed[test][k])
+				# Process times are only meaningful per test for Kraken.
+				if job['suite'] == 'kraken':
+					ent.setdefault('user', []).append(rusage.ru_utime)
+					ent.setdefault('maxrss', []).append(rusage.ru_maxrss)
+
+		if self.opts.verbose:
+			sys.stderr.write('%s %s %s: run %d done\n' % (job['suite'], job['engine'], job['test'], job['run']))
+
+def makeResults(samples, errors, opts):
+	results = []
+	keys = set(samples.keys()) | set(errors.keys())
+	for key in sorted(keys):
+		suite, test, engine = key
+		metric = 'score' if suite == 'v8' else 'time_ms'
+		res = {
+			'suite': suite,
+			'test': test,
+			'engine': engine,
+			'metric': metric,
+			'higher_is_better': (metric == 'score'),
+			'status': 'ok',
+			'stats': None,
+			'samples': None
+		}
+		ent = samples.get(key)
+		if errors.has_key(key) or ent is None or not ent.has_key(metric):
+			res['status'] = errors.get(key, 'n/a')
+		else:
+			res['samples'] = ent
+			res['stats'] = time_multi.computeStats(ent[metric], opts.ci_level)
+		results.append(res)
+	return results
+
+def printSummary(doc):
+	results = {}
+	tests = []
+	for r in doc['results']:
+		results[(r['suite'], r['test'], r['engine'])] = r
+		if (r['suite'], r['test']) not in tests:
+			tests.append((r['suite'], r['test']))
+
+	for suite, test in tests:
+		line = '%-8s %-28s:' % (suite, test)
+		for name in doc['engines']:
+			r = results.get((suite, test, name))
+			if r is None:
+				val = 'n/a'
+			elif r['status'] != 'ok':
+				val = r['status']
+			else:
+				val = '%.1f' % r['stats']['median']
+				if r['stats']['ci_rel'] is not None:
+					val += '+/-%.1f%%' % (r['stats']['ci_rel'] * 100.0)
+			line += ' %s %14s' % (name, val)
+		print(line)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option('--engine', dest='engines', action='append', default=[], help='Engine to test, NAME=COMMAND or COMMAND, repeatable (default: duk.O2)')
+	parser.add_option('--suite', dest='suites', default='kraken,v8', help='Suites to run (default: kraken,v8)')
+	parser.add_option('--kraken-dir', dest='kraken_dir', default=None, help='Kraken snapshot directory (or its tests/kraken-1.0)')
+	parser.add_option('--v8-dir', dest='v8_dir', default=os.path.join('tests', 'google-v8-benchmark-v7'))
+	parser.add_option('--filter', dest='filter', default=None, help='Regexp for Kraken subtests to run')
+	parser.add_option('--runs', dest='runs', type='int', default=5, help='Runs for each engine and test (default 5)')
+	parser.add_option('--cpus', dest='cpus', default=None, help='CPUs to run on, e.g. 2,3 or 2-5 (default: all)')
+	parser.add_option('--no-pin', dest='pin', action='store_false', default=True, help='Don\'t pin runs to CPUs')
+	parser.add_option('--ci-level', type='float', dest='ci_level', default=0.95)
+	parser.add_option('--output', dest='output', default=None, help='Write results as JSON')
+	parser.add_option('--history', dest='history', default=None, help='Append results as a JSON line to a history file')
+	parser.add_option('--verbose', action='store_true', dest='verbose', default=False)
+	(opts, args) = parser.parse_args()
+
+	engines = [ perftest.parseEngine(x) for x in (opts.engines or [ 'duk.O2=./duk.O2' ]) ]
+	suites = opts.suites.split(',')
+	filter_re = None
+	if opts.filter is not None:
+		filter_re = re.compile(opts.filter)
+
+	if opts.cpus is not None:
+		cpus = perftest.parseCpus(opts.cpus)
+	else:
+		cpus = range(multiprocessing.cpu_count())
+	pin = opts.pin
+	if pin and perftest.findExecutable('taskset') is None:
+		sys.stderr.write('taskset not found, runs are not pinned to CPUs\n')
+		pin = False
+
+	tmp_dir = tempfile.mkdtemp(prefix='duk-benchmark-')
+	jobs = Queue.Queue()
+
+	# Interleave runs so that engines are measured under similar conditions.
+	for run in xrange(opts.runs):
+		if 'kraken' in suites:
+			if opts.kraken_dir is None:
+				raise Exception('--kraken-dir needed for the kraken suite')
+			test_dir, names = findKrakenTests(opts.kraken_dir)
+			for name in names:
+				if filter_re is not None and filter_re.search(name) is None:
+					continue
+				src_fn = os.path.join(tmp_dir, name + '.js')
+				if not os.path.isfile(src_fn):
+					makeKrakenSource(test_dir, name, tmp_dir)
+				for eng in engines:
+					jobs.put({ 'suite': 'kraken', 'test': name, 'engine': eng['name'], 'run': run,
+					           'args': eng['command'] + [ src_fn ] })
+		if 'v8' in suites:
+			combined_fn = os.path.join(opts.v8_dir, 'combined.js')
+			if not os.path.isfile(combined_fn):
+				raise Exception('missing %r, run "make" in %r first' % (combined_fn, opts.v8_dir))
+			for eng in engines:
+				jobs.put({ 'suite': 'v8', 'test': 'combined', 'engine': eng['name'], 'run': run,
+				           'args': eng['command'] + [ combined_fn ] })
+
+	git = perftest.getGitInfo()
+	start_time = time.time()
+
+	samples = {}
+	errors = {}
+	lock = threading.Lock()
+	try:
+		workers = [ Worker(cpu, jobs, samples, errors, opts, pin, lock) for cpu in cpus ]
+		for w in workers:
+			w.start()
+		for w in workers:
+			while w.is_alive():
+				w.join(1.0)  # timeout allows KeyboardInterrupt
+	finally:
+		for fn in os.listdir(tmp_dir):
+			os.unlink(os.path.join(tmp_dir, fn))
+		os.rmdir(tmp_dir)
+
+	doc = {
+		'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(start_time)),
+		'duration': time.time() - start_time,
+		'host': socket.gethostname(),
+		'git_describe': git['describe'],
+		'git_commit': git['commit'],
+		'cpus': cpus if pin else None,
+		'runs': opts.runs,
+		'engines': [ eng['name'] for eng in engines ],
+		'results': makeResults(samples, errors, opts)
+	}
+
+	if opts.output is not None:
+		with open(opts.output, 'wb') as f:
+			f.write(json.dumps(doc, indent=4, sort_keys=True) + '\n')
+	if opts.history is not None:
+		with open(opts.history, 'ab') as f:
+			f.write(json.dumps(doc, sort_keys=True) + '\n')
+
+	printSummary(doc)
+
+if __name__ == '__main__':
+	main()
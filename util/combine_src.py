@@ -16,12 +16,18 @@
 #      inlined into the result while extenal includes are left as is.
 #      Duplicate #include statements are replaced with a comment.
 #      
-#  At every step, source and header lines are represented with explicit
-#  line objects which keep track of original filename and line.  The
-#  output contains #line directives, if necessary, to ensure error
-#  throwing and other diagnostic info will work in a useful manner when
-#  deployed.  It's also possible to generate a combined source with no
-#  #line directives.
+#  Source and header files are represented as plain line lists; the
+#  original line number of a line is its index in the list (plus one).
+#  Each file is read only when it's processed and output is written as it
+#  is generated, so only one C file and its (not yet included) headers
+#  are kept in memory at a time.  The output contains #line directives,
+#  if necessary, to ensure error throwing and other diagnostic info will
+#  work in a useful manner when deployed.  It's also possible to generate
+#  a combined source with no #line directives.
+#
+#  A line map from combined source lines to original file/line is written
+#  into the metadata JSON file, and optionally into a compact binary file
+#  (see writeBinaryLineMap()).
 #
 #  Making the process deterministic is important, so that if users have
 #  diffs that they apply to the combined source, such diffs would apply
@@ -48,6 +54,7 @@ import os
 import sys
 import re
 import json
+import struct
 import optparse
 
 # Include path for finding include files which are amalgamated.
@@ -56,52 +63,53 @@ include_paths = []
 # Include files specifically excluded from being inlined.
 include_excluded = []
 
+# Cache for include lookups and parsed header files.
+include_lookup_cache = {}
+header_cache = {}
+
+# File contents as a list of lines (without newlines); line number of
+# lines[i] is i + 1.
 class File:
-	filename_full = None
-	filename = None
-	lines = None
+	__slots__ = [ 'filename_full', 'filename', 'lines' ]
 
 	def __init__(self, filename, lines):
 		self.filename = os.path.basename(filename)
 		self.filename_full = filename
 		self.lines = lines
 
-class Line:
-	filename_full = None
-	filename = None
-	lineno = None
-	data = None
-
-	def __init__(self, filename, lineno, data):
-		self.filename = os.path.basename(filename)
-		self.filename_full = filename
-		self.lineno = lineno
-		self.data = data
-
 def readFile(filename):
-	lines = []
-
 	with open(filename, 'rb') as f:
-		lineno = 0
-		for line in f:
-			lineno += 1
-			if len(line) > 0 and line[-1] == '\n':
-				line = line[:-1]
-			lines.append(Line(filename, lineno, line))
+		lines = f.read().split('\n')
+	if len(lines) > 0 and lines[-1] == '':
+		lines.pop()  # file ends in a newline
 
 	return File(filename, lines)
 
+def readHeader(filename):
+	# Headers are never modified so the parsed form can be shared.
+	f = header_cache.get(filename)
+	if f is None:
+		f = readFile(filename)
+		header_cache[filename] = f
+	return f
+
 def lookupInclude(incfn):
+	if include_lookup_cache.has_key(incfn):
+		return include_lookup_cache[incfn]
+
 	re_sep = re.compile(r'/|\\')
 
 	inccomp = re.split(re_sep, incfn)  # split include path, support / and \
 
+	res = None
 	for path in include_paths:
 		fn = apply(os.path.join, [ path ] + inccomp)
 		if os.path.exists(fn):
-			return fn  # Return full path to first match
+			res = fn  # Return full path to first match
+			break
 
-	return None
+	include_lookup_cache[incfn] = res
+	return res
 
 def addAutomaticUndefs(f):
 	defined = {}
@@ -110,11 +118,13 @@ def addAutomaticUndefs(f):
 	re_undef = re.compile(r'#undef\s+(\w+).*$')
 
 	for line in f.lines:
-		m = re_def.match(line.data)
+		if line[:1] != '#':
+			continue
+		m = re_def.match(line)
 		if m is not None:
 			#print('DEFINED: %s' % repr(m.group(1)))
 			defined[m.group(1)] = True
-		m = re_undef.match(line.data)
+		m = re_undef.match(line)
 		if m is not None:
 			# Could just ignore #undef's here: we'd then emit
 			# reliable #undef's (though maybe duplicates) at
@@ -131,41 +141,51 @@ def addAutomaticUndefs(f):
 	keys = sorted(defined.keys())  # deterministic order
 	if len(keys) > 0:
 		#print('STILL DEFINED: %r' % repr(defined.keys()))
-		f.lines.append(Line(f.filename, len(f.lines) + 1, ''))
-		f.lines.append(Line(f.filename, len(f.lines) + 1, '/* automatic undefs */'))
+		f.lines.append('')
+		f.lines.append('/* automatic undefs */')
 		for k in keys:
-			f.lines.append(Line(f.filename, len(f.lines) + 1, '#undef %s' % k))
+			f.lines.append('#undef %s' % k)
 
-def createCombined(files, prologue_filename, line_directives):
-	res = []
+# Write combined source into 'out'.  Source files are read, given
+# automatic #undefs, and processed one at a time.  Returns metadata
+# (including the line map) and the number of bytes written.
+def createCombined(out, sources, prologue_filename, line_directives):
 	line_map = []   # indicate combined source lines where uncombined file/line would change
 	metadata = {
 		'line_map': line_map
 	}
 
-	emit_state = [ None, None ]  # curr_filename, curr_lineno
-
-	def emit(line):
-		if isinstance(line, (str, unicode)):
-			res.append(line)
-			emit_state[1] += 1
-		else:
-			if line.filename != emit_state[0] or line.lineno != emit_state[1]:
-				if line_directives:
-					res.append('#line %d "%s"' % (line.lineno, line.filename))
-				line_map.append({ 'original_file': line.filename,
-				                  'original_line': line.lineno,
-				                  'combined_line': len(res) + 1 })
-			res.append(line.data)
-			emit_state[0] = line.filename
-			emit_state[1] = line.lineno + 1
+	# Output line count and bytes written, current original file/line.
+	emit_state = [ 0, 0, None, None ]  # out_lines, out_bytes, curr_filename, curr_lineno
+
+	def write(data):
+		out.write(data)
+		out.write('\n')
+		emit_state[0] += 1
+		emit_state[1] += len(data) + 1
+
+	def emitString(data):
+		write(data)
+		if emit_state[3] is not None:
+			emit_state[3] += 1
+
+	def emitLine(filename, lineno, data):
+		if filename != emit_state[2] or lineno != emit_state[3]:
+			if line_directives:
+				write('#line %d "%s"' % (lineno, filename))
+			line_map.append({ 'original_file': filename,
+			                  'original_line': lineno,
+			                  'combined_line': emit_state[0] + 1 })
+		write(data)
+		emit_state[2] = filename
+		emit_state[3] = lineno + 1
 
 	included = {}  # headers already included
 
 	if prologue_filename is not None:
 		with open(prologue_filename, 'rb') as f:
 			for line in f.read().split('\n'):
-				res.append(line)
+				write(line)
 
 	re_inc = re.compile(r'^#include\s+(<|\")(.*?)(>|\").*$')
 
@@ -175,19 +195,20 @@ def createCombined(files, prologue_filename, line_directives):
 	def processFile(f):
 		#print('Process file: ' + f.filename)
 
-		for line in f.lines:
-			if not line.data.startswith('#include'):
-				emit(line)
+		filename = f.filename
+		for idx, line in enumerate(f.lines):
+			if not line.startswith('#include'):
+				emitLine(filename, idx + 1, line)
 				continue
 
-			m = re_inc.match(line.data)
+			m = re_inc.match(line)
 			if m is None:
-				raise Exception('Couldn\'t match #include line: %s' % repr(line.data))
+				raise Exception('Couldn\'t match #include line: %s' % repr(line))
 			incpath = m.group(2)
 			if incpath in include_excluded:
 				# Specific include files excluded from the
 				# inlining / duplicate suppression process.
-				emit(line)  # keep as is
+				emitLine(filename, idx + 1, line)  # keep as is
 				continue
 
 			if included.has_key(incpath):
@@ -195,7 +216,7 @@ def createCombined(files, prologue_filename, line_directives):
 				# external, based on the assumption that includes are
 				# not behind #ifdef checks.  This is the case for
 				# Duktape (except for the include files excluded).
-				emit('/* #include %s -> already included */' % incpath)
+				emitString('/* #include %s -> already included */' % incpath)
 				continue
 			included[incpath] = True
 
@@ -204,17 +225,48 @@ def createCombined(files, prologue_filename, line_directives):
 
 			incfile = lookupInclude(incpath)
 			if incfile is not None:
-				#print('Include considered internal: %s -> %s' % (repr(line.data), repr(incfile)))
-				emit('/* #include %s */' % incpath)
-				processFile(readFile(incfile))
+				#print('Include considered internal: %s -> %s' % (repr(line), repr(incfile)))
+				emitString('/* #include %s */' % incpath)
+				processFile(readHeader(incfile))
 			else:
-				#print('Include considered external: %s' % repr(line.data))
-				emit(line)  # keep as is
+				#print('Include considered external: %s' % repr(line))
+				emitLine(filename, idx + 1, line)  # keep as is
 
-	for f in files:
+	for fn in sources:
+		f = readFile(fn)
+		#print('Add automatic undefs for: ' + fn)
+		addAutomaticUndefs(f)
 		processFile(f)
 
-	return '\n'.join(res) + '\n', metadata
+	return metadata, emit_state[1]
+
+# Write the line map in a compact binary format, all integers big endian:
+#
+#   4 bytes   magic 'DLM1'
+#   u32       number of file names N
+#   N times:  u16 length + file name bytes
+#   u32       number of entries M
+#   M times:  u32 combined line, u16 file name index, u32 original line
+#
+# Entries are in increasing combined line order, like in the JSON line map.
+def writeBinaryLineMap(filename, line_map):
+	names = []
+	name_index = {}
+	for e in line_map:
+		if not name_index.has_key(e['original_file']):
+			name_index[e['original_file']] = len(names)
+			names.append(e['original_file'])
+
+	parts = [ 'DLM1', struct.pack('>L', len(names)) ]
+	for name in names:
+		parts.append(struct.pack('>H', len(name)))
+		parts.append(name)
+	parts.append(struct.pack('>L', len(line_map)))
+	for e in line_map:
+		parts.append(struct.pack('>LHL', e['combined_line'], name_index[e['original_file']], e['original_line']))
+
+	with open(filename, 'wb') as f:
+		f.write(''.join(parts))
 
 def main():
 	global include_paths, include_excluded
@@ -225,6 +277,7 @@ def main():
 	parser.add_option('--prologue', dest='prologue', help='Prologue to prepend to start of file')
 	parser.add_option('--output-source', dest='output_source', help='Output source filename')
 	parser.add_option('--output-metadata', dest='output_metadata', help='Output metadata filename')
+	parser.add_option('--output-line-map', dest='output_line_map', default=None, help='Output binary line map filename (optional)')
 	parser.add_option('--line-directives', dest='line_directives', action='store_true', default=False, help='Use #line directives in combined source')
 	(opts, args) = parser.parse_args()
 
@@ -234,24 +287,17 @@ def main():
 	assert(opts.output_source)
 	assert(opts.output_metadata)
 
-	print('Read input files, add automatic #undefs')
 	sources = args
-	files = []
-	for fn in sources:
-		res = readFile(fn)
-		#print('Add automatic undefs for: ' + fn)
-		addAutomaticUndefs(res)
-		files.append(res)
-
-	print('Create combined source file from %d source files' % len(files))
-	combined_source, metadata = \
-	    createCombined(files, opts.prologue, opts.line_directives)
+	print('Create combined source file from %d source files' % len(sources))
 	with open(opts.output_source, 'wb') as f:
-		f.write(combined_source)
+		metadata, num_bytes = \
+		    createCombined(f, sources, opts.prologue, opts.line_directives)
 	with open(opts.output_metadata, 'wb') as f:
 		f.write(json.dumps(metadata, indent=4))
+	if opts.output_line_map is not None:
+		writeBinaryLineMap(opts.output_line_map, metadata['line_map'])
 
-	print('Wrote %d bytes to %s' % (len(combined_source), opts.output_source))
+	print('Wrote %d bytes to %s' % (num_bytes, opts.output_source))
 
 if __name__ == '__main__':
 	main()
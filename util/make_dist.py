@@ -27,6 +27,16 @@ import glob
 import optparse
 import subprocess
 import tarfile
+import hashlib
+import json
+import threading
+import traceback
+import multiprocessing
+import multiprocessing.pool
+try:
+	import Queue as queue
+except ImportError:
+	import queue
 
 # Helpers
 
@@ -54,6 +64,196 @@ def exec_get_stdout(cmd, input=None, default=None, print_stdout=False):
 def exec_print_stdout(cmd, input=None):
 	ret = exec_get_stdout(cmd, input=input, print_stdout=True)
 
+# Generation steps are declared as a task graph: each task is a callable
+# with a list of tasks it depends on, and tasks whose dependencies have
+# completed are started in parallel.  Dependencies must be declared before
+# the task depending on them so the graph is acyclic by construction.  Most
+# tasks run a helper script in a child process, so a thread pool driving
+# the child processes is enough for them.  Tasks doing CPU bound Python
+# work in-process (the Unicode table generators) would be serialized by
+# the GIL in a thread, so they're declared using add_process() and run in
+# a pool of worker processes instead.
+
+output_lock = threading.Lock()  # keep output of parallel tasks unmixed
+
+def write_stdout(data):
+	with output_lock:
+		sys.stdout.write(data)
+		sys.stdout.flush()
+
+# Run a process task in a worker process.  Returns a formatted traceback
+# on failure because exceptions may not survive pickling.
+def run_process_task(fn, args):
+	try:
+		fn(*args)
+		return None
+	except:
+		return traceback.format_exc()
+
+class TaskGraph:
+	def __init__(self):
+		self.tasks = []  # (name, fn, deps) in declaration order
+		self.names = {}
+		self.num_process_tasks = 0
+		self.process_pool = None
+
+	def add(self, name, fn, deps=[]):
+		if self.names.has_key(name):
+			raise Exception('duplicate task: %r' % name)
+		for dep in deps:
+			if not self.names.has_key(dep):
+				raise Exception('task %r depends on undeclared task %r' % (name, dep))
+		self.names[name] = True
+		self.tasks.append((name, fn, deps))
+		return name
+
+	# Add a task which runs 'fn(*args)' in a worker process.  'fn' must be
+	# a module level function and 'args' picklable.  The worker processes
+	# are forked when the graph is run, so they only see module state set
+	# up before that; state created by other tasks must be passed in files.
+	def add_process(self, name, fn, args, deps=[]):
+		self.num_process_tasks += 1
+		return self.add(name, lambda: self._run_in_process(fn, args), deps=deps)
+
+	def _run_in_process(self, fn, args):
+		if self.process_pool is None:
+			fn(*args)
+			return
+		err = self.process_pool.apply(run_process_task, (fn, args))
+		if err is not None:
+			raise Exception('task failed in worker process:\n%s' % err)
+
+	def get_names(self):
+		return [ t[0] for t in self.tasks ]
+
+	def run(self, jobs):
+		results = queue.Queue()
+
+		# Fork the worker processes before any task threads exist.
+		if self.num_process_tasks > 0 and jobs > 1:
+			self.process_pool = multiprocessing.Pool(min(jobs, self.num_process_tasks))
+		pool = multiprocessing.pool.ThreadPool(max(1, jobs))
+
+		def _run_task(name, fn):
+			try:
+				fn()
+				results.put((name, None))
+			except:
+				results.put((name, traceback.format_exc()))
+
+		started = {}
+		done = {}
+		running = 0
+		failures = []
+		try:
+			while True:
+				if len(failures) == 0:
+					for name, fn, deps in self.tasks:
+						if started.has_key(name):
+							continue
+						if all([ done.has_key(dep) for dep in deps ]):
+							started[name] = True
+							running += 1
+							pool.apply_async(_run_task, (name, fn))
+				if running == 0:
+					break
+
+				# Poll with a timeout so that Ctrl-C is noticed.
+				try:
+					name, err = results.get(True, 0.5)
+				except queue.Empty:
+					continue
+				running -= 1
+				if err is not None:
+					write_stdout('Task %s failed:\n%s' % (name, err))
+					failures.append(name)
+				else:
+					done[name] = True
+		finally:
+			pool.close()
+			if self.process_pool is not None:
+				self.process_pool.close()
+		pool.join()
+		if self.process_pool is not None:
+			self.process_pool.join()
+			self.process_pool = None
+
+		if len(failures) > 0:
+			raise Exception('dist task(s) failed: %s' % ', '.join(failures))
+
+# Build cache: a generation step is keyed on a hash of its command line and
+# the contents of its input files.  If a previous dist run stored outputs for
+# the same key, they're restored instead of re-running the step.  Output
+# paths are replaced with placeholders in the key so that identical steps
+# writing to different files share a cache entry.
+
+BUILD_CACHE_VERSION = 1
+build_cache_dir = None  # set from --build-cache
+
+def list_tree_files(path):
+	res = []
+	for dirpath, dirnames, filenames in os.walk(path):
+		dirnames.sort()
+		for fn in sorted(filenames):
+			if os.path.splitext(fn)[1] == '.pyc':
+				continue
+			res.append(os.path.join(dirpath, fn))
+	return res
+
+def get_cache_key(cmd, inputs, outputs):
+	h = hashlib.sha1()
+	h.update('version:%d\n' % BUILD_CACHE_VERSION)
+	for arg in cmd:
+		for idx, fn in enumerate(outputs):
+			arg = arg.replace(fn, '@OUTPUT%d@' % idx)
+		h.update('arg:%s\n' % arg)
+	for fn in inputs:
+		with open(fn, 'rb') as f:
+			h.update('input:%s:%s\n' % (fn, hashlib.sha1(f.read()).hexdigest()))
+	return h.hexdigest()
+
+def exec_cached(name, cmd, inputs=[], outputs=[], stdout_file=None):
+	# If 'stdout_file' is given, command stdout is written there, otherwise
+	# it is printed.
+	def _emit(data):
+		if stdout_file is not None:
+			with open(stdout_file, 'wb') as f:
+				f.write(data)
+		else:
+			write_stdout(data)
+
+	if build_cache_dir is None:
+		_emit(exec_get_stdout(cmd))
+		return
+
+	key = get_cache_key(cmd, inputs, outputs)
+	entry = os.path.join(build_cache_dir, '%s-%s' % (name, key))
+	if os.path.isdir(entry):
+		write_stdout('Build cache hit for %s (%s)\n' % (name, key))
+		for idx, fn in enumerate(outputs):
+			copy_file(os.path.join(entry, 'output%d' % idx), fn)
+		with open(os.path.join(entry, 'stdout'), 'rb') as f:
+			_emit(f.read())
+		return
+
+	data = exec_get_stdout(cmd)
+	_emit(data)
+
+	# Populate a temporary directory and rename it into place so that an
+	# interrupted run never leaves a partial entry behind.
+	tmp = '%s.tmp%d' % (entry, os.getpid())
+	if os.path.isdir(tmp):
+		shutil.rmtree(tmp)
+	os.makedirs(tmp)
+	for idx, fn in enumerate(outputs):
+		copy_file(fn, os.path.join(tmp, 'output%d' % idx))
+	with open(os.path.join(tmp, 'stdout'), 'wb') as f:
+		f.write(data)
+	try:
+		os.rename(tmp, entry)
+	except OSError:
+		shutil.rmtree(tmp)  # concurrent run stored the same entry
+
 def mkdir(path):
 	os.mkdir(path)
 
@@ -204,6 +404,8 @@ parser.add_option('--git-describe', dest='git_describe', default=None, help='For
 parser.add_option('--git-branch', dest='git_branch', default=None, help='Force git branch name')
 parser.add_option('--rom-support', dest='rom_support', action='store_true', help='Add support for ROM strings/objects (increases duktape.c size considerably)')
 parser.add_option('--user-builtin-metadata', dest='user_builtin_metadata', action='append', default=[], help='User strings and objects to add, YAML format (can be repeated for multiple overrides)')
+parser.add_option('--jobs', dest='jobs', type='int', default=multiprocessing.cpu_count(), help='Number of generation steps to run in parallel (default: number of CPUs)')
+parser.add_option('--build-cache', dest='build_cache', default=None, help='Cache directory for generated files, steps whose inputs are unchanged are skipped (entries are never expired, delete the directory manually)')
 (opts, args) = parser.parse_args()
 
 # Python module check and friendly errors
@@ -272,6 +474,12 @@ else:
 	git_branch = exec_get_stdout([ 'git', 'rev-parse', '--abbrev-ref', 'HEAD' ], default='external').strip()
 git_branch_cstring = cstring(git_branch)
 
+if opts.build_cache is not None:
+	build_cache_dir = os.path.abspath(opts.build_cache)
+	if not os.path.isdir(build_cache_dir):
+		os.makedirs(build_cache_dir)
+	print('Using build cache %s' % build_cache_dir)
+
 print('Dist for Duktape version %s, commit %s, describe %s, branch %s' % \
       (duk_version_formatted, git_commit, git_describe, git_branch))
 
@@ -522,6 +730,8 @@ copy_files([
 
 copy_files([
 	'README.rst',
+	'alloc_log.py',
+	'alloc_profile.py',
 	'duk_alloc_logging.c',
 	'duk_alloc_logging.h',
 	'log2gnuplot.py'
@@ -690,64 +900,61 @@ copy_files([
 copy_and_cquote('LICENSE.txt', os.path.join(dist, 'LICENSE.txt.tmp'))
 copy_and_cquote('AUTHORS.rst', os.path.join(dist, 'AUTHORS.rst.tmp'))
 
-print('Create duk_config.h headers')
+# Generation steps are added to a task graph and executed in parallel
+# once everything has been declared, see end of file.
+tasks = TaskGraph()
 
 # Merge debugger metadata.
-merged = exec_print_stdout([
-	sys.executable, os.path.join('debugger', 'merge_debug_meta.py'),
-	'--output', os.path.join(dist, 'debugger', 'duk_debug_meta.json'),
-	'--class-names', os.path.join('debugger', 'duk_classnames.yaml'),
-	'--debug-commands', os.path.join('debugger', 'duk_debugcommands.yaml'),
-	'--debug-errors', os.path.join('debugger', 'duk_debugerrors.yaml'),
-	'--opcodes', os.path.join('debugger', 'duk_opcodes.yaml')
-])
+def merge_debug_meta():
+	exec_cached('merge_debug_meta', [
+		sys.executable, os.path.join('debugger', 'merge_debug_meta.py'),
+		'--output', os.path.join(dist, 'debugger', 'duk_debug_meta.json'),
+		'--class-names', os.path.join('debugger', 'duk_classnames.yaml'),
+		'--debug-commands', os.path.join('debugger', 'duk_debugcommands.yaml'),
+		'--debug-errors', os.path.join('debugger', 'duk_debugerrors.yaml'),
+		'--opcodes', os.path.join('debugger', 'duk_opcodes.yaml')
+	], inputs=[
+		os.path.join('debugger', 'merge_debug_meta.py'),
+		os.path.join('debugger', 'duk_classnames.yaml'),
+		os.path.join('debugger', 'duk_debugcommands.yaml'),
+		os.path.join('debugger', 'duk_debugerrors.yaml'),
+		os.path.join('debugger', 'duk_opcodes.yaml')
+	], outputs=[
+		os.path.join(dist, 'debugger', 'duk_debug_meta.json')
+	])
+
+tasks.add('merge_debug_meta', merge_debug_meta)
+
+# Headers generated by genconfig, as (output, extra_args) pairs.  All
+# headers are generated by a single genconfig batch run so that metadata
+# is only loaded once.
+genconfig_headers = []
 
 # Build default duk_config.h from snippets using genconfig.
-exec_print_stdout([
-	sys.executable, os.path.join('config', 'genconfig.py'), '--metadata', 'config',
-	'--output', os.path.join(dist, 'duk_config.h.tmp'),
-	'--git-commit', git_commit, '--git-describe', git_describe, '--git-branch', git_branch,
+genconfig_headers.append((os.path.join(dist, 'duk_config.h.tmp'), [
 	'--omit-removed-config-options', '--omit-unused-config-options',
 	'--emit-config-sanity-check',
-	'--support-feature-options',
-	'duk-config-header'
-])
-
-copy_file(os.path.join(dist, 'duk_config.h.tmp'), os.path.join(distsrccom, 'duk_config.h'))
-copy_file(os.path.join(dist, 'duk_config.h.tmp'), os.path.join(distsrcnol, 'duk_config.h'))
-copy_file(os.path.join(dist, 'duk_config.h.tmp'), os.path.join(distsrcsep, 'duk_config.h'))
-#copy_file(os.path.join(dist, 'duk_config.h.tmp'), os.path.join(dist, 'config', 'duk_config.h-autodetect'))
+	'--support-feature-options'
+]))
 
 # Build duk_config.h without feature option support.
-exec_print_stdout([
-	sys.executable, os.path.join('config', 'genconfig.py'), '--metadata', 'config',
-	'--output', os.path.join(dist, 'config', 'duk_config.h-modular-static'),
-	'--git-commit', git_commit, '--git-describe', git_describe, '--git-branch', git_branch,
+genconfig_headers.append((os.path.join(dist, 'config', 'duk_config.h-modular-static'), [
 	'--omit-removed-config-options', '--omit-unused-config-options',
-	'--emit-legacy-feature-check', '--emit-config-sanity-check',
-	'duk-config-header'
-])
-exec_print_stdout([
-	sys.executable, os.path.join('config', 'genconfig.py'), '--metadata', 'config',
-	'--output', os.path.join(dist, 'config', 'duk_config.h-modular-dll'),
-	'--git-commit', git_commit, '--git-describe', git_describe, '--git-branch', git_branch,
+	'--emit-legacy-feature-check', '--emit-config-sanity-check'
+]))
+genconfig_headers.append((os.path.join(dist, 'config', 'duk_config.h-modular-dll'), [
 	'--omit-removed-config-options', '--omit-unused-config-options',
 	'--emit-legacy-feature-check', '--emit-config-sanity-check',
-	'--dll',
-	'duk-config-header'
-])
+	'--dll'
+]))
 
 # Generate a few barebones config examples
 def genconfig_barebones(platform, architecture, compiler):
-	exec_print_stdout([
-		sys.executable, os.path.join('config', 'genconfig.py'), '--metadata', 'config',
-		'--output', os.path.join(dist, 'config', 'duk_config.h-%s-%s-%s' % (platform, architecture, compiler)),
-		'--git-commit', git_commit, '--git-describe', git_describe, '--git-branch', git_branch,
+	genconfig_headers.append((os.path.join(dist, 'config', 'duk_config.h-%s-%s-%s' % (platform, architecture, compiler)), [
 		'--platform', platform, '--architecture', architecture, '--compiler', compiler,
 		'--omit-removed-config-options', '--omit-unused-config-options',
-		'--emit-legacy-feature-check', '--emit-config-sanity-check',
-		'duk-config-header'
-	])
+		'--emit-legacy-feature-check', '--emit-config-sanity-check'
+	]))
 
 #genconfig_barebones('linux', 'x86', 'gcc')
 #genconfig_barebones('linux', 'x64', 'gcc')
@@ -760,6 +967,34 @@ def genconfig_barebones(platform, architecture, compiler):
 #genconfig_barebones('apple', 'x86', 'clang')
 #genconfig_barebones('apple', 'x64', 'clang')
 
+# Run genconfig; the whole metadata directory is a cache input.
+def genconfig():
+	batch_file = os.path.join(dist, 'genconfig_batch.json.tmp')
+	with open(batch_file, 'wb') as f:
+		for output, extra_args in genconfig_headers:
+			f.write(json.dumps([
+				'--output', output,
+				'--git-commit', git_commit, '--git-describe', git_describe, '--git-branch', git_branch
+			] + extra_args) + '\n')
+
+	snapshot_args = []
+	if build_cache_dir is not None:
+		# Parsed YAML metadata snapshot shared by all genconfig runs.
+		snapshot_args = [ '--metadata-snapshot', os.path.join(build_cache_dir, 'genconfig-metadata.pickle') ]
+	exec_cached('genconfig', [
+		sys.executable, os.path.join('config', 'genconfig.py'), '--metadata', 'config',
+		'--batch', batch_file
+	] + snapshot_args + [
+		'duk-config-header-batch'
+	], inputs=list_tree_files('config') + [ batch_file ], outputs=[ output for output, extra_args in genconfig_headers ])
+
+	copy_file(os.path.join(dist, 'duk_config.h.tmp'), os.path.join(distsrccom, 'duk_config.h'))
+	copy_file(os.path.join(dist, 'duk_config.h.tmp'), os.path.join(distsrcnol, 'duk_config.h'))
+	copy_file(os.path.join(dist, 'duk_config.h.tmp'), os.path.join(distsrcsep, 'duk_config.h'))
+	#copy_file(os.path.join(dist, 'duk_config.h.tmp'), os.path.join(dist, 'config', 'duk_config.h-autodetect'))
+
+tasks.add('genconfig', genconfig)
+
 # Build duktape.h from parts, with some git-related replacements.
 # The only difference between single and separate file duktape.h
 # is the internal DUK_SINGLE_FILE define.
@@ -831,32 +1066,35 @@ def minify_closure(src):
 	])
 	return ret
 
-initjs_src = os.path.join('src', 'duk_initjs.js')
-if opts.minify == 'none':
-	print('*** No minifier, this should not happen for an official build')
-	initjs_out = minify_none(initjs_src)
-	print('No minifier: %d bytes' % len(initjs_out))
-elif opts.minify == 'uglifyjs':
-	initjs_out = minify_uglifyjs(initjs_src)
-	print('Minified using UglifyJS: %d bytes' % len(initjs_out))
-elif opts.minify == 'uglifyjs2':
-	initjs_out = minify_uglifyjs2(initjs_src)
-	print('Minified using UglifyJS2: %d bytes' % len(initjs_out))
-elif opts.minify == 'closure':
-	initjs_out = minify_closure(initjs_src)
-	print('Minified using Closure: %d bytes' % len(initjs_out))
-else:
-	raise Exception('invalid minifier: %r' % opts.minify)
-
-with open(os.path.join(distsrcsep, 'duk_initjs_min.js'), 'wb') as f:
-	f.write(initjs_out)
+def minify_initjs():
+	initjs_src = os.path.join('src', 'duk_initjs.js')
+	if opts.minify == 'none':
+		write_stdout('*** No minifier, this should not happen for an official build\n')
+		initjs_out = minify_none(initjs_src)
+		write_stdout('No minifier: %d bytes\n' % len(initjs_out))
+	elif opts.minify == 'uglifyjs':
+		initjs_out = minify_uglifyjs(initjs_src)
+		write_stdout('Minified using UglifyJS: %d bytes\n' % len(initjs_out))
+	elif opts.minify == 'uglifyjs2':
+		initjs_out = minify_uglifyjs2(initjs_src)
+		write_stdout('Minified using UglifyJS2: %d bytes\n' % len(initjs_out))
+	elif opts.minify == 'closure':
+		initjs_out = minify_closure(initjs_src)
+		write_stdout('Minified using Closure: %d bytes\n' % len(initjs_out))
+	else:
+		raise Exception('invalid minifier: %r' % opts.minify)
+
+	with open(os.path.join(distsrcsep, 'duk_initjs_min.js'), 'wb') as f:
+		f.write(initjs_out)
+
+tasks.add('minify_initjs', minify_initjs)
 
 # Autogenerated strings and built-in files
 #
 # There are currently no profile specific variants of strings/builtins, but
 # this will probably change when functions are added/removed based on profile.
 
-exec_print_stdout([
+tasks.add('genbuildparams', lambda: exec_cached('genbuildparams', [
 	sys.executable,
 	os.path.join('src', 'genbuildparams.py'),
 	'--version=' + str(duk_version),
@@ -865,17 +1103,23 @@ exec_print_stdout([
 	'--git-branch=' + git_branch,
 	'--out-json=' + os.path.join(distsrcsep, 'buildparams.json.tmp'),
 	'--out-header=' + os.path.join(distsrcsep, 'duk_buildparams.h.tmp')
-])
-
-res = exec_get_stdout([
+], inputs=[
+	os.path.join('src', 'genbuildparams.py'),
+	os.path.join('src', 'dukutil.py')
+], outputs=[
+	os.path.join(distsrcsep, 'buildparams.json.tmp'),
+	os.path.join(distsrcsep, 'duk_buildparams.h.tmp')
+]))
+
+scan_files = glob_files(os.path.join('src', '*.c')) \
+           + glob_files(os.path.join('src', '*.h')) \
+           + glob_files(os.path.join('src', '*.h.in'))
+tasks.add('scan_used_stridx_bidx', lambda: exec_cached('scan_used_stridx_bidx', [
 	sys.executable,
 	os.path.join('src', 'scan_used_stridx_bidx.py')
-] + glob_files(os.path.join('src', '*.c')) \
-  + glob_files(os.path.join('src', '*.h')) \
-  + glob_files(os.path.join('src', '*.h.in'))
-)
-with open(os.path.join(dist, 'duk_used_stridx_bidx_defs.json.tmp'), 'wb') as f:
-	f.write(res)
+] + scan_files, inputs=[
+	os.path.join('src', 'scan_used_stridx_bidx.py')
+] + scan_files, stdout_file=os.path.join(dist, 'duk_used_stridx_bidx_defs.json.tmp')))
 
 gb_opts = []
 if opts.rom_support:
@@ -887,7 +1131,12 @@ for fn in opts.user_builtin_metadata:
 	print('Forwarding --user-builtin-metadata %s' % fn)
 	gb_opts.append('--user-builtin-metadata')
 	gb_opts.append(fn)
-exec_print_stdout([
+if build_cache_dir is not None:
+	# Parsed and normalized YAML metadata can be reused even when the
+	# genbuiltins step itself is a cache miss, e.g. when only the used
+	# DUK_STRIDX_xxx defines change.
+	gb_opts.append('--metadata-cache-dir=' + os.path.join(build_cache_dir, 'genbuiltins-metadata'))
+tasks.add('genbuiltins', lambda: exec_cached('genbuiltins', [
 	sys.executable,
 	os.path.join('src', 'genbuiltins.py'),
 	'--buildinfo=' + os.path.join(distsrcsep, 'buildparams.json.tmp'),
@@ -898,7 +1147,19 @@ exec_print_stdout([
 	'--out-header=' + os.path.join(distsrcsep, 'duk_builtins.h'),
 	'--out-source=' + os.path.join(distsrcsep, 'duk_builtins.c'),
 	'--out-metadata-json=' + os.path.join(dist, 'duk_build_meta.json')
-] + gb_opts)
+] + gb_opts, inputs=[
+	os.path.join('src', 'genbuiltins.py'),
+	os.path.join('src', 'dukutil.py'),
+	os.path.join(distsrcsep, 'buildparams.json.tmp'),
+	os.path.join(dist, 'duk_used_stridx_bidx_defs.json.tmp'),
+	os.path.join('src', 'strings.yaml'),
+	os.path.join('src', 'builtins.yaml'),
+	os.path.join(distsrcsep, 'duk_initjs_min.js')
+] + opts.user_builtin_metadata, outputs=[
+	os.path.join(distsrcsep, 'duk_builtins.h'),
+	os.path.join(distsrcsep, 'duk_builtins.c'),
+	os.path.join(dist, 'duk_build_meta.json')
+]), deps=[ 'genbuildparams', 'scan_used_stridx_bidx', 'minify_initjs' ])
 
 # Autogenerated Unicode files
 #
@@ -911,7 +1172,10 @@ exec_print_stdout([
 #   4E00;<CJK Ideograph, First>;Lo;0;L;;;;;N;;;;;
 #   9FCB;<CJK Ideograph, Last>;Lo;0;L;;;;;N;;;;;
 #
-# These are currently decoded into individual characters as a prestep.
+# These are kept as ranges by src/unicode_db.py: UnicodeData.txt is parsed
+# once into per-category interval lists, pickled into the build cache (or a
+# temporary file if no cache is used), and the table generators run in
+# worker processes which load that pickle.
 #
 # For IDPART:
 #   UnicodeCombiningMark -> categories Mn, Mc
@@ -959,61 +1223,82 @@ IDPART_MINUS_IDSTART_NOA_EXCL='Lu,Ll,Lt,Lm,Lo,Nl,0024,005F,ASCII'
 IDPART_MINUS_IDSTART_NOABMP_INCL=IDPART_MINUS_IDSTART_NOA_INCL
 IDPART_MINUS_IDSTART_NOABMP_EXCL='Lu,Ll,Lt,Lm,Lo,Nl,0024,005F,ASCII,NONBMP'
 
-print('Expand UnicodeData.txt ranges')
+sys.path.insert(0, os.path.abspath('src'))
+import unicode_db
+import extract_chars as unicode_extract_chars
+import extract_caseconv as unicode_extract_caseconv
 
-exec_print_stdout([
-	sys.executable,
-	os.path.join('src', 'prepare_unicode_data.py'),
-	os.path.join('src', 'UnicodeData.txt'),
-	os.path.join(distsrcsep, 'UnicodeData-expanded.tmp')
-])
+if build_cache_dir is not None:
+	unicode_db_file = os.path.join(build_cache_dir, 'unicode-db.pickle')
+else:
+	unicode_db_file = os.path.join(distsrcsep, 'unicode-db.pickle.tmp')
+
+unicode_state = {}  # per worker process: 'db' -> unicode_db.UnicodeDatabase, 'special_casing' -> SpecialCasing
+
+# Parse UnicodeData.txt (unless cached) and write the pickle for workers.
+def load_unicode_db():
+	unicode_db.load_unicode_database(os.path.join('src', 'UnicodeData.txt'), unicode_db_file)
+	with open(os.path.join(distsrcsep, 'caseconv_special_casing.txt'), 'wb') as log:
+		unicode_extract_caseconv.SpecialCasing(os.path.join('src', 'SpecialCasing.txt'), log=log)
+
+tasks.add('load_unicode_db', load_unicode_db)
+
+def get_unicode_db():
+	if not unicode_state.has_key('db'):
+		unicode_state['db'] = unicode_db.load_unicode_database(os.path.join('src', 'UnicodeData.txt'), unicode_db_file)
+	return unicode_state['db']
+
+def get_special_casing():
+	if not unicode_state.has_key('special_casing'):
+		with open(os.devnull, 'wb') as log:  # logged by load_unicode_db()
+			unicode_state['special_casing'] = unicode_extract_caseconv.SpecialCasing(os.path.join('src', 'SpecialCasing.txt'), log=log)
+	return unicode_state['special_casing']
+
+def split_categories(cats):
+	if cats == 'NONE' or cats == '':
+		return []
+	return cats.split(',')
+
+# Worker process functions, module level so that they can be pickled.
+def extract_chars_worker(incl, excl, suffix):
+	with open(os.path.join(distsrcsep, suffix + '.txt'), 'wb') as log:
+		unicode_extract_chars.generate_match_table_files(get_unicode_db(),
+			split_categories(incl), split_categories(excl), 'duk_unicode_%s' % suffix,
+			out_source=os.path.join(distsrcsep, 'duk_unicode_%s.c.tmp' % suffix),
+			out_header=os.path.join(distsrcsep, 'duk_unicode_%s.h.tmp' % suffix),
+			log=log)
+
+def extract_caseconv_worker():
+	with open(os.path.join(distsrcsep, 'caseconv.txt'), 'wb') as log:
+		unicode_extract_caseconv.generate_caseconv_files(get_unicode_db(),
+			get_special_casing(), 'caseconv_bitpacked',
+			os.path.join(distsrcsep, 'duk_unicode_caseconv.c.tmp'),
+			os.path.join(distsrcsep, 'duk_unicode_caseconv.h.tmp'),
+			table_name_lc='duk_unicode_caseconv_lc',
+			table_name_uc='duk_unicode_caseconv_uc',
+			log=log)
+
+def extract_re_canon_lookup_worker():
+	with open(os.path.join(distsrcsep, 'caseconv_re_canon_lookup.txt'), 'wb') as log:
+		unicode_extract_caseconv.generate_caseconv_files(get_unicode_db(),
+			get_special_casing(), 're_canon_lookup',
+			os.path.join(distsrcsep, 'duk_unicode_re_canon_lookup.c.tmp'),
+			os.path.join(distsrcsep, 'duk_unicode_re_canon_lookup.h.tmp'),
+			table_name_re_canon_lookup='duk_unicode_re_canon_lookup',
+			log=log)
 
 def extract_chars(incl, excl, suffix):
 	#print('- extract_chars: %s %s %s' % (incl, excl, suffix))
-	res = exec_get_stdout([
-		sys.executable,
-		os.path.join('src', 'extract_chars.py'),
-		'--unicode-data=' + os.path.join(distsrcsep, 'UnicodeData-expanded.tmp'),
-		'--include-categories=' + incl,
-		'--exclude-categories=' + excl,
-		'--out-source=' + os.path.join(distsrcsep, 'duk_unicode_%s.c.tmp' % suffix),
-		'--out-header=' + os.path.join(distsrcsep, 'duk_unicode_%s.h.tmp' % suffix),
-		'--table-name=' + 'duk_unicode_%s' % suffix
-	])
-	with open(os.path.join(distsrcsep, suffix + '.txt'), 'wb') as f:
-		f.write(res)
+	tasks.add_process('extract_chars_' + suffix, extract_chars_worker, (incl, excl, suffix), deps=[ 'load_unicode_db' ])
 
 def extract_caseconv():
 	#print('- extract_caseconv case conversion')
-	res = exec_get_stdout([
-		sys.executable,
-		os.path.join('src', 'extract_caseconv.py'),
-		'--command=caseconv_bitpacked',
-		'--unicode-data=' + os.path.join(distsrcsep, 'UnicodeData-expanded.tmp'),
-		'--special-casing=' + os.path.join('src', 'SpecialCasing.txt'),
-		'--out-source=' + os.path.join(distsrcsep, 'duk_unicode_caseconv.c.tmp'),
-		'--out-header=' + os.path.join(distsrcsep, 'duk_unicode_caseconv.h.tmp'),
-		'--table-name-lc=duk_unicode_caseconv_lc',
-		'--table-name-uc=duk_unicode_caseconv_uc'
-	])
-	with open(os.path.join(distsrcsep, 'caseconv.txt'), 'wb') as f:
-		f.write(res)
+	tasks.add_process('extract_caseconv', extract_caseconv_worker, (), deps=[ 'load_unicode_db' ])
 
 	#print('- extract_caseconv canon lookup')
-	res = exec_get_stdout([
-		sys.executable,
-		os.path.join('src', 'extract_caseconv.py'),
-		'--command=re_canon_lookup',
-		'--unicode-data=' + os.path.join(distsrcsep, 'UnicodeData-expanded.tmp'),
-		'--special-casing=' + os.path.join('src', 'SpecialCasing.txt'),
-		'--out-source=' + os.path.join(distsrcsep, 'duk_unicode_re_canon_lookup.c.tmp'),
-		'--out-header=' + os.path.join(distsrcsep, 'duk_unicode_re_canon_lookup.h.tmp'),
-		'--table-name-re-canon-lookup=duk_unicode_re_canon_lookup'
-	])
-	with open(os.path.join(distsrcsep, 'caseconv_re_canon_lookup.txt'), 'wb') as f:
-		f.write(res)
+	tasks.add_process('extract_re_canon_lookup', extract_re_canon_lookup_worker, (), deps=[ 'load_unicode_db' ])
 
-print('Create Unicode tables for codepoint classes')
+# Create Unicode tables for codepoint classes
 extract_chars(WHITESPACE_INCL, WHITESPACE_EXCL, 'ws')
 extract_chars(LETTER_INCL, LETTER_EXCL, 'let')
 extract_chars(LETTER_NOA_INCL, LETTER_NOA_EXCL, 'let_noa')
@@ -1028,50 +1313,52 @@ extract_chars(IDPART_MINUS_IDSTART_INCL, IDPART_MINUS_IDSTART_EXCL, 'idp_m_ids')
 extract_chars(IDPART_MINUS_IDSTART_NOA_INCL, IDPART_MINUS_IDSTART_NOA_EXCL, 'idp_m_ids_noa')
 extract_chars(IDPART_MINUS_IDSTART_NOABMP_INCL, IDPART_MINUS_IDSTART_NOABMP_EXCL, 'idp_m_ids_noabmp')
 
-print('Create Unicode tables for case conversion')
+# Create Unicode tables for case conversion
 extract_caseconv()
 
-print('Combine sources and clean up')
-
 # Inject autogenerated files into source and header files so that they are
 # usable (for all profiles and define cases) directly.
 #
 # The injection points use a standard C preprocessor #include syntax
 # (earlier these were actual includes).
 
-copy_and_replace(os.path.join(distsrcsep, 'duk_unicode.h'), os.path.join(distsrcsep, 'duk_unicode.h'), {
-	'#include "duk_unicode_ids_noa.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_noa.h.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_ids_noabmp.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_noabmp.h.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_ids_m_let_noa.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_m_let_noa.h.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_ids_m_let_noabmp.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_m_let_noabmp.h.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_idp_m_ids_noa.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_idp_m_ids_noa.h.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_idp_m_ids_noabmp.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_idp_m_ids_noabmp.h.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_caseconv.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_caseconv.h.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_re_canon_lookup.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_re_canon_lookup.h.tmp'), strip_last_nl=True)
-})
-
-copy_and_replace(os.path.join(distsrcsep, 'duk_unicode_tables.c'), os.path.join(distsrcsep, 'duk_unicode_tables.c'), {
-	'#include "duk_unicode_ids_noa.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_noa.c.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_ids_noabmp.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_noabmp.c.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_ids_m_let_noa.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_m_let_noa.c.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_ids_m_let_noabmp.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_m_let_noabmp.c.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_idp_m_ids_noa.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_idp_m_ids_noa.c.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_idp_m_ids_noabmp.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_idp_m_ids_noabmp.c.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_caseconv.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_caseconv.c.tmp'), strip_last_nl=True),
-	'#include "duk_unicode_re_canon_lookup.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_re_canon_lookup.c.tmp'), strip_last_nl=True)
-})
-
-# Clean up some temporary files
+def inject_unicode_tables():
+	copy_and_replace(os.path.join(distsrcsep, 'duk_unicode.h'), os.path.join(distsrcsep, 'duk_unicode.h'), {
+		'#include "duk_unicode_ids_noa.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_noa.h.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_ids_noabmp.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_noabmp.h.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_ids_m_let_noa.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_m_let_noa.h.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_ids_m_let_noabmp.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_m_let_noabmp.h.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_idp_m_ids_noa.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_idp_m_ids_noa.h.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_idp_m_ids_noabmp.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_idp_m_ids_noabmp.h.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_caseconv.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_caseconv.h.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_re_canon_lookup.h"': read_file(os.path.join(distsrcsep, 'duk_unicode_re_canon_lookup.h.tmp'), strip_last_nl=True)
+	})
+
+	copy_and_replace(os.path.join(distsrcsep, 'duk_unicode_tables.c'), os.path.join(distsrcsep, 'duk_unicode_tables.c'), {
+		'#include "duk_unicode_ids_noa.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_noa.c.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_ids_noabmp.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_noabmp.c.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_ids_m_let_noa.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_m_let_noa.c.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_ids_m_let_noabmp.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_ids_m_let_noabmp.c.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_idp_m_ids_noa.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_idp_m_ids_noa.c.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_idp_m_ids_noabmp.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_idp_m_ids_noabmp.c.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_caseconv.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_caseconv.c.tmp'), strip_last_nl=True),
+		'#include "duk_unicode_re_canon_lookup.c"': read_file(os.path.join(distsrcsep, 'duk_unicode_re_canon_lookup.c.tmp'), strip_last_nl=True)
+	})
+
+	# Clean up some temporary files
+	delete_matching_files(distsrcsep, lambda x: x[-4:] == '.tmp')
+	delete_matching_files(distsrcsep, lambda x: x in [
+		'ws.txt',
+		'let.txt', 'let_noa.txt', 'let_noabmp.txt',
+		'ids.txt', 'ids_noa.txt', 'ids_noabmp.txt',
+		'ids_m_let.txt', 'ids_m_let_noa.txt', 'ids_m_let_noabmp.txt',
+		'idp_m_ids.txt', 'idp_m_ids_noa.txt', 'idp_m_ids_noabmp.txt'
+	])
+	delete_matching_files(distsrcsep, lambda x: x[0:8] == 'caseconv' and x[-4:] == '.txt')
 
-delete_matching_files(distsrcsep, lambda x: x[-4:] == '.tmp')
-delete_matching_files(distsrcsep, lambda x: x in [
-	'ws.txt',
-	'let.txt', 'let_noa.txt', 'let_noabmp.txt',
-	'ids.txt', 'ids_noa.txt', 'ids_noabmp.txt',
-	'ids_m_let.txt', 'ids_m_let_noa.txt', 'ids_m_let_noabmp.txt',
-	'idp_m_ids.txt', 'idp_m_ids_noa.txt', 'idp_m_ids_noabmp.txt'
-])
-delete_matching_files(distsrcsep, lambda x: x[0:8] == 'caseconv' and x[-4:] == '.txt')
+# All generated files must be in place in src-separate before the sources
+# are combined, so depend on every task declared so far.
+tasks.add('inject_unicode_tables', inject_unicode_tables, deps=tasks.get_names())
 
 # Create a combined source file, duktape.c, into a separate combined source
 # directory.  This allows user to just include "duktape.c", "duktape.h", and
@@ -1158,28 +1445,33 @@ def select_combined_sources():
 with open(os.path.join(dist, 'prologue.tmp'), 'wb') as f:
 	f.write(create_source_prologue(os.path.join(dist, 'LICENSE.txt.tmp'), os.path.join(dist, 'AUTHORS.rst.tmp')))
 
-exec_print_stdout([
-	sys.executable,
-	os.path.join('util', 'combine_src.py'),
-	'--include-path', distsrcsep,
-	'--include-exclude', 'duk_config.h',  # don't inline
-	'--include-exclude', 'duktape.h',     # don't inline
-	'--prologue', os.path.join(dist, 'prologue.tmp'),
-	'--output-source', os.path.join(distsrccom, 'duktape.c'),
-	'--output-metadata', os.path.join(distsrccom, 'metadata.json'),
-	'--line-directives'
-] + select_combined_sources())
-
-exec_print_stdout([
-	sys.executable,
-	os.path.join('util', 'combine_src.py'),
-	'--include-path', distsrcsep,
-	'--include-exclude', 'duk_config.h',  # don't inline
-	'--include-exclude', 'duktape.h',     # don't inline
-	'--prologue', os.path.join(dist, 'prologue.tmp'),
-	'--output-source', os.path.join(distsrcnol, 'duktape.c'),
-	'--output-metadata', os.path.join(distsrcnol, 'metadata.json')
-] + select_combined_sources())
+def combine_src(outdir, extra_args):
+	exec_cached('combine_src', [
+		sys.executable,
+		os.path.join('util', 'combine_src.py'),
+		'--include-path', distsrcsep,
+		'--include-exclude', 'duk_config.h',  # don't inline
+		'--include-exclude', 'duktape.h',     # don't inline
+		'--prologue', os.path.join(dist, 'prologue.tmp'),
+		'--output-source', os.path.join(outdir, 'duktape.c'),
+		'--output-metadata', os.path.join(outdir, 'metadata.json'),
+		'--output-line-map', os.path.join(outdir, 'line_map.bin')
+	] + extra_args + select_combined_sources(), inputs=[
+		os.path.join('util', 'combine_src.py'),
+		os.path.join(dist, 'prologue.tmp')
+	] + list_tree_files(distsrcsep), outputs=[
+		os.path.join(outdir, 'duktape.c'),
+		os.path.join(outdir, 'metadata.json'),
+		os.path.join(outdir, 'line_map.bin')
+	])
+
+tasks.add('combine_src', lambda: combine_src(distsrccom, [ '--line-directives' ]), deps=[ 'inject_unicode_tables' ])
+tasks.add('combine_src_noline', lambda: combine_src(distsrcnol, []), deps=[ 'inject_unicode_tables' ])
+
+print('Run %d dist tasks using %d parallel jobs' % (len(tasks.get_names()), opts.jobs))
+tasks.run(opts.jobs)
+
+print('Clean up')
 
 # Clean up remaining temp files
 delete_matching_files(dist, lambda x: x[-4:] == '.tmp')
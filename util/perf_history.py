@@ -0,0 +1,371 @@
+#!/usr/bin/env python2
+#
+#  Performance result history: record, compare and plot benchmark runs.
+#
+#  Runs are JSON documents written by util/perftest.py (and other benchmark
+#  drivers using the same result format):
+#
+#    {
+#      "timestamp": "...", "git_describe": "...", "git_commit": "...",
+#      "metric": "user",
+#      "results": [
+#        { "suite": "perf", "test": "...", "engine": "...", "status": "ok",
+#          "samples": { "user": [ ... ], ... }, "higher_is_better": false },
+#        ...
+#      ]
+#    }
+#
+#  "suite" defaults to "perf" and "higher_is_better" to false (times).
+#
+#  A history directory contains one file per recorded run.  Runs can be
+#  referred to by file name, or by git describe or commit hash (prefix)
+#  when a history directory is given; when several recorded runs match a
+#  reference their samples are merged.
+#
+#  Commands:
+#
+#    record RUN.json...          copy runs into --history-dir
+#    list                        list recorded runs
+#    compare REF_A REF_B         compare runs, A is the baseline
+#    trend                       write trend data and charts into --out-dir
+#
+#  Comparison uses a two-sided Mann-Whitney U test on the raw samples, a
+#  change is flagged when it's larger than --threshold and significant at
+#  --alpha.  'compare' exits with 1 if regressions were found so it can be
+#  used in test scripts (e.g. testrunner run_commit_test.py).
+#
+#  Example:
+#
+#  $ python util/perf_history.py --history-dir /tmp/perf record /tmp/duk-perftest.json
+#  $ python util/perf_history.py --history-dir /tmp/perf compare v1.5.0 v1.5.0-12-g1234abc
+#
+
+import os
+import re
+import sys
+import json
+import math
+import optparse
+
+def writeJson(fn, val):
+	f = open(fn, 'wb')
+	f.write(json.dumps(val, indent=4, sort_keys=True) + '\n')
+	f.close()
+
+# Read runs from a file: either a single JSON document or one JSON document
+# per line (perftest.py --history).
+def readRunFile(fn):
+	f = open(fn, 'rb')
+	d = f.read()
+	f.close()
+	try:
+		return [ json.loads(d) ]
+	except ValueError:
+		pass
+	res = []
+	for line in d.split('\n'):
+		line = line.strip()
+		if line != '':
+			res.append(json.loads(line))
+	return res
+
+def readHistory(history_dir):
+	runs = []
+	if history_dir is None or not os.path.isdir(history_dir):
+		return runs
+	for fn in sorted(os.listdir(history_dir)):
+		if not fn.endswith('.json'):
+			continue
+		for run in readRunFile(os.path.join(history_dir, fn)):
+			run['_filename'] = fn
+			runs.append(run)
+	runs.sort(key=lambda r: r.get('timestamp') or '')
+	return runs
+
+def runName(run):
+	return run.get('git_describe') or run.get('git_commit') or run.get('_filename') or 'unknown'
+
+def runMatches(run, ref):
+	if run.get('git_describe') == ref or run.get('_filename') == ref:
+		return True
+	commit = run.get('git_commit')
+	if commit is not None and len(ref) >= 4 and commit.startswith(ref):
+		return True
+	return False
+
+# Resolve a run reference into a list of runs.
+def resolveRef(ref, history):
+	if os.path.isfile(ref):
+		return readRunFile(ref)
+	res = [ run for run in history if runMatches(run, ref) ]
+	if len(res) == 0:
+		raise Exception('no recorded runs match %r' % ref)
+	return res
+
+def resultKey(res):
+	return (res.get('suite', 'perf'), res['test'], res['engine'])
+
+# Merge samples of runs into a dict: key -> info.  'metric' overrides the
+# metric recorded in the runs, e.g. a perf counter for perftest.py --perf-stat
+# runs.
+def collectSamples(runs, metric=None):
+	res = {}
+	for run in runs:
+		for r in run.get('results', []):
+			key = resultKey(r)
+			ent = res.get(key)
+			if ent is None:
+				ent = {
+					'samples': [],
+					'status': r.get('status', 'ok'),
+					'higher_is_better': r.get('higher_is_better', False)
+				}
+				res[key] = ent
+			m = metric or r.get('metric', run.get('metric', 'user'))
+			if r.get('status', 'ok') == 'ok' and r.get('samples') is not None:
+				ent['samples'] += [ x for x in r['samples'].get(m, []) if x is not None ]
+				ent['status'] = 'ok'
+	return res
+
+def median(values):
+	tmp = sorted(values)
+	n = len(tmp)
+	if n == 0:
+		return None
+	if n & 1:
+		return tmp[n / 2]
+	return (tmp[n / 2 - 1] + tmp[n / 2]) / 2.0
+
+# Two-sided Mann-Whitney U test using the normal approximation with tie
+# and continuity correction.  Returns a p-value, or None if there are too
+# few samples.
+def mannWhitneyU(a, b):
+	n1 = len(a)
+	n2 = len(b)
+	if n1 < 2 or n2 < 2:
+		return None
+
+	values = sorted([ (x, 0) for x in a ] + [ (x, 1) for x in b ])
+	n = n1 + n2
+	ranks = [ 0.0 ] * n
+	tie_term = 0.0
+	i = 0
+	while i < n:
+		j = i
+		while j + 1 < n and values[j + 1][0] == values[i][0]:
+			j += 1
+		rank = (i + j) / 2.0 + 1.0
+		for k in xrange(i, j + 1):
+			ranks[k] = rank
+		t = j - i + 1
+		tie_term += t * t * t - t
+		i = j + 1
+
+	r1 = sum([ ranks[k] for k in xrange(n) if values[k][1] == 0 ])
+	u1 = r1 - n1 * (n1 + 1) / 2.0
+	mu = n1 * n2 / 2.0
+	sigma2 = n1 * n2 / 12.0 * ((n + 1) - tie_term / (n * (n - 1)))
+	if sigma2 <= 0:
+		return 1.0
+	z = (abs(u1 - mu) - 0.5) / math.sqrt(sigma2)
+	if z < 0:
+		z = 0.0
+	return math.erfc(z / math.sqrt(2.0))
+
+# Compare two sets of runs, return a list of row dicts.
+def compareRuns(runs_a, runs_b, threshold=0.02, alpha=0.05, metric=None):
+	samples_a = collectSamples(runs_a, metric)
+	samples_b = collectSamples(runs_b, metric)
+	rows = []
+	for key in sorted(set(samples_a.keys()) | set(samples_b.keys())):
+		a = samples_a.get(key)
+		b = samples_b.get(key)
+		row = {
+			'suite': key[0],
+			'test': key[1],
+			'engine': key[2],
+			'median_a': None,
+			'median_b': None,
+			'change': None,
+			'p': None,
+			'verdict': ''
+		}
+		rows.append(row)
+		if a is None or b is None:
+			row['verdict'] = 'missing'
+			continue
+		if a['status'] != 'ok' or b['status'] != 'ok':
+			row['verdict'] = 'failed'
+			continue
+
+		row['median_a'] = median(a['samples'])
+		row['median_b'] = median(b['samples'])
+		if row['median_a'] is None or row['median_b'] is None or row['median_a'] == 0:
+			continue
+		row['change'] = (row['median_b'] - row['median_a']) / row['median_a']
+		row['p'] = mannWhitneyU(a['samples'], b['samples'])
+
+		worse = row['change'] if not b['higher_is_better'] else -row['change']
+		if row['p'] is not None and row['p'] < alpha and abs(row['change']) > threshold:
+			if worse > 0:
+				row['verdict'] = 'REGRESSION'
+			else:
+				row['verdict'] = 'improvement'
+	return rows
+
+def formatSummary(rows):
+	regressions = [ r for r in rows if r['verdict'] == 'REGRESSION' ]
+	improvements = [ r for r in rows if r['verdict'] == 'improvement' ]
+	res = '%d regressions, %d improvements, %d compared' % \
+	      (len(regressions), len(improvements), len([ r for r in rows if r['change'] is not None ]))
+	if len(regressions) > 0:
+		worst = max(regressions, key=lambda r: abs(r['change']))
+		res += ', worst %s %s %+.1f%%' % (worst['engine'], worst['test'], worst['change'] * 100.0)
+	return res
+
+def printRows(rows, only_flagged):
+	print('%-10s %-36s %-12s %10s %10s %8s %8s  %s' % ('suite', 'test', 'engine', 'a', 'b', 'change', 'p', ''))
+	for r in rows:
+		if only_flagged and r['verdict'] not in [ 'REGRESSION', 'improvement' ]:
+			continue
+		def fmt(x, f):
+			if x is None:
+				return '-'
+			return f % x
+		print('%-10s %-36s %-12s %10s %10s %8s %8s  %s' % \
+		      (r['suite'], r['test'], r['engine'],
+		       fmt(r['median_a'], '%.4f'), fmt(r['median_b'], '%.4f'),
+		       fmt(None if r['change'] is None else r['change'] * 100.0, '%+.1f%%'),
+		       fmt(r['p'], '%.4f'), r['verdict']))
+
+def safeName(x):
+	return re.sub(r'[^A-Za-z0-9_.+-]', '_', x)
+
+def cmd_record(opts, args):
+	if opts.history_dir is None:
+		raise Exception('--history-dir required')
+	if not os.path.isdir(opts.history_dir):
+		os.makedirs(opts.history_dir)
+	for fn in args[1:]:
+		for run in readRunFile(fn):
+			out_fn = '%s-%s.json' % (safeName(run.get('timestamp') or 'unknown'), safeName(runName(run)))
+			writeJson(os.path.join(opts.history_dir, out_fn), run)
+			print('Recorded %s as %s' % (runName(run), out_fn))
+
+def cmd_list(opts, args):
+	for run in readHistory(opts.history_dir):
+		print('%-24s %-30s %-12s %4d results  %s' % \
+		      (run.get('timestamp'), runName(run), (run.get('git_commit') or '')[:12],
+		       len(run.get('results', [])), run['_filename']))
+
+def cmd_compare(opts, args):
+	history = readHistory(opts.history_dir)
+	runs_a = resolveRef(args[1], history)
+	runs_b = resolveRef(args[2], history)
+	rows = compareRuns(runs_a, runs_b, opts.threshold, opts.alpha, opts.metric)
+	if opts.output is not None:
+		writeJson(opts.output, rows)
+	if not opts.summary:
+		printRows(rows, opts.only_flagged)
+	print(formatSummary(rows))
+	if len([ r for r in rows if r['verdict'] == 'REGRESSION' ]) > 0:
+		sys.exit(1)
+
+# Write one data file per (suite, test) with a median column for each engine
+# (rows are runs in timestamp order) and plot them with gnuplot.  An HTML
+# index lists the charts.
+def cmd_trend(opts, args):
+	if opts.out_dir is None:
+		raise Exception('--out-dir required')
+	if not os.path.isdir(opts.out_dir):
+		os.makedirs(opts.out_dir)
+
+	runs = readHistory(opts.history_dir)
+	per_run = [ collectSamples([ run ]) for run in runs ]
+
+	series = {}  # (suite, test) -> set of engines
+	for samples in per_run:
+		for key in samples.keys():
+			series.setdefault((key[0], key[1]), set()).add(key[2])
+
+	cmds = []
+	charts = []
+	for suite, test in sorted(series.keys()):
+		engines = sorted(series[(suite, test)])
+		name = safeName('%s_%s' % (suite, test))
+		data_fn = os.path.join(opts.out_dir, name + '.txt')
+		f = open(data_fn, 'wb')
+		f.write('# index run ' + ' '.join(engines) + '\n')
+		for idx, run in enumerate(runs):
+			row = [ '%d' % idx, safeName(runName(run)) ]
+			for eng in engines:
+				ent = per_run[idx].get((suite, test, eng))
+				med = None
+				if ent is not None and ent['status'] == 'ok':
+					med = median(ent['samples'])
+				row.append('?' if med is None else '%f' % med)
+			f.write(' '.join(row) + '\n')
+		f.close()
+
+		png_fn = os.path.join(opts.out_dir, name + '.png')
+		cmds.append('set output "%s"' % png_fn)
+		cmds.append('set title "%s %s"' % (suite, test))
+		plots = []
+		for i, eng in enumerate(engines):
+			plots.append('"%s" using 1:%d:xtic(2) title "%s" with linespoints' % (data_fn, i + 3, eng))
+		cmds.append('plot ' + ', '.join(plots))
+		charts.append((suite, test, name + '.png'))
+
+	# Run all plots with a single gnuplot invocation.
+	cmd_fn = os.path.join(opts.out_dir, 'gnuplot-commands')
+	f = open(cmd_fn, 'wb')
+	f.write('set terminal pngcairo size 1024,480\n')
+	f.write('set datafile missing "?"\n')
+	f.write('set xtics rotate by -45\n')
+	f.write('set key outside\n')
+	f.write('\n'.join(cmds) + '\n')
+	f.close()
+	os.system('gnuplot <"%s" >/dev/null 2>/dev/null' % cmd_fn)
+
+	f = open(os.path.join(opts.out_dir, 'index.html'), 'wb')
+	f.write('<!DOCTYPE html>\n')
+	f.write('<html>\n')
+	f.write('<body>\n')
+	for suite, test, png in charts:
+		f.write('<h2>%s %s</h2>\n' % (suite, test))
+		f.write('<img src="%s">\n' % png)
+	f.write('</body>\n')
+	f.write('</html>\n')
+	f.close()
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option('--history-dir', dest='history_dir', default=None, help='Directory of recorded runs')
+	parser.add_option('--threshold', dest='threshold', type='float', default=0.02, help='Relative change needed to flag a difference (default 0.02)')
+	parser.add_option('--alpha', dest='alpha', type='float', default=0.05, help='Significance level (default 0.05)')
+	parser.add_option('--metric', dest='metric', default=None, help='Metric to compare instead of the recorded one, e.g. instructions')
+	parser.add_option('--only-flagged', dest='only_flagged', action='store_true', default=False, help='Only print regressions and improvements')
+	parser.add_option('--summary', dest='summary', action='store_true', default=False, help='Only print a one line summary')
+	parser.add_option('--output', dest='output', default=None, help='Write comparison as JSON')
+	parser.add_option('--out-dir', dest='out_dir', default=None, help='Output directory for trend data and charts')
+	(opts, args) = parser.parse_args()
+
+	if len(args) == 0:
+		parser.error('command missing')
+
+	cmd = args[0]
+	if cmd == 'record':
+		cmd_record(opts, args)
+	elif cmd == 'list':
+		cmd_list(opts, args)
+	elif cmd == 'compare':
+		if len(args) != 3:
+			parser.error('compare needs two run references')
+		cmd_compare(opts, args)
+	elif cmd == 'trend':
+		cmd_trend(opts, args)
+	else:
+		raise Exception('invalid command: %r' % cmd)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python2
+#
+#  Perftest driver: runs tests/perf/*.js (or equivalent .lua/.py/.pl/.rb
+#  files for other engines) for a set of engines and writes the results as
+#  JSON.
+#
+#  Independent (engine, test) pairs are run in parallel, one worker per CPU
+#  given with --cpus, and each worker is pinned to its CPU using taskset so
+#  that runs don't migrate or disturb each other.  For stable results use
+#  isolated cores (e.g. isolcpus=2-5 kernel option) and --cpus 2,3,4,5.
+#
+#  Timing uses time_multi.py so the same warmup, repetition and statistics
+#  options are available.
+#
+#  Results are written as a JSON document (--output) and can also be
+#  appended as a single line to a history file (--history, one JSON document
+#  per line).  A text table compatible with format_perftest.py is printed
+#  to stdout.
+#
+#  With --perf-stat each run is executed under 'perf stat' and hardware
+#  counters (--perf-events) are recorded alongside the times.  Counters are
+#  much less noisy than times, especially on shared hosts.  --baseline ENGINE
+#  prints per-test counter deltas of the other engines against ENGINE.
+#
+#  With --flamegraph DIR each (engine, test) pair is also run once under
+#  'perf record -g'; collapsed stacks are written to DIR/<engine>_<test>.folded
+#  and rendered into an SVG if flamegraph.pl (FlameGraph) is in PATH.
+#
+#  Example:
+#
+#  $ python util/perftest.py --cpus 2,3 --engine duk.O2=./duk.O2 \
+#        --engine duk.O2.130=./duk.O2.130 --engine lua \
+#        --output /tmp/perf.json --history /tmp/perf-history.jsonl
+#
+#  $ python util/perftest.py --perf-stat --engine duk.O2=./duk.O2 \
+#        --engine duk.O2.new=/tmp/duk.O2 --baseline duk.O2
+#
+
+import os
+import re
+import sys
+import json
+import time
+import socket
+import tempfile
+import threading
+import Queue
+import optparse
+import subprocess
+import multiprocessing
+
+import time_multi
+
+# Test file suffix for engines which don't run the .js files.
+engine_suffixes = {
+	'lua': '.lua',
+	'luajit': '.lua',
+	'python': '.py',
+	'python2': '.py',
+	'perl': '.pl',
+	'ruby': '.rb'
+}
+
+default_perf_events = 'instructions,cycles,branch-misses,cache-misses'
+
+default_engines = [
+	'duk.Os=./duk',
+	'duk.O2=./duk.O2',
+	'duk.O3=./duk.O3',
+	'duk.O4=./duk.O4'
+]
+
+def parseEngine(spec):
+	# NAME=COMMAND or just COMMAND (name is then the command basename).
+	if '=' in spec:
+		name, cmd = spec.split('=', 1)
+	else:
+		name, cmd = os.path.basename(spec.split(' ')[0]), spec
+	cmd = cmd.split(' ')
+	suffix = engine_suffixes.get(os.path.basename(cmd[0]), '.js')
+	return { 'name': name, 'command': cmd, 'suffix': suffix }
+
+def parseCpus(spec):
+	res = []
+	for part in spec.split(','):
+		if '-' in part:
+			lo, hi = part.split('-', 1)
+			res += range(int(lo), int(hi) + 1)
+		else:
+			res.append(int(part))
+	return res
+
+def discoverTests(test_dir, filter_re):
+	res = []
+	for fn in sorted(os.listdir(test_dir)):
+		if not fn.endswith('.js'):
+			continue
+		if filter_re is not None and filter_re.search(fn) is None:
+			continue
+		res.append(fn)
+	return res
+
+def getGitInfo():
+	res = { 'describe': None, 'commit': None }
+	try:
+		res['describe'] = subprocess.check_output([ 'git', 'describe', '--always', '--dirty' ], stderr=subprocess.PIPE).strip()
+		res['commit'] = subprocess.check_output([ 'git', 'rev-parse', 'HEAD' ], stderr=subprocess.PIPE).strip()
+	except (OSError, subprocess.CalledProcessError):
+		pass
+	return res
+
+def findExecutable(name):
+	for d in os.environ.get('PATH', '').split(os.pathsep):
+		fn = os.path.join(d, name)
+		if os.path.isfile(fn) and os.access(fn, os.X_OK):
+			return fn
+	return None
+
+# Parse 'perf stat -x ,' output: value,unit,event,...  Counters which
+# couldn't be measured ('<not counted>', '<not supported>') are None.
+def parsePerfStat(data):
+	res = {}
+	for line in data.split('\n'):
+		line = line.strip()
+		if line == '' or line.startswith('#'):
+			continue
+		parts = line.split(',')
+		if len(parts) < 3:
+			continue
+		event = parts[2].split(':')[0]  # strip modifiers, e.g. 'cycles:u'
+		try:
+			res[event] = long(parts[0])
+		except ValueError:
+			try:
+				res[event] = float(parts[0])
+			except ValueError:
+				res[event] = None
+	return res
+
+# Runner for time_multi.measure() which adds perf counters to the run
+# measurements.
+def makePerfStatRunner(events):
+	def run(args):
+		fd, tmp_fn = tempfile.mkstemp(suffix='.perfstat')
+		os.close(fd)
+		try:
+			res = time_multi.runOnce([ 'perf', 'stat', '-x', ',', '-e', events, '-o', tmp_fn, '--' ] + args)
+			with open(tmp_fn, 'rb') as f:
+				counters = parsePerfStat(f.read())
+		finally:
+			os.unlink(tmp_fn)
+		for ev in events.split(','):
+			res[ev] = counters.get(ev)
+		return res
+	return run
+
+# Collapse 'perf script' output into folded stacks (root first, frames
+# separated by ';') as used by flamegraph.pl.
+def collapsePerfScript(data):
+	counts = {}
+	comm = None
+	frames = []
+
+	def flush():
+		if comm is None:
+			return
+		key = ';'.join([ comm ] + list(reversed(frames)))
+		counts[key] = counts.get(key, 0) + 1
+
+	for line in data.split('\n'):
+		if line.strip() == '':
+			flush()
+			comm = None
+			frames = []
+		elif line[0] in ' \t':
+			# '    55d3a0 duk_js_execute_bytecode+0x123 (/path/to/duk)'
+			parts = line.strip().split(' ', 2)
+			if len(parts) >= 2:
+				frames.append(re.sub(r'\+0x[0-9a-f]+$', '', parts[1]))
+		else:
+			comm = line.split(' ')[0]
+	flush()
+
+	return counts
+
+def recordFlamegraph(args, out_dir, name):
+	data_fn = os.path.join(out_dir, name + '.perf.data')
+	folded_fn = os.path.join(out_dir, name + '.folded')
+	devnull = open(os.devnull, 'wb')
+	try:
+		subprocess.check_call([ 'perf', 'record', '-g', '-o', data_fn, '--' ] + args, stdout=devnull, stderr=devnull)
+		script = subprocess.check_output([ 'perf', 'script', '-i', data_fn ], stderr=devnull)
+	finally:
+		devnull.close()
+
+	counts = collapsePerfScript(script)
+	with open(folded_fn, 'wb') as f:
+		for key in sorted(counts.keys()):
+			f.write('%s %d\n' % (key, counts[key]))
+
+	flamegraph = findExecutable('flamegraph.pl')
+	if flamegraph is not None:
+		with open(os.path.join(out_dir, name + '.svg'), 'wb') as f:
+			subprocess.check_call([ flamegraph, folded_fn ], stdout=f)
+
+class Worker(threading.Thread):
+	def __init__(self, cpu, jobs, results, opts, pin):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.cpu = cpu
+		self.jobs = jobs
+		self.results = results
+		self.opts = opts
+		self.pin = pin
+
+	def run(self):
+		while True:
+			try:
+				job = self.jobs.get_nowait()
+			except Queue.Empty:
+				return
+			self.results.append(self.runJob(job))
+
+	def runJob(self, job):
+		opts = self.opts
+		res = {
+			'test': job['test'],
+			'engine': job['engine']['name'],
+			'command': job['args'],
+			'cpu': self.cpu if self.pin else None,
+			'metric': opts.metric,
+			'status': 'ok',
+			'stats': None,
+			'samples': None,
+			'counters': None
+		}
+
+		args = job['args']
+		if self.pin:
+			args = [ 'taskset', '-c', str(self.cpu) ] + args
+
+		events = []
+		runner = time_multi.runOnce
+		if opts.perf_stat:
+			events = opts.perf_events.split(',')
+			runner = makePerfStatRunner(opts.perf_events)
+
+		try:
+			samples = time_multi.measure(args, metric=opts.metric, count=opts.count,
+			                             max_count=opts.max_count, warmup=opts.warmup,
+			                             target_ci=opts.target_ci, ci_level=opts.ci_level,
+			                             sleep_factor=opts.sleep_factor,
+			                             rerun_limit=opts.rerun_limit, runner=runner)
+			if opts.flamegraph is not None:
+				name = re.sub(r'[^A-Za-z0-9_.+-]', '_', '%s_%s' % (res['engine'], res['test']))
+				recordFlamegraph(args, opts.flamegraph, name)
+		except time_multi.RunFailed as e:
+			res['status'] = str(e)
+		except (OSError, subprocess.CalledProcessError) as e:
+			res['status'] = 'n/a'
+
+		if res['status'] == 'ok':
+			res['stats'] = time_multi.computeStats([ s[opts.metric] for s in samples ], opts.ci_level)
+			res['samples'] = {}
+			for k in [ 'user', 'sys', 'cpu', 'wall', 'maxrss' ] + events:
+				res['samples'][k] = [ s[k] for s in samples ]
+			if len(events) > 0:
+				res['counters'] = {}
+				for ev in events:
+					values = [ x for x in res['samples'][ev] if x is not None ]
+					res['counters'][ev] = time_multi.median(values)
+
+		if opts.verbose:
+			if res['status'] == 'ok':
+				val = '%.04f' % res['stats']['median']
+			else:
+				val = res['status']
+			sys.stderr.write('cpu %s: %s %s: %s\n' % (res['cpu'], res['engine'], res['test'], val))
+			sys.stderr.flush()
+
+		return res
+
+def printTable(doc):
+	results = {}
+	for r in doc['results']:
+		results[(r['test'], r['engine'])] = r
+
+	for test in doc['tests']:
+		line = '%-36s:' % test
+		for name in doc['engines']:
+			r = results.get((test, name))
+			if r is None:
+				val = 'n/a'
+			elif r['status'] != 'ok':
+				val = r['status']
+			else:
+				val = '%.02f' % r['stats']['median']
+			line += ' %s %5s' % (name, val)
+		print(line)
+
+# Print counter (and time) deltas of each engine against a baseline engine.
+def printCounterDeltas(doc, baseline, events):
+	results = {}
+	for r in doc['results']:
+		results[(r['test'], r['engine'])] = r
+
+	def delta(new, old):
+		if new is None or old is None or old == 0:
+			return 'n/a'
+		return '%+.2f%%' % ((float(new) - float(old)) / float(old) * 100.0)
+
+	for test in doc['tests']:
+		base = results.get((test, baseline))
+		if base is None or base['status'] != 'ok':
+			continue
+		for name in doc['engines']:
+			if name == baseline:
+				continue
+			r = results.get((test, name))
+			if r is None or r['status'] != 'ok':
+				continue
+			line = '%-36s: %s vs %s: %s %s' % \
+			       (test, name, baseline, doc['metric'], delta(r['stats']['median'], base['stats']['median']))
+			for ev in events:
+				line += ' %s %s' % (ev, delta(r['counters'].get(ev), base['counters'].get(ev)))
+			print(line)
+
+def main():
+	parser = optparse.OptionParser()
+	parser.add_option('--engine', dest='engines', action='append', default=[], help='Engine to test, NAME=COMMAND or COMMAND, repeatable (default: duk.Os, duk.O2, duk.O3, duk.O4)')
+	parser.add_option('--test-dir', dest='test_dir', default=os.path.join('tests', 'perf'))
+	parser.add_option('--filter', dest='filter', default=None, help='Regexp for test filenames to run')
+	parser.add_option('--cpus', dest='cpus', default=None, help='CPUs to run on, e.g. 2,3 or 2-5 (default: all)')
+	parser.add_option('--no-pin', dest='pin', action='store_false', default=True, help='Don\'t pin runs to CPUs')
+	parser.add_option('--count', type='int', dest='count', default=5)
+	parser.add_option('--max-count', type='int', dest='max_count', default=None)
+	parser.add_option('--target-ci', type='float', dest='target_ci', default=0.01)
+	parser.add_option('--ci-level', type='float', dest='ci_level', default=0.95)
+	parser.add_option('--warmup', type='int', dest='warmup', default=1)
+	parser.add_option('--metric', dest='metric', default='user')
+	parser.add_option('--sleep-factor', type='float', dest='sleep_factor', default=0.0)
+	parser.add_option('--rerun-limit', type='int', dest='rerun_limit', default=30)
+	parser.add_option('--perf-stat', dest='perf_stat', action='store_true', default=False, help='Record hardware counters using perf stat')
+	parser.add_option('--perf-events', dest='perf_events', default=default_perf_events, help='Events for --perf-stat (default: %s)' % default_perf_events)
+	parser.add_option('--baseline', dest='baseline', default=None, help='With --perf-stat, print counter deltas against this engine')
+	parser.add_option('--flamegraph', dest='flamegraph', default=None, help='Record a perf profile of each test and write collapsed stacks (and SVG flamegraphs) into this directory')
+	parser.add_option('--output', dest='output', default=None, help='Write results as JSON')
+	parser.add_option('--history', dest='history', default=None, help='Append results as a JSON line to a history file')
+	parser.add_option('--verbose', action='store_true', dest='verbose', default=False)
+	(opts, args) = parser.parse_args()
+
+	engines = [ parseEngine(x) for x in (opts.engines or default_engines) ]
+	filter_re = None
+	if opts.filter is not None:
+		filter_re = re.compile(opts.filter)
+	tests = discoverTests(opts.test_dir, filter_re)
+
+	if opts.cpus is not None:
+		cpus = parseCpus(opts.cpus)
+	else:
+		cpus = range(multiprocessing.cpu_count())
+	pin = opts.pin
+	if pin and findExecutable('taskset') is None:
+		sys.stderr.write('taskset not found, runs are not pinned to CPUs\n')
+		pin = False
+	if (opts.perf_stat or opts.flamegraph is not None) and findExecutable('perf') is None:
+		raise Exception('perf not found, needed for --perf-stat and --flamegraph')
+	if opts.flamegraph is not None and not os.path.isdir(opts.flamegraph):
+		os.makedirs(opts.flamegraph)
+
+	# Interleave engines so that a slow engine doesn't end up running alone
+	# at the end.
+	jobs = Queue.Queue()
+	for test in tests:
+		for eng in engines:
+			fn = os.path.join(opts.test_dir, test[:-3] + eng['suffix'])
+			if not os.path.isfile(fn):
+				continue
+			jobs.put({ 'test': test, 'engine': eng, 'args': eng['command'] + [ fn ] })
+
+	git = getGitInfo()
+	start_time = time.time()
+
+	results = []
+	workers = [ Worker(cpu, jobs, results, opts, pin) for cpu in cpus ]
+	for w in workers:
+		w.start()
+	for w in workers:
+		while w.is_alive():
+			w.join(1.0)  # timeout allows KeyboardInterrupt
+
+	doc = {
+		'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(start_time)),
+		'duration': time.time() - start_time,
+		'host': socket.gethostname(),
+		'git_describe': git['describe'],
+		'git_commit': git['commit'],
+		'cpus': cpus if pin else None,
+		'metric': opts.metric,
+		'perf_events': opts.perf_events.split(',') if opts.perf_stat else None,
+		'engines': [ eng['name'] for eng in engines ],
+		'tests': tests,
+		'results': sorted(results, key=lambda r: (r['test'], r['engine']))
+	}
+
+	if opts.output is not None:
+		with open(opts.output, 'wb') as f:
+			f.write(json.dumps(doc, indent=4, sort_keys=True) + '\n')
+	if opts.history is not None:
+		with open(opts.history, 'ab') as f:
+			f.write(json.dumps(doc, sort_keys=True) + '\n')
+
+	printTable(doc)
+	if opts.perf_stat and opts.baseline is not None:
+		print('')
+		printCounterDeltas(doc, opts.baseline, doc['perf_events'])
+
+if __name__ == '__main__':
+	main()
@@ -1,26 +1,60 @@
 #!/usr/bin/env python2
 #
 #  Resolve a line number in the combined source into an uncombined file/line
-#  using a dist/src/metadata.json file.
+#  using a dist/src/metadata.json or a dist/src/line_map.bin file.
 #
 #  Usage: $ python resolve_combined_lineno.py dist/src/metadata.json 12345
+#         $ python resolve_combined_lineno.py dist/src/line_map.bin 12345
 #
 
 import os
 import sys
 import json
+import struct
+import bisect
+
+# Read a binary line map written by combine_src.py, returns a list of
+# (combined_line, original_file, original_line) tuples.
+def read_binary_line_map(data):
+	if data[0:4] != 'DLM1':
+		raise Exception('invalid line map magic')
+	off = 4
+	num_names, = struct.unpack_from('>L', data, off)
+	off += 4
+	names = []
+	for i in xrange(num_names):
+		name_len, = struct.unpack_from('>H', data, off)
+		off += 2
+		names.append(data[off:off + name_len])
+		off += name_len
+	num_entries, = struct.unpack_from('>L', data, off)
+	off += 4
+	res = []
+	for i in xrange(num_entries):
+		combined_line, name_idx, original_line = struct.unpack_from('>LHL', data, off)
+		off += 10
+		res.append((combined_line, names[name_idx], original_line))
+	return res
+
+def read_line_map(filename):
+	with open(filename, 'rb') as f:
+		data = f.read()
+	if data[0:4] == 'DLM1':
+		return read_binary_line_map(data)
+	metadata = json.loads(data)
+	return [ (e['combined_line'], e['original_file'], e['original_line']) for e in metadata['line_map'] ]
 
 def main():
-	with open(sys.argv[1], 'rb') as f:
-		metadata = json.loads(f.read())
+	line_map = read_line_map(sys.argv[1])
 	lineno = int(sys.argv[2])
 
-	for e in reversed(metadata['line_map']):
-		if lineno >= e['combined_line']:
-			orig_lineno = e['original_line'] + (lineno - e['combined_line'])
-			print('%s:%d -> %s:%d' % ('duktape.c', lineno,
-			                          e['original_file'], orig_lineno))
-			break
+	# Entries are sorted by combined line, find last entry <= lineno.
+	idx = bisect.bisect_right([ e[0] for e in line_map ], lineno) - 1
+	if idx >= 0:
+		combined_line, original_file, original_line = line_map[idx]
+		orig_lineno = original_line + (lineno - combined_line)
+		print('%s:%d -> %s:%d' % ('duktape.c', lineno,
+		                          original_file, orig_lineno))
 
 if __name__ == '__main__':
 	main()
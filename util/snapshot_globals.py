@@ -0,0 +1,363 @@
+#!/usr/bin/env python2
+#
+#  Snapshot global values created by bootstrap code into user builtin
+#  metadata (YAML) so that they become part of the built-in objects.
+#
+#  Usage:
+#
+#    $ python util/snapshot_globals.py --duk ./duk --output snapshot.yaml \
+#          bootstrap1.js bootstrap2.js
+#    $ python util/make_dist.py --rom-support \
+#          --user-builtin-metadata snapshot.yaml
+#
+#  The bootstrap files are executed in order in a single Duktape heap
+#  using the 'duk' command line tool, and the resulting object graph
+#  reachable from new global properties is dumped.  Each snapshotted
+#  object becomes a built-in object, so that:
+#
+#    - With ROM built-ins (DUK_USE_ROM_OBJECTS) the values are shared
+#      read-only by all heaps and creating a heap has no per-value cost.
+#
+#    - With RAM built-ins the values are created from the compact built-in
+#      init data during heap creation (lazily with DUK_USE_LAZY_BUILTINS),
+#      without compiling or executing the bootstrap code.
+#
+#  Limitations, caused by what built-in metadata can describe:
+#
+#    - Only new global properties are snapshotted; changes to existing
+#      globals or built-in objects are ignored.
+#
+#    - Values may be undefined, null, booleans, numbers, strings, plain
+#      objects, arrays, and references to standard built-in objects which
+#      have an 'id' in builtins.yaml (e.g. Object.prototype or Math).
+#      Functions (other than such built-ins), accessors, and other object
+#      classes are rejected; keep them in per-heap bootstrap code.
+#
+#    - Array elements must be plain writable, enumerable, configurable
+#      data properties (RAM built-ins store them in the array part).
+#      Array 'length' is always writable in RAM built-ins.
+#
+#    - The RAM init data format has no null value, so RAM built-ins get
+#      undefined instead of null (genbuiltins.py warns about this).
+#
+#    - Property attributes are preserved, but ROM objects are always
+#      non-extensible and their properties non-configurable.  RAM objects
+#      are always extensible.
+#
+
+import os
+import sys
+import json
+import yaml
+import struct
+import tempfile
+import subprocess
+import optparse
+
+try:
+	from yaml import CSafeLoader as YamlLoader
+except ImportError:
+	from yaml import SafeLoader as YamlLoader
+
+# Dump script executed after the bootstrap files.  It prints a JSON
+# description of global properties, using Duktape JC encoding so that
+# the output is always ASCII.  Numbers which don't survive a JSON
+# roundtrip (NaN, infinities, negative zero) are encoded as strings
+# inside a { "t": "number" } wrapper.
+dump_script = r'''
+(function (global, builtinPaths, baselineNames) {
+    var builtins = [];  // [ object, id ]
+    var objects = [];   // snapshotted objects, index is object number
+    var records = [];
+    var errors = [];
+    var result;
+
+    function resolvePath(path) {
+        var parts = path.split('.');
+        var curr = global;
+        var i;
+        for (i = 0; i < parts.length; i++) {
+            if (parts[i] === '') {
+                continue;  // global object itself
+            }
+            if (curr === null || (typeof curr !== 'object' && typeof curr !== 'function')) {
+                return undefined;
+            }
+            curr = curr[parts[i]];
+        }
+        return curr;
+    }
+
+    function findBuiltin(obj) {
+        var i;
+        for (i = 0; i < builtins.length; i++) {
+            if (builtins[i][0] === obj) {
+                return builtins[i][1];
+            }
+        }
+        return null;
+    }
+
+    function getAttributes(desc) {
+        return (desc.writable ? 'w' : '') +
+               (desc.enumerable ? 'e' : '') +
+               (desc.configurable ? 'c' : '');
+    }
+
+    function encodeValue(val, path) {
+        var id, i, cls;
+
+        if (val === undefined) {
+            return { t: 'undefined' };
+        } else if (val === null || typeof val === 'boolean' || typeof val === 'string') {
+            return val;
+        } else if (typeof val === 'number') {
+            if (val !== val) {
+                return { t: 'number', v: 'NaN' };
+            } else if (val === 1 / 0) {
+                return { t: 'number', v: 'Infinity' };
+            } else if (val === -1 / 0) {
+                return { t: 'number', v: '-Infinity' };
+            } else if (val === 0 && 1 / val < 0) {
+                return { t: 'number', v: '-0' };
+            }
+            return val;
+        }
+
+        id = findBuiltin(val);
+        if (id !== null) {
+            return { t: 'builtin', id: id };
+        }
+        if (typeof val === 'function') {
+            errors.push(path + ': function values cannot be snapshotted');
+            return null;
+        }
+        if (typeof val !== 'object') {
+            errors.push(path + ': unsupported value type ' + typeof val);
+            return null;
+        }
+        cls = Object.prototype.toString.call(val);
+        if (cls !== '[object Object]' && cls !== '[object Array]') {
+            errors.push(path + ': unsupported object class ' + cls);
+            return null;
+        }
+
+        // Linear scan is good enough for bootstrap sized object graphs.
+        for (i = 0; i < objects.length; i++) {
+            if (objects[i] === val) {
+                return { t: 'object', idx: i };
+            }
+        }
+        objects.push(val);
+        records.push(null);
+        i = objects.length - 1;
+        records[i] = encodeObject(val, path);
+        return { t: 'object', idx: i };
+    }
+
+    function encodeProperty(obj, key, path) {
+        var desc = Object.getOwnPropertyDescriptor(obj, key);
+        if ('get' in desc) {
+            errors.push(path + ': accessor properties cannot be snapshotted');
+            return null;
+        }
+        return { key: key, attributes: getAttributes(desc), value: encodeValue(desc.value, path) };
+    }
+
+    function encodeObject(obj, path) {
+        var proto = Object.getPrototypeOf(obj);
+        var isArray = Array.isArray(obj);
+        var props = [];
+        Object.getOwnPropertyNames(obj).forEach(function (key) {
+            var prop;
+            if (isArray && key === 'length') {
+                return;  // emitted last, after the elements
+            }
+            prop = encodeProperty(obj, key, path + '.' + key);
+            if (isArray && prop !== null && String(key >>> 0) === key &&
+                key !== '4294967295' && prop.attributes !== 'wec') {
+                errors.push(path + '.' + key + ': array elements must be writable, enumerable, and configurable');
+            }
+            props.push(prop);
+        });
+        if (isArray) {
+            props.push(encodeProperty(obj, 'length', path + '.length'));
+        }
+        return {
+            'class': (isArray ? 'Array' : 'Object'),
+            proto: (proto === null ? null : encodeValue(proto, path + '.<prototype>')),
+            extensible: Object.isExtensible(obj),
+            properties: props
+        };
+    }
+
+    if (baselineNames === null) {
+        print(Duktape.enc('jc', Object.getOwnPropertyNames(global)));
+        return;
+    }
+
+    Object.getOwnPropertyNames(builtinPaths).forEach(function (id) {
+        var obj = resolvePath(builtinPaths[id]);
+        if (obj !== null && (typeof obj === 'object' || typeof obj === 'function')) {
+            builtins.push([ obj, id ]);
+        }
+    });
+
+    result = { globals: [], objects: records, errors: errors };
+    Object.getOwnPropertyNames(global).forEach(function (key) {
+        if (baselineNames.indexOf(key) >= 0) {
+            return;
+        }
+        result.globals.push(encodeProperty(global, key, key));
+    });
+
+    print(Duktape.enc('jc', result));
+})(new Function('return this')(), %(builtin_paths)s, %(baseline_names)s);
+'''
+
+# Map built-in object IDs to global access paths (e.g. 'bi_math' ->
+# 'Math') by walking object references starting from the global object.
+def get_builtin_paths(objects_metadata):
+	with open(objects_metadata, 'rb') as f:
+		meta = yaml.load(f, Loader=YamlLoader)
+
+	objid_to_object = {}
+	for o in meta['objects']:
+		objid_to_object[o['id']] = o
+
+	paths = { 'bi_global': '' }
+	pending = [ 'bi_global' ]
+	while len(pending) > 0:
+		objid = pending.pop(0)
+		for p in objid_to_object[objid].get('properties', []):
+			v = p['value']
+			if not isinstance(v, dict) or v.get('type') != 'object':
+				continue
+			if paths.has_key(v['id']) or not objid_to_object.has_key(v['id']):
+				continue
+			if paths[objid] == '':
+				paths[v['id']] = p['key']
+			else:
+				paths[v['id']] = paths[objid] + '.' + p['key']
+			pending.append(v['id'])
+
+	return paths
+
+def run_dump(duk, bootstrap_files, builtin_paths, baseline_names):
+	fd, fn = tempfile.mkstemp(suffix='.js', prefix='snapshot-dump-')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			f.write(dump_script % {
+				'builtin_paths': json.dumps(builtin_paths),
+				'baseline_names': json.dumps(baseline_names)
+			})
+		cmd = [ duk ] + bootstrap_files + [ fn ]
+		proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+		out, _ = proc.communicate()
+		if proc.returncode != 0:
+			raise Exception('command failed with exit code %d: %r' % (proc.returncode, cmd))
+	finally:
+		os.unlink(fn)
+
+	# Bootstrap code may print, the dump is always the last line.
+	lines = out.strip().split('\n')
+	return json.loads(lines[-1])
+
+# Convert a dumped string into the YAML metadata string format where
+# codepoints U+0000 to U+00FF identify bytes of the (extended) UTF-8
+# encoded string.  Python 2 encodes lone surrogates like Duktape does.
+def convert_string(x):
+	return x.encode('utf-8').decode('latin-1')
+
+def convert_value(v, objid_prefix):
+	if isinstance(v, dict):
+		if v['t'] == 'undefined':
+			return { 'type': 'undefined' }
+		elif v['t'] == 'builtin':
+			return { 'type': 'object', 'id': v['id'] }
+		elif v['t'] == 'object':
+			return { 'type': 'object', 'id': '%s_%d' % (objid_prefix, v['idx']) }
+		elif v['t'] == 'number':
+			x = float(v['v'].replace('Infinity', 'inf'))
+			if v['v'] == 'NaN':
+				hexbytes = '7ff8000000000000'  # Duktape normalized NaN
+			else:
+				hexbytes = struct.pack('>d', x).encode('hex')
+			return { 'type': 'double', 'bytes': hexbytes }
+		raise Exception('invalid dumped value: %r' % v)
+	elif isinstance(v, unicode):
+		return convert_string(v)
+	elif isinstance(v, float) or (isinstance(v, (int, long)) and not isinstance(v, bool) and \
+	                              (v < -0x80000000 or v > 0x7fffffff)):
+		# Exact IEEE representation for anything other than plain
+		# 32-bit integers.
+		return { 'type': 'double', 'bytes': struct.pack('>d', float(v)).encode('hex') }
+	return v  # None, bool, 32-bit integer
+
+def convert_property(p, objid_prefix):
+	return {
+		'key': convert_string(p['key']),
+		'value': convert_value(p['value'], objid_prefix),
+		'attributes': p['attributes']
+	}
+
+def create_user_metadata(dump, objid_prefix):
+	objects = []
+
+	objects.append({
+		'id': 'bi_global',
+		'modify': True,
+		'properties': [ convert_property(p, objid_prefix) for p in dump['globals'] ]
+	})
+
+	for idx,rec in enumerate(dump['objects']):
+		if not rec['extensible']:
+			print('WARNING: object %s_%d is non-extensible, not preserved in snapshot' % (objid_prefix, idx))
+		obj = {
+			'id': '%s_%d' % (objid_prefix, idx),
+			'add': True,
+			'class': rec['class'],
+			'properties': [ convert_property(p, objid_prefix) for p in rec['properties'] ]
+		}
+		if rec['proto'] is not None:
+			obj['internal_prototype'] = convert_value(rec['proto'], objid_prefix)['id']
+		objects.append(obj)
+
+	return { 'objects': objects }
+
+def main():
+	parser = optparse.OptionParser(usage='%prog [options] bootstrap1.js [bootstrap2.js ...]')
+	parser.add_option('--duk', dest='duk', default='duk', help='Duktape command line binary used to run the bootstrap code')
+	parser.add_option('--objects-metadata', dest='objects_metadata', default=None, help='Built-in objects metadata file (default: src/builtins.yaml)')
+	parser.add_option('--object-id-prefix', dest='object_id_prefix', default='snapshot', help='Prefix for snapshotted object IDs, must be unique across user builtin metadata files')
+	parser.add_option('--output', dest='output', default=None, help='Output user builtin metadata YAML file')
+	(opts, args) = parser.parse_args()
+
+	if opts.output is None:
+		raise Exception('missing --output')
+	if len(args) == 0:
+		raise Exception('no bootstrap files given')
+	if opts.objects_metadata is None:
+		opts.objects_metadata = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'builtins.yaml')
+
+	builtin_paths = get_builtin_paths(opts.objects_metadata)
+
+	# Global properties present without bootstrap code (including any
+	# bindings added by the command line tool) are not snapshotted.
+	baseline_names = run_dump(opts.duk, [], builtin_paths, None)
+	dump = run_dump(opts.duk, args, builtin_paths, baseline_names)
+
+	if len(dump['errors']) > 0:
+		for e in dump['errors']:
+			sys.stderr.write('%s\n' % e)
+		raise Exception('%d value(s) cannot be snapshotted' % len(dump['errors']))
+
+	doc = create_user_metadata(dump, opts.object_id_prefix)
+	with open(opts.output, 'wb') as f:
+		f.write('# Generated by snapshot_globals.py from: %s\n' % ' '.join(args))
+		f.write(yaml.safe_dump(doc, default_flow_style=False))
+	print('Snapshotted %d global(s) and %d object(s) into %s' % \
+	      (len(dump['globals']), len(dump['objects']), opts.output))
+
+if __name__ == '__main__':
+	main()
@@ -2,97 +2,256 @@
 #
 #  Small helper for perftest runs.
 #
+#  Runs a command multiple times and reports statistics for its user, system
+#  or wall clock time.  Resource usage (user/sys time, max RSS) is collected
+#  for each run separately using os.wait4(), wall clock time is measured
+#  around the run.
+#
+#  Optional warmup runs are discarded.  With --max-count larger than --count
+#  runs are repeated until the confidence interval of the median is within
+#  --target-ci (relative to the median), which is needed to detect small
+#  (a few percent) differences reliably.  The confidence interval is
+#  distribution free (based on order statistics) so that it isn't thrown
+#  off by outliers, e.g. runs disturbed by other activity.
+#
+#  Output modes:
+#
+#    min, max, avg, median    single value, compatible with perftest tables
+#    all                      human readable summary
+#    json                     all statistics and samples as JSON
+#
 
 import os
 import sys
 import time
+import json
+import math
 import optparse
 import subprocess
 
-def main():
-	parser = optparse.OptionParser()
-	parser.add_option('--count', type='int', dest='count', default=3)
-	parser.add_option('--mode', dest='mode', default='min')
-	parser.add_option('--sleep', type='float', dest='sleep', default=0.0)
-	parser.add_option('--sleep-factor', type='float', dest='sleep_factor', default=0.0)
-	parser.add_option('--rerun-limit', type='int', dest='rerun_limit', default=30)
-	parser.add_option('--verbose', action='store_true', dest='verbose', default=False)
-	(opts, args) = parser.parse_args()
+# Outlier threshold in (normal distribution scaled) MADs from the median.
+OUTLIER_MADS = 3.0
+
+class RunFailed(Exception):
+	pass
+
+# Run command once, return a dict of measurements.
+def runOnce(args):
+	devnull = open(os.devnull, 'wb')
+	try:
+		t1 = time.time()
+		p = subprocess.Popen(args, stdout=devnull, stderr=devnull)
+		pid, status, rusage = os.wait4(p.pid, 0)
+		t2 = time.time()
+	finally:
+		devnull.close()
+	p.returncode = os.WEXITSTATUS(status)  # already reaped, avoid waiting again
+
+	if os.WIFSIGNALED(status):
+		if os.WTERMSIG(status) == 11:
+			raise RunFailed('segv')
+		raise RunFailed('n/a')
+	if os.WEXITSTATUS(status) != 0:
+		raise RunFailed('n/a')
+
+	return {
+		'user': rusage.ru_utime,
+		'sys': rusage.ru_stime,
+		'cpu': rusage.ru_utime + rusage.ru_stime,
+		'wall': t2 - t1,
+		'maxrss': rusage.ru_maxrss  # kB on Linux
+	}
+
+def median(values):
+	tmp = sorted(values)
+	n = len(tmp)
+	if n == 0:
+		return None
+	if n & 1:
+		return tmp[n / 2]
+	return (tmp[n / 2 - 1] + tmp[n / 2]) / 2.0
+
+# Median absolute deviation (unscaled).
+def mad(values):
+	med = median(values)
+	return median([ abs(x - med) for x in values ])
+
+def binomialCdf(k, n):
+	# P(X <= k) for X ~ Binomial(n, 0.5).
+	res = 0.0
+	for i in xrange(k + 1):
+		res += math.exp(math.lgamma(n + 1) - math.lgamma(i + 1) - math.lgamma(n - i + 1) - n * math.log(2.0))
+	return res
+
+# Distribution free confidence interval for the median: the interval
+# between order statistics x_(k) and x_(n-k+1) where k is the largest value
+# for which P(X < k) <= (1 - level) / 2, X ~ Binomial(n, 0.5).  Returns None
+# if there are too few samples for the requested level.
+def medianCi(values, level):
+	tmp = sorted(values)
+	n = len(tmp)
+	alpha = (1.0 - level) / 2.0
+	k = 0
+	while k + 1 <= n / 2 and binomialCdf(k, n) <= alpha:
+		k += 1
+	if k == 0:
+		return None
+	return (tmp[k - 1], tmp[n - k])
+
+def computeStats(values, level):
+	n = len(values)
+	res = {
+		'count': n,
+		'min': min(values),
+		'max': max(values),
+		'mean': sum(values) / float(n),
+		'median': median(values),
+		'mad': mad(values),
+		'ci_level': level,
+		'ci_low': None,
+		'ci_high': None,
+		'ci_rel': None,
+		'outliers': 0
+	}
+	if n >= 2:
+		res['stdev'] = math.sqrt(sum([ (x - res['mean']) ** 2 for x in values ]) / float(n - 1))
+	else:
+		res['stdev'] = None
+
+	ci = medianCi(values, level)
+	if ci is not None:
+		res['ci_low'], res['ci_high'] = ci
+		if res['median'] > 0:
+			res['ci_rel'] = (ci[1] - ci[0]) / 2.0 / res['median']
+
+	limit = OUTLIER_MADS * 1.4826 * res['mad']
+	if limit > 0:
+		res['outliers'] = len([ x for x in values if abs(x - res['median']) > limit ])
 
-	time_min = None
-	time_max = None
-	time_sum = 0.0
-	time_list = []
+	return res
 
-	if opts.verbose:
+# Run a command repeatedly and return a list of measurement dicts for the
+# non-warmup runs.  Raises RunFailed if a run fails.  A custom 'runner'
+# (same interface as runOnce()) can add measurements, e.g. perf counters.
+def measure(args, metric='user', count=3, max_count=None, warmup=0, target_ci=0.01,
+            ci_level=0.95, sleep=0.0, sleep_factor=0.0, rerun_limit=30, verbose=False,
+            runner=runOnce):
+	if max_count is None or max_count < count:
+		max_count = count
+
+	samples = []
+
+	if verbose:
 		sys.stderr.write('Running:')
 		sys.stderr.flush()
 
-	for i in xrange(opts.count):
-		time.sleep(opts.sleep)
-
-		cmd = [
-			'time',
-			'-f', '%U',
-			'--quiet'
-		]
-		cmd = cmd + args
-		#print(repr(cmd))
-		p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-		stdout, stderr = p.communicate()
-		retval = p.wait()
-		#print(i, retval, stdout, stderr)
-
-		if retval == 139:
-			print 'segv'
-			sys.exit(1)
-		elif retval != 0:
-			print 'n/a'
-			sys.exit(1)
-
-		time_this = float(stderr)
-		#print(i, time_this)
-
-		if time_min is None:
-			time_min = time_this
-		else:
-			time_min = min(time_min, time_this)
-		if time_max is None:
-			time_max = time_this
-		else:
-			time_max = max(time_max, time_this)
-		time_sum += time_this
-
-		if opts.verbose:
-			sys.stderr.write(' %f' % time_this)
+	i = 0
+	while True:
+		is_warmup = (i < warmup)
+		measured = i - warmup
+		if not is_warmup:
+			if measured >= max_count:
+				break
+			if measured >= count and len(samples) > 0:
+				ci_rel = computeStats([ s[metric] for s in samples ], ci_level)['ci_rel']
+				if ci_rel is not None and ci_rel <= target_ci:
+					break
+		i += 1
+
+		time.sleep(sleep)
+
+		res = runner(args)
+		time_this = res[metric]
+
+		if verbose:
+			if is_warmup:
+				sys.stderr.write(' (%f)' % time_this)
+			else:
+				sys.stderr.write(' %f' % time_this)
 			sys.stderr.flush()
 
-		time_list.append(time_this)
+		if not is_warmup:
+			samples.append(res)
 
 		# Sleep time dependent on test time is useful for thermal throttling.
-		time.sleep(opts.sleep_factor * time_this)
+		time.sleep(sleep_factor * time_this)
 
 		# If run takes too long, there's no point in trying to get an accurate
 		# estimate.
-		if time_this >= opts.rerun_limit:
+		if time_this >= rerun_limit and not is_warmup:
 			break
 
-	if opts.verbose:
+	if verbose:
 		sys.stderr.write('\n')
 		sys.stderr.flush()
 
-	time_avg = time_sum / float(len(time_list))
+	return samples
+
+def main():
+	parser = optparse.OptionParser()
+	parser.disable_interspersed_args()  # options after command belong to the command
+	parser.add_option('--count', type='int', dest='count', default=3, help='Number of measured runs (minimum number if --max-count is larger)')
+	parser.add_option('--max-count', type='int', dest='max_count', default=None, help='Maximum number of measured runs, repeat until --target-ci is reached')
+	parser.add_option('--target-ci', type='float', dest='target_ci', default=0.01, help='Target confidence interval half width relative to median (default 0.01)')
+	parser.add_option('--ci-level', type='float', dest='ci_level', default=0.95, help='Confidence level (default 0.95)')
+	parser.add_option('--warmup', type='int', dest='warmup', default=0, help='Number of warmup runs, not included in statistics')
+	parser.add_option('--metric', dest='metric', default='user', help='Time to report: user, sys, cpu (user+sys), wall (default user)')
+	parser.add_option('--mode', dest='mode', default='min')
+	parser.add_option('--sleep', type='float', dest='sleep', default=0.0)
+	parser.add_option('--sleep-factor', type='float', dest='sleep_factor', default=0.0)
+	parser.add_option('--rerun-limit', type='int', dest='rerun_limit', default=30)
+	parser.add_option('--verbose', action='store_true', dest='verbose', default=False)
+	(opts, args) = parser.parse_args()
+
+	if opts.metric not in [ 'user', 'sys', 'cpu', 'wall' ]:
+		print('invalid metric: %r' % opts.metric)
+		sys.exit(1)
+
+	try:
+		samples = measure(args, metric=opts.metric, count=opts.count, max_count=opts.max_count,
+		                  warmup=opts.warmup, target_ci=opts.target_ci, ci_level=opts.ci_level,
+		                  sleep=opts.sleep, sleep_factor=opts.sleep_factor,
+		                  rerun_limit=opts.rerun_limit, verbose=opts.verbose)
+	except RunFailed as e:
+		print(str(e))
+		sys.exit(1)
+
+	if len(samples) == 0:
+		print('n/a')
+		sys.exit(1)
+
+	time_list = [ s[opts.metric] for s in samples ]
+	st = computeStats(time_list, opts.ci_level)
 
-	# /usr/bin/time has only two digits of resolution
 	if opts.mode == 'min':
-		print('%.02f' % time_min)
+		print('%.02f' % st['min'])
 	elif opts.mode == 'max':
-		print('%.02f' % time_max)
+		print('%.02f' % st['max'])
 	elif opts.mode == 'avg':
-		print('%.02f' % time_avg)
+		print('%.02f' % st['mean'])
+	elif opts.mode == 'median':
+		print('%.02f' % st['median'])
 	elif opts.mode == 'all':
-		print('min=%.02f, max=%.02f, avg=%0.2f, count=%d: %r' % \
-		      (time_min, time_max, time_avg, len(time_list), time_list))
+		ci = 'n/a'
+		if st['ci_low'] is not None:
+			ci = '%.04f-%.04f (+/- %.02f%%)' % (st['ci_low'], st['ci_high'], st['ci_rel'] * 100.0)
+		print('min=%.04f, max=%.04f, avg=%.04f, median=%.04f, mad=%.04f, ci=%s, outliers=%d, maxrss=%dkB, count=%d: %r' % \
+		      (st['min'], st['max'], st['mean'], st['median'], st['mad'], ci, st['outliers'],
+		       max([ s['maxrss'] for s in samples ]), len(time_list), time_list))
+	elif opts.mode == 'json':
+		doc = {
+			'command': args,
+			'metric': opts.metric,
+			'warmup': opts.warmup,
+			'stats': st,
+			'maxrss': max([ s['maxrss'] for s in samples ]),
+			'samples': {}
+		}
+		for k in [ 'user', 'sys', 'cpu', 'wall', 'maxrss' ]:
+			doc['samples'][k] = [ s[k] for s in samples ]
+			if k != opts.metric:
+				doc['stats_' + k] = computeStats(doc['samples'][k], opts.ci_level)
+		print(json.dumps(doc, indent=4, sort_keys=True))
 	else:
 		print('invalid mode: %r' % opts.mode)
 